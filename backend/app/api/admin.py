@@ -2,12 +2,18 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
-from app.db import get_db
+from app.db import get_db, get_pool_stats
 from app.api.deps import require_admin
 from app.models.user import User
 
 from sqlalchemy import func
 from app.models.knowledge import KnowledgeDoc
+from app.api import auth
+from app.services import answer_cache, principal_cache, token_budget, token_revocation
+from app.services.auth_service import get_password_hash_stats
+from app.services.ingest_service import get_ingest_stats
+from app.services.knowledge_service import get_context_cache_stats, get_snapshot
+from app.services.retrievers import search_status
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -27,16 +33,39 @@ def system_status(
     # ナレッジ文書数
     knowledge_count = db.query(func.count(KnowledgeDoc.id)).scalar()
 
+    # ナレッジ検索（KNOWLEDGE_RETRIEVER）の状態
+    snap = get_snapshot()
+    search = search_status(snap)
+
     return {
         "ok": True,
         "services": {
             "llm": "ok",
-            "vector_store": "ok",
+            "vector_store": search["status"],
         },
         "stats": {
             "users": user_count,
             "knowledge_docs": knowledge_count,
         },
+        "knowledge_search": {
+            **search,
+            "version": snap.version,
+            "chunks": sum(len(seg.chunk_starts) for seg in snap.segments),
+            "cache": get_context_cache_stats(),
+        },
+        "ingest": get_ingest_stats(db),
+        "db_pool": get_pool_stats(),
+        "answer_cache": answer_cache.get_stats(),
+        "prompt_tokens": token_budget.get_stats(),
+        "principal_cache": principal_cache.get_stats(),
+        "token_revocation": token_revocation.get_stats(),
+        "password_hash": {
+            **get_password_hash_stats(),
+            "login_rate_limit": {
+                "ip": auth.ip_limiter.get_stats(),
+                "account": auth.account_limiter.get_stats(),
+            },
+        },
     }
 
 
@@ -73,6 +102,8 @@ def set_user_active(
 
     u.is_active = bool(active)
     db.commit()
+    # ログイン中のユーザーのキャッシュを捨てる（次のリクエストから反映、他のプロセスにも知らせる）
+    principal_cache.invalidate_user(u.email, db, u.id)
     return {"ok": True}
 
 
@@ -91,4 +122,6 @@ def make_admin(
 
     u.role = "admin"
     db.commit()
+    # ログイン中のユーザーのキャッシュを捨てる（次のリクエストから反映、他のプロセスにも知らせる）
+    principal_cache.invalidate_user(u.email, db, u.id)
     return {"ok": True}
@@ -1,23 +1,46 @@
 # backend/app/api/admin_knowledge.py
-# 管理者向け：ナレッジ文書の追加/一覧/削除/再読み込み
+# 管理者向け：ナレッジ文書の追加（1 件 / 一括）/一覧/削除/再読み込み
 
 from __future__ import annotations
 
-from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import BinaryIO, List, Optional
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile, status
+from sqlalchemy.orm import Session, load_only
 
 from app.db import get_db
 from app.api.deps import require_admin
-from app.models.knowledge import KnowledgeDoc
-from app.services.knowledge_service import reload_knowledge_cache
+from app.models.knowledge import KnowledgeDoc, KnowledgeDocPart
+from app.services.bulk_import import import_docs, iter_entries, run_upload
+from app.services.extractors import supported_extensions
+from app.services.ingest_service import cancel_doc_jobs
+from app.services.knowledge_service import (
+  reload_knowledge_cache,
+  remove_knowledge_doc,
+)
 
 router = APIRouter(prefix="/admin/knowledge", tags=["admin-knowledge"])
 
-ALLOWED_EXT = {".txt", ".md", ".markdown"}
+# テキスト + PDF / DOCX / HTML（テキストは取り込み時に別プロセスで取り出す）
+ALLOWED_EXT = supported_extensions()
+
+# 一覧・確認で読むカラム（本文 content は大きいので読まない）
+_META_COLUMNS = (
+  KnowledgeDoc.id,
+  KnowledgeDoc.original_name,
+  KnowledgeDoc.stored_name,
+  KnowledgeDoc.size,
+  KnowledgeDoc.content_type,
+  KnowledgeDoc.status,
+  KnowledgeDoc.chunk_count,
+  KnowledgeDoc.error_message,
+  KnowledgeDoc.created_at,
+)
+
+# 一覧の 1 ページの件数（既定 / 上限）
+LIST_PAGE_SIZE = 100
+LIST_PAGE_MAX = 500
 
 
 def _safe_filename(name: str) -> str:
@@ -26,16 +49,29 @@ def _safe_filename(name: str) -> str:
 
 
 @router.get("", response_model=List[dict])
-def list_docs(_: dict = Depends(require_admin), db: Session = Depends(get_db)):
+def list_docs(
+  response: Response,
+  limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_PAGE_MAX),
+  cursor: Optional[int] = Query(None, description="前のページの X-Next-Cursor"),
+  _: dict = Depends(require_admin),
+  db: Session = Depends(get_db),
+):
   """
-  アップロード済み文書一覧（DB 管理分）
+  アップロード済み文書一覧（DB 管理分、新しい順）
+  - 取り込み中・失敗した文書も status / error_message 付きで返す
+  - 本文は読まない（一覧に必要なカラムだけ）
+  - キーセットページング：続きがあればレスポンスヘッダ X-Next-Cursor を
+    次のリクエストの cursor に渡す（OFFSET を使わないので、後ろのページでも速い）
   """
-  docs = (
-    db.query(KnowledgeDoc)
-    .filter(KnowledgeDoc.status == "active")
-    .order_by(KnowledgeDoc.created_at.desc())
-    .all()
-  )
+  q = db.query(KnowledgeDoc).options(load_only(*_META_COLUMNS))
+  if cursor is not None:
+    q = q.filter(KnowledgeDoc.id < cursor)
+  docs = q.order_by(KnowledgeDoc.id.desc()).limit(limit + 1).all()
+
+  if len(docs) > limit:
+    docs = docs[:limit]
+    response.headers["X-Next-Cursor"] = str(docs[-1].id)
+
   return [
     {
       "id": d.id,
@@ -43,6 +79,9 @@ def list_docs(_: dict = Depends(require_admin), db: Session = Depends(get_db)):
       "stored_name": d.stored_name,  # 互換のため残しているだけ
       "size": d.size,
       "content_type": d.content_type,
+      "status": d.status,
+      "chunk_count": d.chunk_count,
+      "error_message": d.error_message,
       "created_at": d.created_at.isoformat() if d.created_at else None,
     }
     for d in docs
@@ -56,7 +95,13 @@ async def upload_doc(
   file: UploadFile = File(...),
 ):
   """
-  文書アップロード → テキスト抽出 → DB 保存 → ナレッジ再読み込み
+  文書アップロード → テキスト抽出（PDF / DOCX / HTML は別プロセス） → DB 保存 → 取り込みジョブを登録してすぐ返す
+  - チャンク分割・インデックス作成・ナレッジへの反映はワーカーが行う
+  - 進み具合は一覧の status（pending / indexing / ready / error）で確認する
+  - 同じ内容の文書が既にあれば登録しない（duplicate: true）
+  - 同じ名前の文書があれば差し替える（replaced: true、変わったチャンクだけ埋め込み直す）
+  - 大きいファイルは丸ごと読まず、少しずつ UTF-8 に変換しながら DB に書き込む
+    （ファイルの読み込み・取り出しの待ちがあるので、取り込み専用のスレッドで動かす：run_upload）
   """
   if not file.filename:
     raise HTTPException(status_code=400, detail="ファイル名がありません。")
@@ -70,37 +115,66 @@ async def upload_doc(
       detail=f"未対応形式です: {ext}（対応: {', '.join(sorted(ALLOWED_EXT))}）",
     )
 
-  raw = await file.read()
-  if not raw:
-    raise HTTPException(status_code=400, detail="空ファイルはアップロードできません。")
-  if len(raw) > 2 * 1024 * 1024:
-    raise HTTPException(status_code=400, detail="ファイルが大きすぎます（上限2MB）。")
-
-  # テキストに変換（UTF-8 基本、失敗したら errors='ignore'）
-  try:
-    text = raw.decode("utf-8")
-  except UnicodeDecodeError:
-    text = raw.decode("utf-8", errors="ignore")
-
-  doc = KnowledgeDoc(
-    original_name=original_name,
-    stored_name=None,  # 物理ファイルは保存しない
-    size=len(raw),
-    content_type=file.content_type or "text/plain",
-    content=text,
-    status="active",
-    created_at=datetime.utcnow(),
-  )
-  db.add(doc)
-  db.commit()
-  db.refresh(doc)
+  return await run_upload(_upload_doc, db, file.file, original_name)
 
-  reload_knowledge_cache(db=db)
+
+def _upload_doc(db: Session, f: BinaryIO, original_name: str) -> dict:
+  # 同じ内容の文書があれば登録しない / 同じ名前の文書があれば差し替える
+  result = import_docs(db, iter_entries(original_name, f, ALLOWED_EXT))
+  if result["skipped"]:
+    raise HTTPException(status_code=400, detail=f"{result['skipped'][0]['reason']}。")
+
+  if result["duplicates"]:
+    dup_id = result["duplicates"][0]["id"]
+    doc = db.get(KnowledgeDoc, dup_id, options=[load_only(*_META_COLUMNS)]) if dup_id else None
+    return {
+      "ok": True,
+      "id": dup_id,
+      "original_name": doc.original_name if doc else original_name,
+      "status": doc.status if doc else None,
+      "duplicate": True,
+    }
+
+  saved = (result["added"] or result["updated"])[0]
+  doc = db.get(KnowledgeDoc, saved["id"], options=[load_only(*_META_COLUMNS)])
 
   return {
     "ok": True,
     "id": doc.id,
     "original_name": doc.original_name,
+    "status": doc.status,
+    "job_id": result["job_ids"][0],
+    "replaced": bool(result["updated"]),
+  }
+
+
+@router.post("/upload/bulk", status_code=200)
+async def upload_docs_bulk(
+  _: dict = Depends(require_admin),
+  db: Session = Depends(get_db),
+  files: List[UploadFile] = File(...),
+):
+  """
+  複数ファイル / zip・tar アーカイブの一括アップロード → DB 保存 → 取り込みジョブをまとめて登録
+  - アーカイブは丸ごと読まず、中のファイルを 1 つずつ読む
+  - 同じ内容の文書は登録しない（duplicates）、同じ名前の文書は差し替える（updated）
+  - 未対応形式・大きすぎるものは skipped
+  - インデックスの更新は取り込みの最後に 1 回（ワーカーがまとめて処理する）
+  - アーカイブの展開・取り出しは重いので、取り込み専用のスレッドで動かす（run_upload）
+  """
+  def entries():
+    for f in files:
+      for entry in iter_entries(f.filename or "", f.file, ALLOWED_EXT):
+        yield entry._replace(name=_safe_filename(entry.name))
+
+  result = await run_upload(import_docs, db, entries())
+  return {
+    "ok": True,
+    "added": result["added"],
+    "updated": result["updated"],
+    "duplicates": result["duplicates"],
+    "skipped": result["skipped"],
+    "job_count": len(result["job_ids"]),
   }
 
 
@@ -111,19 +185,25 @@ def delete_doc(
   db: Session = Depends(get_db),
 ):
   """
-  文書削除 → DB から削除 → ナレッジ再読み込み
+  文書削除 → DB から削除 → ナレッジから外す（この文書だけ）
   """
   doc: Optional[KnowledgeDoc] = (
-    db.query(KnowledgeDoc).filter(KnowledgeDoc.id == doc_id).first()
+    db.query(KnowledgeDoc)
+    .options(load_only(KnowledgeDoc.id))
+    .filter(KnowledgeDoc.id == doc_id)
+    .first()
   )
   if not doc:
     raise HTTPException(status_code=404, detail="対象文書が見つかりません。")
 
-  # 物理ファイルは使っていないので、DB 削除だけ
+  # 物理ファイルは使っていないので、DB 削除だけ（長い文書の本文の続きも）
+  db.query(KnowledgeDocPart).filter(KnowledgeDocPart.doc_id == doc_id).delete()
   db.delete(doc)
+  # まだ始まっていない取り込みジョブは取り消す
+  cancel_doc_jobs(db, doc_id)
   db.commit()
 
-  reload_knowledge_cache(db=db)
+  remove_knowledge_doc(doc_id, db=db)
 
   return {"ok": True}
 
@@ -131,7 +211,8 @@ def delete_doc(
 @router.post("/reload", status_code=200)
 def reload_docs(_: dict = Depends(require_admin), db: Session = Depends(get_db)):
   """
-  手動でナレッジ再読み込み
+  手動でナレッジ再読み込み（全件、文書単位の反映がずれたときの保険）
+  - 他のワーカーにも全件読み込みさせる
   """
-  reload_knowledge_cache(db=db)
+  reload_knowledge_cache(db=db, publish=True)
   return {"ok": True}
@@ -4,6 +4,7 @@
 from __future__ import annotations
 
 from fastapi import APIRouter, Depends
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from app.api.deps import require_admin
@@ -19,8 +20,9 @@ def system_status(_: dict = Depends(require_admin), db: Session = Depends(get_db
     """
     システム状態（最小）
     """
-    user_count = db.query(User).count()
-    doc_count = db.query(KnowledgeDoc).count()
+    # 件数だけ数える（query(...).count() は全カラムのサブクエリになる）
+    user_count = db.query(func.count(User.id)).scalar()
+    doc_count = db.query(func.count(KnowledgeDoc.id)).scalar()
 
     return {
         "ok": True,
@@ -11,6 +11,7 @@ from sqlalchemy.orm import Session
 from app.db import get_db
 from app.api.deps import require_admin
 from app.models.user import User
+from app.services.principal_cache import invalidate_user
 
 router = APIRouter(prefix="/admin/users", tags=["admin-users"])
 
@@ -67,6 +68,8 @@ def update_role(
     u.role = payload.role
     db.commit()
     db.refresh(u)
+    # ログイン中のユーザーのキャッシュを捨てる（次のリクエストから反映、他のプロセスにも知らせる）
+    invalidate_user(u.email, db, u.id)
 
     return UserItem(
         id=u.id,
@@ -99,6 +102,8 @@ def update_active(
     u.is_active = bool(payload.is_active)
     db.commit()
     db.refresh(u)
+    # ログイン中のユーザーのキャッシュを捨てる（次のリクエストから反映、他のプロセスにも知らせる）
+    invalidate_user(u.email, db, u.id)
 
     return UserItem(
         id=u.id,
@@ -1,20 +1,231 @@
-from fastapi import APIRouter
+import json
+from typing import List, Optional
 
-from app.models.schemas import AskRequest, AskResponse
-from app.services.llm_service import ask_llm
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from app.api.deps import get_current_user
+from app.models.schemas import (
+    AskRequest,
+    AskResponse,
+    ConversationAskRequest,
+    ConversationAskResponse,
+    ConversationMessageOut,
+    ConversationOut,
+)
+from app.services.conversation_service import (
+    append_turn,
+    compact_conversation,
+    delete_conversation,
+    get_or_create_conversation,
+    list_conversations,
+    list_messages,
+    load_history,
+)
+from app.services.llm_service import (
+    StreamStatus,
+    ask_llm_async,
+    ask_llm_result_async,
+    get_cached_answer,
+    retrieve_context_async,
+    stream_llm_async,
+)
+from app.services.principal_cache import Principal
 
 
 router = APIRouter(prefix="/api", tags=["ask"])
 
 
+async def _single(text: str):
+    yield text
+
+
 @router.post("/ask", response_model=AskResponse)
-def ask(request: AskRequest):
+async def ask(request: AskRequest):
     history = [msg.dict() for msg in request.history]
 
-    answer = ask_llm(
+    answer = await ask_llm_async(
         question=request.question,
         subject=request.subject,
         history=history,
     )
 
     return AskResponse(answer=answer)
+
+
+@router.post("/ask/stream")
+async def ask_stream(request: AskRequest):
+    """
+    回答を Server-Sent Events で逐次返す
+    - data: {"delta": "..."} を受け取った順に連結すると回答全文になる
+    - 最後に data: [DONE] を送る
+    """
+    history = [msg.dict() for msg in request.history]
+
+    # キャッシュ済みの回答があれば 1 イベントでまとめて返す
+    cached = get_cached_answer(request.question, request.subject, history)
+
+    # ナレッジ検索はレスポンスを返し始める前に済ませておく
+    context = "" if cached is not None else await retrieve_context_async(request.question)
+
+    async def event_stream():
+        if cached is not None:
+            deltas = _single(cached)
+        else:
+            deltas = stream_llm_async(
+                question=request.question,
+                subject=request.subject,
+                history=history,
+                context=context,
+            )
+        async for delta in deltas:
+            payload = json.dumps({"delta": delta}, ensure_ascii=False)
+            yield f"data: {payload}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return _sse_response(event_stream())
+
+
+def _sse_response(body, background: Optional[BackgroundTask] = None) -> StreamingResponse:
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # リバースプロキシでのバッファリングを止める
+        },
+        background=background,
+    )
+
+
+# ========== 会話（履歴はサーバー側に保存） ==========
+
+async def _open_conversation(user: Principal, request: ConversationAskRequest) -> int:
+    conversation_id = await run_in_threadpool(
+        get_or_create_conversation, user.id, request.conversation_id, request.question
+    )
+    if conversation_id is None:
+        raise HTTPException(status_code=404, detail="会話が見つかりません")
+    return conversation_id
+
+
+@router.post("/conversations/ask", response_model=ConversationAskResponse)
+async def conversation_ask(
+    request: ConversationAskRequest,
+    background_tasks: BackgroundTasks,
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    会話の続きとして質問する（conversation_id が無ければ新しい会話を作る）
+    - 履歴はサーバー側から末尾（と古いやり取りの要約）だけを読む
+    - 質問と回答を保存し、履歴が予算を超えたら返した後で要約に畳む
+    - Groq の呼び出しに失敗したときは保存せず 502 を返す
+    """
+    conversation_id = await _open_conversation(current_user, request)
+    history = await run_in_threadpool(load_history, conversation_id)
+
+    answer, ok = await ask_llm_result_async(
+        question=request.question,
+        subject=request.subject,
+        history=history,
+    )
+    if not ok:
+        raise HTTPException(status_code=502, detail=answer)
+
+    if await run_in_threadpool(append_turn, conversation_id, request.question, answer):
+        background_tasks.add_task(compact_conversation, conversation_id)
+    return ConversationAskResponse(conversation_id=conversation_id, answer=answer)
+
+
+@router.post("/conversations/ask/stream")
+async def conversation_ask_stream(
+    request: ConversationAskRequest,
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    /conversations/ask の Server-Sent Events 版
+    - 最初に data: {"conversation_id": ...} を送り、続けて /ask/stream と同じ形で回答を送る
+    - 回答を最後まで受け取れたときだけ保存する
+    - Groq の呼び出しに失敗した・途中で切れたときは data: {"error": "..."} を送り、保存しない
+    """
+    conversation_id = await _open_conversation(current_user, request)
+    history = await run_in_threadpool(load_history, conversation_id)
+
+    cached = get_cached_answer(request.question, request.subject, history)
+    context = "" if cached is not None else await retrieve_context_async(request.question)
+    needs_compaction = False
+
+    async def event_stream():
+        nonlocal needs_compaction
+        yield f"data: {json.dumps({'conversation_id': conversation_id})}\n\n"
+        status = StreamStatus()
+        if cached is not None:
+            deltas = _single(cached)
+        else:
+            deltas = stream_llm_async(
+                question=request.question,
+                subject=request.subject,
+                history=history,
+                context=context,
+                status=status,
+            )
+        parts: List[str] = []
+        async for delta in deltas:
+            if status.error is not None:
+                # エラーの文言は回答ではないので、error として送り保存しない
+                break
+            parts.append(delta)
+            payload = json.dumps({"delta": delta}, ensure_ascii=False)
+            yield f"data: {payload}\n\n"
+        if status.error is not None:
+            payload = json.dumps({"error": status.error}, ensure_ascii=False)
+            yield f"data: {payload}\n\n"
+        else:
+            needs_compaction = await run_in_threadpool(
+                append_turn, conversation_id, request.question, "".join(parts)
+            )
+        yield "data: [DONE]\n\n"
+
+    async def after_stream():
+        if needs_compaction:
+            await compact_conversation(conversation_id)
+
+    return _sse_response(event_stream(), background=BackgroundTask(after_stream))
+
+
+@router.get("/conversations", response_model=List[ConversationOut])
+async def conversations(
+    limit: int = Query(50, ge=1, le=200),
+    current_user: Principal = Depends(get_current_user),
+):
+    """自分の会話の一覧（新しく更新された順）"""
+    return await run_in_threadpool(list_conversations, current_user.id, limit)
+
+
+@router.get("/conversations/{conversation_id}/messages", response_model=List[ConversationMessageOut])
+async def conversation_messages(
+    conversation_id: int,
+    before: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    会話のメッセージ（古い順）
+    - before にいちばん古いメッセージの id を渡すと、それより前を読む（さかのぼって表示）
+    """
+    rows = await run_in_threadpool(list_messages, current_user.id, conversation_id, before, limit)
+    if rows is None:
+        raise HTTPException(status_code=404, detail="会話が見つかりません")
+    return rows
+
+
+@router.delete("/conversations/{conversation_id}")
+async def remove_conversation(
+    conversation_id: int,
+    current_user: Principal = Depends(get_current_user),
+):
+    if not await run_in_threadpool(delete_conversation, current_user.id, conversation_id):
+        raise HTTPException(status_code=404, detail="会話が見つかりません")
+    return {"ok": True}
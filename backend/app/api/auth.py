@@ -1,24 +1,85 @@
 # backend/app/api/auth.py
-from fastapi import APIRouter, Depends, HTTPException, status
+import math
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from app.db import get_db
 from app.models.user import User
 from app.services.auth_service import (
-    create_user,
-    authenticate_user,
-    create_access_token,
-    verify_password,
-    get_password_hash,
+    create_user_async,
+    authenticate_user_async,
+    decode_token,
+    issue_tokens,
+    revoke_access_token,
+    revoke_refresh_token,
+    revoke_user_tokens,
+    rotate_refresh_token,
+    verify_password_async,
+    hash_password_async,
+    PasswordHashBusyError,
     PasswordTooLongError,
 )
+from app.services.rate_limit import RateLimiter
 
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, oauth2_scheme
+from app.services.principal_cache import Principal
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+# 登录/注册/刷新令牌的次数限制（令牌桶：LIMIT 次 / WINDOW 秒，0 表示不限制）
+# - 按 IP：同一教室的学生常常共用一个出口 IP，所以放宽（刷新令牌也算在内）
+# - 按账号：登录成功后清零
+LOGIN_IP_LIMIT = int(os.getenv("LOGIN_IP_LIMIT", "120"))
+LOGIN_IP_WINDOW = float(os.getenv("LOGIN_IP_WINDOW", "60"))
+LOGIN_ACCOUNT_LIMIT = int(os.getenv("LOGIN_ACCOUNT_LIMIT", "10"))
+LOGIN_ACCOUNT_WINDOW = float(os.getenv("LOGIN_ACCOUNT_WINDOW", "300"))
+
+# 前面的反向代理的层数（每层在 X-Forwarded-For 末尾追加一个地址）
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", "1"))
+
+ip_limiter = RateLimiter(LOGIN_IP_LIMIT, LOGIN_IP_WINDOW)
+account_limiter = RateLimiter(LOGIN_ACCOUNT_LIMIT, LOGIN_ACCOUNT_WINDOW)
+
+
+def _client_ip(request: Request) -> str:
+    """
+    客户端 IP（用于按 IP 限制次数）
+    - X-Forwarded-For 的前面几项是客户端自己可以随便填的，不能用
+    - 取最右边 TRUSTED_PROXY_COUNT 个代理中最外层那个追加的地址（Render 等前面有 1 层代理 → 最后一项）
+    - TRUSTED_PROXY_COUNT=0（没有反向代理）时只用连接的对端地址
+    """
+    if TRUSTED_PROXY_COUNT > 0:
+        forwarded = [ip.strip() for ip in request.headers.get("x-forwarded-for", "").split(",") if ip.strip()]
+        if forwarded:
+            return forwarded[-min(TRUSTED_PROXY_COUNT, len(forwarded))]
+    return request.client.host if request.client else "unknown"
+
+
+def _admit(limiter: RateLimiter, key: str) -> None:
+    """超过次数限制 → 429（Retry-After 秒后再试）"""
+    retry_after = limiter.hit(key)
+    if retry_after > 0:
+        seconds = max(1, math.ceil(retry_after))
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"試行回数が多すぎます。{seconds} 秒後にもう一度お試しください。",
+            headers={"Retry-After": str(seconds)},
+        )
+
+
+def _busy(e: PasswordHashBusyError) -> HTTPException:
+    """密码哈希的队列已满 → 503（马上拒绝，不占用线程）"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={"Retry-After": "1"},
+    )
+
 
 # ========= Pydantic 模型 =========
 
@@ -31,6 +92,15 @@ class RegisterRequest(BaseModel):
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    # 访问令牌过期后，用它调用 /auth/refresh 换新的（每次都会换成新的刷新令牌）
+    refresh_token: str | None = None
+    expires_in: int | None = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: str | None = None
 
 class MeResponse(BaseModel):
     id: int
@@ -42,17 +112,21 @@ class MeResponse(BaseModel):
 # ========= 接口实现 =========
 
 @router.post("/register")
-def register(payload: RegisterRequest, db: Session = Depends(get_db)):
+async def register(payload: RegisterRequest, request: Request, db: Session = Depends(get_db)):
     """
     注册新用户
+    - bcrypt 在专用线程里计算（async 接口，不占用共享线程池）
     """
+    _admit(ip_limiter, _client_ip(request))
     try:
-        create_user(
+        await create_user_async(
             db=db,
             email=str(payload.email),
             password=payload.password,
             full_name=payload.full_name,
         )
+    except PasswordHashBusyError as e:
+        raise _busy(e)
     except PasswordTooLongError as e:
         # 密码太长 → 直接告诉用户
         raise HTTPException(
@@ -71,7 +145,8 @@ def register(payload: RegisterRequest, db: Session = Depends(get_db)):
 
 
 @router.post("/login", response_model=TokenResponse)
-def login(
+async def login(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db),
 ):
@@ -79,13 +154,19 @@ def login(
     OAuth2 标准登录（Swagger Authorize 会用这个）
     - Swagger 会提交 application/x-www-form-urlencoded
     - form_data.username 在这里就是“邮箱”
+    - 按 IP / 账号限制次数；bcrypt 在专用线程里计算，登录集中时也不影响 /api/ask
     """
     email = form_data.username
     password = form_data.password
 
+    _admit(ip_limiter, _client_ip(request))
+    _admit(account_limiter, email.strip().lower())
+
     # ✅ 在这里捕获 PasswordTooLongError
     try:
-        user = authenticate_user(db, email=email, password=password)
+        user = await authenticate_user_async(db, email=email, password=password)
+    except PasswordHashBusyError as e:
+        raise _busy(e)
     except PasswordTooLongError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -98,14 +179,51 @@ def login(
             detail="メールアドレスまたはパスワードが正しくありません。",
         )
 
-    # ✅ 保持原来 dict 形式的 create_access_token
-    token = create_access_token({"sub": user.email, "email": user.email})
+    account_limiter.reset(email.strip().lower())
 
-    return TokenResponse(access_token=token, token_type="bearer")
+    # 访问令牌（短期）+ 刷新令牌（只存哈希）
+    tokens = await run_in_threadpool(issue_tokens, db, user.id, user.email)
+
+    return TokenResponse(**tokens)
+
+
+@router.post("/refresh", response_model=TokenResponse)
+def refresh(payload: RefreshRequest, request: Request, db: Session = Depends(get_db)):
+    """
+    用刷新令牌换新的访问令牌（不需要密码，不计算 bcrypt）
+    - 刷新令牌只能用一次，响应里是新的刷新令牌
+    - 已用过的刷新令牌再次被使用时，视为被盗用，这次登录的令牌全部作废
+    - 和登录一样按 IP 限制次数（防止大量猜测刷新令牌）
+    """
+    _admit(ip_limiter, _client_ip(request))
+    tokens = rotate_refresh_token(db, payload.refresh_token)
+    if not tokens:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="リフレッシュトークンが無効です。もう一度ログインしてください。",
+        )
+    return TokenResponse(**tokens)
+
+
+@router.post("/logout")
+def logout(
+    payload: LogoutRequest,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db),
+):
+    """
+    注销：这次登录的刷新令牌作废，当前的访问令牌也加入吊销列表
+    """
+    claims = decode_token(token)
+    if claims:
+        revoke_access_token(db, claims)
+    if payload.refresh_token:
+        revoke_refresh_token(db, payload.refresh_token)
+    return {"ok": True}
 
 
 @router.get("/me", response_model=MeResponse)
-def me(current_user: User = Depends(get_current_user)):
+def me(current_user: Principal = Depends(get_current_user)):
     """
     ログイン中のユーザー情報を返す
     """
@@ -121,19 +239,39 @@ class ChangePasswordRequest(BaseModel):
     new_password: str
 
 @router.post("/change-password")
-def change_password(
+async def change_password(
     payload: ChangePasswordRequest,
+    token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
     """
     パスワード変更（本人のみ）
+    - current_user はキャッシュしたスナップショットなので、ユーザーは DB から読み直す
+    - 現在のパスワードの確認は、ログインと同じくアカウントごとに回数を制限する
+    - 変更したら、このログイン以外（他の端末）のトークンはすべて無効にする
     """
-    if not verify_password(payload.current_password, current_user.hashed_password):
-        raise HTTPException(status_code=400, detail="現在のパスワードが正しくありません")
+    user = await run_in_threadpool(db.get, User, current_user.id)
+    if not user:
+        raise HTTPException(status_code=401, detail="ユーザーが見つかりません。")
+
+    _admit(account_limiter, user.email.strip().lower())
+    try:
+        if not await verify_password_async(payload.current_password, user.hashed_password):
+            raise HTTPException(status_code=400, detail="現在のパスワードが正しくありません")
+        new_hash = await hash_password_async(payload.new_password)
+    except PasswordHashBusyError as e:
+        raise _busy(e)
+    except PasswordTooLongError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    account_limiter.reset(user.email.strip().lower())
+
+    def save() -> None:
+        user.hashed_password = new_hash
+        db.commit()
+        claims = decode_token(token) or {}
+        revoke_user_tokens(db, user.id, keep_family=claims.get("fid"))
 
-    current_user.hashed_password = get_password_hash(payload.new_password)
-    db.add(current_user)
-    db.commit()
+    await run_in_threadpool(save)
 
     return {"ok": True}
\ No newline at end of file
@@ -6,6 +6,8 @@ from jose import jwt, JWTError
 from app.db import get_db
 from app.models.user import User
 from app.services.auth_service import SECRET_KEY, ALGORITHM
+from app.services.principal_cache import Principal, get_principal, sync_invalidations
+from app.services.token_revocation import family_key, is_revoked, sync_revocations, token_key
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
@@ -13,9 +15,13 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
-) -> User:
+) -> Principal:
     """
     从 JWT 中解析当前用户（sub = email）
+    - 返回只读的用户快照（id / email / full_name / role / is_active），不是 ORM 对象
+    - 快照按 sub 缓存（principal_cache），命中时不查数据库；修改角色/停用时会立即失效
+    - 需要修改用户本身时，请用 current_user.id 重新从数据库读取
+    - 注销 / 修改密码 / 刷新令牌被盗用时吊销的令牌会被拒绝
     """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -32,17 +38,47 @@ def get_current_user(
             detail="Token 中缺少 sub",
         )
 
-    user = db.query(User).filter(User.email == email).first()
+    # 已注销 / 已吊销的令牌（内存中的吊销列表，每隔几秒从数据库同步一次新增部分）
+    sync_revocations(db)
+    jti, fid = payload.get("jti"), payload.get("fid")
+    if is_revoked(jti and token_key(jti), fid and family_key(fid)):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token 已失效",
+        )
+
+    # 其他进程修改了角色 / 停用的用户，丢弃缓存（每隔几秒从数据库同步一次新增部分）
+    sync_invalidations(db)
+
+    def load() -> Principal | None:
+        # 只取需要的列（不读密码哈希）
+        row = (
+            db.query(User.id, User.email, User.full_name, User.role, User.is_active)
+            .filter(User.email == email)
+            .first()
+        )
+        if not row:
+            return None
+        return Principal(row.id, row.email, row.full_name, row.role, bool(row.is_active))
+
+    user = get_principal(email, load)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="用户不存在",
         )
 
+    # 停用的用户即使 Token 未过期也不能继续使用
+    if not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="账号已停用",
+        )
+
     return user
 
 
-def require_admin(current_user: User = Depends(get_current_user)):
+def require_admin(current_user: Principal = Depends(get_current_user)):
     """
     管理员权限校验
     """
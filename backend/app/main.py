@@ -10,8 +10,17 @@ from app.api.admin_system import router as admin_system_router
 
 from app.db import Base, engine, get_db
 from app.models.user import User              # noqa: F401  モデル登録用
+from app.models.auth_token import RefreshToken  # noqa: F401  モデル登録用
+from app.models.conversation import Conversation  # noqa: F401  モデル登録用
 from app.models.knowledge import KnowledgeDoc  # noqa: F401  モデル登録用
-from app.services.knowledge_service import reload_knowledge_cache
+from app.services.extractors import shutdown_extractors
+from app.services.ingest_service import start_ingest_workers, stop_ingest_workers
+from app.services.knowledge_service import (
+    load_knowledge_cache,
+    start_knowledge_sync,
+    stop_knowledge_sync,
+)
+from app.services.llm_service import close_async_client
 
 app = FastAPI(title="AI Teacher API (DeepSeek)")
 
@@ -29,6 +38,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # ナレッジ一覧のページング
 )
 
 # ===== ルーター登録 =====
@@ -50,11 +60,29 @@ def on_startup():
     """
     アプリ起動時に呼ばれる処理：
     - テーブル作成（存在しない場合）
-    - ナレッジキャッシュの読み込み
+    - ナレッジキャッシュの読み込み（インデックスファイルがあれば mmap）
+    - 他ワーカーでのナレッジ変更を定期的に取り込むスレッドの起動
+    - アップロードされた文書の取り込みワーカーの起動
     """
     # テーブル作成（SQLite/PostgreSQL どちらでも OK）
     Base.metadata.create_all(bind=engine)
 
     # ナレッジをロード
     with next(get_db()) as db:
-        reload_knowledge_cache(db=db)
+        load_knowledge_cache(db=db)
+
+    start_knowledge_sync()
+    start_ingest_workers()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """
+    アプリ終了時に呼ばれる処理：
+    - LLM 呼び出し用の HTTP コネクションプールを閉じる
+    - ナレッジ同期スレッド・取り込みワーカー・テキスト取り出しプロセスの停止
+    """
+    stop_ingest_workers()
+    shutdown_extractors()
+    stop_knowledge_sync()
+    await close_async_client()
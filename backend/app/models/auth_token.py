@@ -0,0 +1,40 @@
+# backend/app/models/auth_token.py
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, String
+
+from app.db import Base
+
+
+class RefreshToken(Base):
+    """
+    リフレッシュトークン（本体は返すだけで保存しない。保存するのは sha256 だけ）
+    - 使うたびに新しいものに替える（revoked_at を入れ、replaced_by に次の id）
+    - 同じログインから続くものは family_id が同じ
+      （替えた後の古いトークンがまた使われたら盗まれたとみなし、family ごと無効にする）
+    """
+
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False, unique=True, index=True)
+    family_id = Column(String(32), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+    replaced_by = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class RevokedToken(Base):
+    """
+    無効にしたアクセストークン（jti）/ ログイン（family_id）
+    - アクセストークンの有効期限が過ぎたら要らないので、expires_at 以降は消してよい
+    - 各プロセスはここを読んでメモリ上の無効リスト（token_revocation.py）に入れる
+    """
+
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String(40), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
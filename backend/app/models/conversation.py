@@ -0,0 +1,44 @@
+# backend/app/models/conversation.py
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Index, Integer, String, Text
+
+from app.db import Base
+
+
+class Conversation(Base):
+    """
+    会話（ユーザーごと）
+    - 古いやり取りは summary にまとめ、summary_upto（その id までのメッセージ）は
+      プロンプトに入れない（読むのは summary_upto より後のメッセージだけ）
+    """
+
+    __tablename__ = "conversations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    title = Column(String(200), nullable=True)
+    summary = Column(Text, nullable=True)
+    summary_upto = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ConversationMessage(Base):
+    """
+    会話のメッセージ（role: user / assistant）
+    - tokens は保存時に見積もっておく（履歴を予算内に切るときに本文を数え直さない）
+    """
+
+    __tablename__ = "conversation_messages"
+    __table_args__ = (
+        # 会話ごとに新しい順で末尾だけ読む
+        Index("ix_conversation_messages_conv_id", "conversation_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(Integer, nullable=False)
+    role = Column(String(16), nullable=False)
+    content = Column(Text, nullable=False)
+    tokens = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -3,10 +3,26 @@ from __future__ import annotations
 
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, UniqueConstraint
 
 from app.db import Base
 
+# knowledge_docs.status
+# - pending: 取り込み待ち / indexing: 取り込み中 / ready: 検索対象 / error: 取り込みに失敗
+# - 以前の "active" は ready と同じ扱い
+DOC_PENDING = "pending"
+DOC_INDEXING = "indexing"
+DOC_READY = "ready"
+DOC_ERROR = "error"
+SEARCHABLE_STATUSES = (DOC_READY, "active")
+
+# knowledge_jobs.status
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+JOB_CANCELLED = "cancelled"  # 取り込む前に文書が削除された
+
 
 class KnowledgeDoc(Base):
   __tablename__ = "knowledge_docs"
@@ -24,10 +40,87 @@ class KnowledgeDoc(Base):
   content_type = Column(String, nullable=True)
 
   # ★ 実際のナレッジ本文（テキスト）を DB に保存
+  # - 長い文書は先頭だけをここに入れ、続きは knowledge_doc_parts に分けて保存する
   content = Column(Text, nullable=False)
 
-  # 将来用：active / deleted など
-  status = Column(String, nullable=False, default="active")
+  # knowledge_doc_parts に入っている続きの数（0 なら content が本文のすべて）
+  part_count = Column(Integer, nullable=False, default=0)
+
+  # 取り込みの状態（pending / indexing / ready / error、上の定数を参照）
+  status = Column(String, nullable=False, default=DOC_READY)
+
+  # 取り込み結果：チャンク数 / 失敗したときの理由
+  chunk_count = Column(Integer, nullable=False, default=0)
+  error_message = Column(Text, nullable=True)
+
+  # 本文（UTF-8）の sha256。同じ内容の文書は 1 件だけ（ユニークインデックス）
+  # - 以前からある文書は NULL のことがある（tools/migrate_knowledge_docs.py で埋める）
+  content_hash = Column(String(64), nullable=True, unique=True, index=True)
 
   created_at = Column(DateTime, default=datetime.utcnow)
   updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class KnowledgeDocPart(Base):
+  """
+  長い文書の本文の続き（アップロードを読みながら順に書き込む）
+  - 本文 = knowledge_docs.content + seq 順（1, 2, ...）の content
+  """
+  __tablename__ = "knowledge_doc_parts"
+  __table_args__ = (UniqueConstraint("doc_id", "seq", name="uq_knowledge_doc_parts_doc_seq"),)
+
+  id = Column(Integer, primary_key=True, index=True)
+
+  # 対象の knowledge_docs.id
+  doc_id = Column(Integer, nullable=False, index=True)
+  seq = Column(Integer, nullable=False)
+
+  content = Column(Text, nullable=False)
+
+
+class KnowledgeEvent(Base):
+  """
+  ナレッジの変更履歴（ワーカー間でキャッシュを揃えるため）
+  - id がそのままナレッジのバージョンになる
+  - 各ワーカーは自分が反映済みの id より大きいものだけを読んで反映する
+  """
+  __tablename__ = "knowledge_events"
+
+  id = Column(Integer, primary_key=True, index=True)
+
+  # upsert / delete / reload
+  op = Column(String, nullable=False)
+
+  # 対象の knowledge_docs.id（reload のときは NULL）
+  doc_id = Column(Integer, nullable=True)
+
+  created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class KnowledgeJob(Base):
+  """
+  ナレッジ取り込みのジョブ（ingest_service のワーカーが処理する）
+  - アップロードでは pending で登録するだけで、HTTP リクエストはすぐ返す
+  - ワーカーは pending → running を UPDATE で取り合うので、複数ワーカーでも 1 回だけ処理される
+  - 溜まっているジョブはまとめて取り、1 つのセグメントでまとめて反映する（一括取り込み）
+  """
+  __tablename__ = "knowledge_jobs"
+
+  id = Column(Integer, primary_key=True, index=True)
+
+  # 対象の knowledge_docs.id
+  doc_id = Column(Integer, nullable=False, index=True)
+
+  # pending / running / done / error / cancelled
+  status = Column(String, nullable=False, default=JOB_PENDING, index=True)
+
+  # 取ったワーカーの印（複数のジョブをまとめて取ったとき、自分の分を見分けるため）
+  claimed_by = Column(String(32), nullable=True)
+
+  # 処理を始めた回数（途中で落ちたワーカーの分も数える）
+  attempts = Column(Integer, nullable=False, default=0)
+  error_message = Column(Text, nullable=True)
+
+  created_at = Column(DateTime, default=datetime.utcnow)
+  started_at = Column(DateTime, nullable=True)
+  finished_at = Column(DateTime, nullable=True)
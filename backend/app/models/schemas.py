@@ -1,6 +1,6 @@
 # backend/app/models/schemas.py
 from datetime import datetime
-from typing import List, Literal
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel
 from pydantic import ConfigDict
@@ -23,6 +23,38 @@ class AskResponse(BaseModel):
     answer: str
 
 
+# ========== 会话（服务器端保存历史） ==========
+
+class ConversationAskRequest(BaseModel):
+    question: str
+    subject: str
+    # 为空时新建会话；之后只需传 conversation_id，不用再传历史
+    conversation_id: Optional[int] = None
+
+
+class ConversationAskResponse(BaseModel):
+    conversation_id: int
+    answer: str
+
+
+class ConversationOut(BaseModel):
+    id: int
+    title: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ConversationMessageOut(BaseModel):
+    id: int
+    role: Literal["user", "assistant"]
+    content: str
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 # ========== 用户 / 登录相关 ==========
 
 class UserBase(BaseModel):
@@ -20,3 +20,17 @@ class User(Base):
 
     # ✅ 有効/無効（ユーザー停止用）
     is_active = Column(Boolean, nullable=False, default=True)
+
+
+class UserInvalidation(Base):
+    """
+    ユーザーの権限・状態を変えた知らせ（principal_cache.py）
+    - 各プロセスは新しい行を読み、その user_id のキャッシュを捨てる
+    - キャッシュは長くても PRINCIPAL_CACHE_TTL で切れるので、それより古い行は消してよい
+    """
+
+    __tablename__ = "user_invalidations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
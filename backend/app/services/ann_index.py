@@ -0,0 +1,160 @@
+# backend/app/services/ann_index.py
+# ベクトルの近似最近傍検索（IVF：k-means のクラスタごとに分けておき、近いクラスタだけ調べる）
+#
+# - 全件との内積（正確）は件数に比例して遅くなるので、大きなセグメントだけこちらを使う
+# - centroids: クラスタの中心（長さ 1 に正規化、float32）
+# - order / offsets: クラスタ l に属する行は order[offsets[l]:offsets[l + 1]]
+# - 検索はクエリに近い nprobe 個のクラスタの行だけ内積を取る
+#   （nprobe を増やすほど正確・遅くなる）
+
+from __future__ import annotations
+
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+# この件数以上のセグメントで IVF を使う（小さいセグメントは全件を正確に計算する）
+ANN_MIN_CHUNKS = int(os.getenv("ANN_MIN_CHUNKS", "50000"))
+# クラスタ数（0 なら √件数）
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))
+# 1 クエリで調べるクラスタ数
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+
+# k-means の設定
+KMEANS_ITERS = 10
+KMEANS_SAMPLE_PER_LIST = 32
+# 内積を一度に計算する行数（メモリを使いすぎないように）
+_BATCH = 16384
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """スコアの高い k 件の位置（高い順、同点なら前から）"""
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+
+def _assign(mat: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """各行に一番近いクラスタ"""
+    out = np.empty(len(mat), dtype=np.int32)
+    for i in range(0, len(mat), _BATCH):
+        out[i:i + _BATCH] = np.argmax(mat[i:i + _BATCH] @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(
+    mat: np.ndarray,
+    nlist: int,
+    iters: int = KMEANS_ITERS,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    球面 k-means でクラスタの中心を作る（内積 = コサイン類似度なので中心も長さ 1 にする）
+    - 全件ではなく nlist * KMEANS_SAMPLE_PER_LIST 件を抜き出して学習する
+    - 空になったクラスタはランダムな行で置き直す
+    """
+    rng = np.random.default_rng(seed)
+    n = len(mat)
+    nlist = max(1, min(nlist, n))
+    sample_size = min(n, nlist * KMEANS_SAMPLE_PER_LIST)
+    sample = np.asarray(mat[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32)
+
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+class IvfIndex:
+    """
+    1 セグメント分の IVF（構築後は変更しない）
+    - trained_on: 中心を学習したときの件数（まとめ直しで中心を使い回すかの判定に使う）
+    """
+
+    __slots__ = ("centroids", "order", "offsets", "trained_on")
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        order: np.ndarray,
+        offsets: np.ndarray,
+        trained_on: int,
+    ) -> None:
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.trained_on = trained_on
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        mat: np.ndarray,
+        centroids: Optional[np.ndarray] = None,
+        trained_on: int = 0,
+        nlist: int = ANN_NLIST,
+    ) -> "IvfIndex":
+        """
+        行列から IVF を作る
+        - centroids を渡したときは学習せず、各行を近いクラスタに振り分けるだけ
+          （文書の追加・削除でまとめ直したときに使う）
+        """
+        if centroids is None:
+            nlist = nlist or int(len(mat) ** 0.5)
+            centroids = train_centroids(mat, nlist)
+            trained_on = len(mat)
+
+        assign = _assign(mat, centroids)
+        order = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(centroids)), out=offsets[1:])
+        return cls(centroids, order, offsets, trained_on)
+
+    def reusable_for(self, n: int, dim: int) -> bool:
+        """件数が学習時の半分〜2 倍なら、中心を使い回してよい"""
+        return (
+            self.centroids.shape[1] == dim
+            and self.trained_on // 2 <= n <= self.trained_on * 2
+        )
+
+    def search(
+        self,
+        mat: np.ndarray,
+        q: np.ndarray,
+        k: int,
+        nprobe: int = ANN_NPROBE,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (行番号, スコア) をスコアの高い順に最大 k 件
+        - クエリに近い nprobe 個のクラスタに入っている行だけを調べる
+        """
+        probe = top_k_indices(self.centroids @ q, min(nprobe, self.nlist))
+        offsets, order = self.offsets, self.order
+        cand = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in probe])
+        if not len(cand):
+            return cand, np.empty(0, dtype=np.float32)
+
+        # 行番号順に読む（mmap でも先頭から順に触る）
+        cand.sort()
+        scores = mat[cand] @ q
+        top = top_k_indices(scores, k)
+        return cand[top], scores[top]
@@ -0,0 +1,148 @@
+# backend/app/services/answer_cache.py
+# LLM の回答キャッシュ（同じ科目・同じ質問なら Groq を呼ばずに返す）
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # 秒
+
+
+class AnswerCacheBackend(ABC):
+    """
+    キャッシュの保存先インターフェース
+    - 外部ストア（Redis など）を使う場合はこれを継承して
+      set_answer_cache_backend() で差し替える（get / set / clear が無いと作った時点でエラー）
+    - TTL / 容量の管理はバックエンド側の責任
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    def __len__(self) -> int:
+        return 0
+
+
+class MemoryAnswerCache(AnswerCacheBackend):
+    """
+    プロセス内の LRU + TTL キャッシュ
+    - max_entries を超えたら最も古く使われたものから捨てる
+    - ttl 秒を過ぎたエントリは読み出し時に捨てる
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_backend: AnswerCacheBackend = MemoryAnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL)
+_hits = 0
+_misses = 0
+_stats_lock = threading.Lock()
+
+
+def set_answer_cache_backend(backend: AnswerCacheBackend) -> None:
+    """キャッシュの保存先を差し替える（外部ストア用）"""
+    global _backend
+    _backend = backend
+
+
+def make_key(
+    question: str,
+    subject: Optional[str],
+    history: List[Dict[str, str]],
+    knowledge_version: int,
+    model: str,
+) -> str:
+    """
+    キャッシュキー
+    - 正規化済みの質問・科目・履歴・ナレッジのバージョン・モデル名のハッシュ
+    - ナレッジが更新されるとバージョンが変わるので、古い回答は自然に使われなくなる
+    """
+    raw = json.dumps(
+        [question, subject or "", history, knowledge_version, model],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_answer(key: str) -> Optional[str]:
+    global _hits, _misses
+    if not ANSWER_CACHE_ENABLED:
+        return None
+
+    value = _backend.get(key)
+    with _stats_lock:
+        if value is None:
+            _misses += 1
+        else:
+            _hits += 1
+    return value
+
+
+def set_answer(key: str, answer: str) -> None:
+    if ANSWER_CACHE_ENABLED and answer:
+        _backend.set(key, answer)
+
+
+def clear_answers() -> None:
+    _backend.clear()
+
+
+def get_stats() -> dict:
+    """ヒット/ミス数（管理画面のシステム状態で表示）"""
+    total = _hits + _misses
+    return {
+        "enabled": ANSWER_CACHE_ENABLED,
+        "entries": len(_backend),
+        "hits": _hits,
+        "misses": _misses,
+        "hit_rate": round(_hits / total, 4) if total else 0.0,
+    }
@@ -1,25 +1,73 @@
 # backend/app/services/auth_service.py
-from datetime import datetime, timedelta
+import asyncio
+import hashlib
 import os
-from typing import Optional
+import secrets
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from jose import jwt, JWTError
 from passlib.context import CryptContext
+from sqlalchemy import insert, select, update
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from app.models.auth_token import RefreshToken
 from app.models.user import User
+from app.services import token_revocation
 
 # 从环境变量读取更安全，这里给一个默认值，方便开发环境使用
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "change-me-in-prod")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 天
+# 访问令牌（JWT）短期有效；过期后用刷新令牌换新的（不需要再输入密码，也不算 bcrypt）
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+# 刷新令牌换新后，旧令牌在这段时间内再被使用只算失败（多个标签页同时刷新），超过则视为被盗用
+REFRESH_REUSE_GRACE_SECONDS = 10
+
+# bcrypt の強度（2^rounds 回）。変えると、既存ユーザーは次のログインで新しい強度で保存し直す
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    # 強度が違うハッシュは needs_update → ログイン時に保存し直す
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+# パスワードのハッシュ計算（bcrypt）は専用のスレッドで行う
+# （ログインが集中しても、/api/ask などが使う共有のスレッドプールを使い切らない）
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# 待たせておける数（超えたら PasswordHashBusyError → 503、すぐに断る）
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_lock = threading.Lock()
+_hash_stats: Dict[str, float] = {
+    "pending": 0,
+    "running": 0,
+    "completed": 0,
+    "rejected": 0,
+    "rehashed": 0,
+    "wait_ms_total": 0.0,
+    "wait_ms_max": 0.0,
+    "run_ms_total": 0.0,
+}
 
 class PasswordTooLongError(ValueError):
     """パスワードが bcrypt の 72 バイト制限を超えたときのエラー"""
     pass
 
+class PasswordHashBusyError(Exception):
+    """パスワードのハッシュ計算が混んでいて、受け付けられないときのエラー"""
+    pass
+
 def get_password_hash(password: str) -> str:
     # ここで bcrypt のエラーを吸収して、自前の例外に変換
     try:
@@ -40,6 +88,74 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         raise
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    パスワードを確認し、強度が古いハッシュなら新しいハッシュも返す
+    - 戻り値: (一致したか, 保存し直すハッシュ or None)
+    """
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except ValueError as e:
+        if "password cannot be longer than 72 bytes" in str(e):
+            raise PasswordTooLongError("パスワードは72バイト以内で入力してください。") from e
+        raise
+
+
+async def _run_hash(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    fn(*args) をハッシュ計算用のスレッドで実行して待つ
+    - 待ちが PASSWORD_HASH_MAX_PENDING を超えていたら PasswordHashBusyError
+    """
+    with _hash_lock:
+        if _hash_stats["pending"] >= PASSWORD_HASH_MAX_PENDING:
+            _hash_stats["rejected"] += 1
+            raise PasswordHashBusyError("ただいま混み合っています。少し待ってからもう一度お試しください。")
+        _hash_stats["pending"] += 1
+    submitted = time.perf_counter()
+
+    def job():
+        started = time.perf_counter()
+        waited = (started - submitted) * 1000
+        with _hash_lock:
+            _hash_stats["pending"] -= 1
+            _hash_stats["running"] += 1
+            _hash_stats["wait_ms_total"] += waited
+            _hash_stats["wait_ms_max"] = max(_hash_stats["wait_ms_max"], waited)
+        try:
+            return fn(*args)
+        finally:
+            with _hash_lock:
+                _hash_stats["running"] -= 1
+                _hash_stats["completed"] += 1
+                _hash_stats["run_ms_total"] += (time.perf_counter() - started) * 1000
+
+    return await asyncio.wrap_future(_hash_executor.submit(job))
+
+
+async def hash_password_async(password: str) -> str:
+    """get_password_hash をハッシュ計算用のスレッドで"""
+    return await _run_hash(get_password_hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password をハッシュ計算用のスレッドで"""
+    return await _run_hash(verify_password, plain_password, hashed_password)
+
+
+def get_password_hash_stats() -> Dict[str, Any]:
+    """管理画面用：ハッシュ計算の待ち数・実行中の数・待ち時間"""
+    with _hash_lock:
+        stats = dict(_hash_stats)
+    completed = stats["completed"]
+    stats["workers"] = PASSWORD_HASH_WORKERS
+    stats["max_pending"] = PASSWORD_HASH_MAX_PENDING
+    stats["wait_ms_avg"] = round(stats["wait_ms_total"] / completed, 3) if completed else 0.0
+    stats["run_ms_avg"] = round(stats["run_ms_total"] / completed, 3) if completed else 0.0
+    for key in ("wait_ms_total", "wait_ms_max", "run_ms_total"):
+        stats[key] = round(stats[key], 3)
+    return stats
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -47,11 +163,151 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
+    # 每个令牌一个 id（注销时按 jti 吊销）
+    to_encode.setdefault("jti", uuid.uuid4().hex)
 
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def _hash_refresh_token(raw: str) -> str:
+    """刷新令牌是 256 位随机数，保存 sha256 即可（不需要 bcrypt）"""
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _access_revocation_expiry() -> datetime:
+    """吊销记录保留到这之后（此前签发的访问令牌都已过期）"""
+    return datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES, seconds=60)
+
+
+def _new_refresh_token(db: Session, user_id: int, family_id: str) -> Tuple[str, int]:
+    """刷新令牌写入数据库（只存哈希），返回 (令牌原文, id)；不 commit"""
+    raw = secrets.token_urlsafe(32)
+    token_id = db.scalar(
+        insert(RefreshToken)
+        .values(
+            user_id=user_id,
+            token_hash=_hash_refresh_token(raw),
+            family_id=family_id,
+            expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+            created_at=datetime.utcnow(),
+        )
+        .returning(RefreshToken.id)
+    )
+    return raw, token_id
+
+
+def _token_response(email: str, family_id: str, refresh_token: str) -> Dict[str, Any]:
+    access = create_access_token({"sub": email, "email": email, "fid": family_id})
+    return {
+        "access_token": access,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+
+def issue_tokens(db: Session, user_id: int, email: str) -> Dict[str, Any]:
+    """
+    登录时签发访问令牌 + 刷新令牌（新的 family）
+    - 刷新令牌只返回给客户端，数据库里只存哈希
+    """
+    family_id = uuid.uuid4().hex
+    raw, _ = _new_refresh_token(db, user_id, family_id)
+    db.commit()
+    return _token_response(email, family_id, raw)
+
+
+def rotate_refresh_token(db: Session, raw: str) -> Optional[Dict[str, Any]]:
+    """
+    用刷新令牌换新的访问令牌 + 刷新令牌（旧的刷新令牌作废）
+    - 数据库只读一次（token_hash 的唯一索引 + 用户），不计算 bcrypt
+    - 已换过的旧令牌再次被使用 → 视为被盗，整条 family 作废（含已签发的访问令牌）
+    - 无效 / 过期 / 用户已停用 → None
+    """
+    row = db.execute(
+        select(RefreshToken, User.email, User.is_active)
+        .join(User, User.id == RefreshToken.user_id)
+        .where(RefreshToken.token_hash == _hash_refresh_token(raw))
+    ).first()
+    if row is None:
+        return None
+
+    token, email, is_active = row
+    now = datetime.utcnow()
+    if token.revoked_at is not None:
+        if token.replaced_by is not None and now - token.revoked_at > timedelta(seconds=REFRESH_REUSE_GRACE_SECONDS):
+            revoke_family(db, token.family_id)
+        return None
+    if token.expires_at <= now or not is_active:
+        return None
+
+    # 同一令牌被同时使用时只让一个成功
+    claimed = db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.id == token.id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now)
+    ).rowcount
+    if claimed != 1:
+        db.rollback()
+        return None
+
+    family_id = token.family_id
+    new_raw, new_id = _new_refresh_token(db, token.user_id, family_id)
+    db.execute(update(RefreshToken).where(RefreshToken.id == token.id).values(replaced_by=new_id))
+    db.commit()
+    return _token_response(email, family_id, new_raw)
+
+
+def revoke_family(db: Session, family_id: str) -> None:
+    """一次登录（family）的刷新令牌全部作废，已签发的访问令牌也加入吊销列表"""
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+    )
+    token_revocation.revoke(db, [token_revocation.family_key(family_id)], _access_revocation_expiry())
+
+
+def revoke_refresh_token(db: Session, raw: str) -> None:
+    """注销：这个刷新令牌所在的 family 全部作废"""
+    family_id = db.scalar(
+        select(RefreshToken.family_id).where(RefreshToken.token_hash == _hash_refresh_token(raw))
+    )
+    if family_id:
+        revoke_family(db, family_id)
+
+
+def revoke_user_tokens(db: Session, user_id: int, keep_family: Optional[str] = None) -> int:
+    """用户的所有登录（除 keep_family 外）作废（修改密码时），返回作废的 family 数"""
+    families = db.scalars(
+        select(RefreshToken.family_id)
+        .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+        .distinct()
+    ).all()
+    families = [f for f in families if f != keep_family]
+    if not families:
+        return 0
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id.in_(families), RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+    )
+    token_revocation.revoke(
+        db, [token_revocation.family_key(f) for f in families], _access_revocation_expiry()
+    )
+    return len(families)
+
+
+def revoke_access_token(db: Session, payload: dict) -> None:
+    """访问令牌本身作废（注销时，按 jti）"""
+    jti = payload.get("jti")
+    if jti:
+        exp = payload.get("exp")
+        expires_at = datetime.utcfromtimestamp(exp) if exp else _access_revocation_expiry()
+        token_revocation.revoke(db, [token_revocation.token_key(jti)], expires_at)
+
+
 def get_user_by_email(db: Session, email: str) -> Optional[User]:
     return db.query(User).filter(User.email == email).first()
 
@@ -90,6 +346,53 @@ def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
     return user
 
 
+async def create_user_async(db: Session, email: str, password: str, full_name: str | None = None) -> User:
+    """create_user と同じ（ハッシュ計算は専用のスレッド、DB は共有のスレッドプールで短く）"""
+    existing = await run_in_threadpool(get_user_by_email, db, email)
+    if existing:
+        raise ValueError("该邮箱已经注册")
+
+    hashed_pw = await hash_password_async(password)
+
+    def save() -> User:
+        user = User(email=email, hashed_password=hashed_pw, full_name=full_name)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return user
+
+    return await run_in_threadpool(save)
+
+
+async def authenticate_user_async(db: Session, email: str, password: str) -> Optional[User]:
+    """
+    authenticate_user と同じ（ハッシュ計算は専用のスレッド）
+    - BCRYPT_ROUNDS が変わっていたら、ログインできたときに新しい強度で保存し直す
+    """
+    user = await run_in_threadpool(get_user_by_email, db, email)
+    if not user:
+        return None
+
+    # ❌ 停止中ユーザーはログイン不可
+    if not user.is_active:
+        return None
+
+    ok, new_hash = await _run_hash(verify_and_update_password, password, user.hashed_password)
+    if not ok:
+        return None
+
+    if new_hash:
+        def save() -> None:
+            user.hashed_password = new_hash
+            db.commit()
+            db.refresh(user)
+
+        await run_in_threadpool(save)
+        with _hash_lock:
+            _hash_stats["rehashed"] += 1
+
+    return user
+
 
 def decode_token(token: str) -> dict | None:
     try:
@@ -0,0 +1,494 @@
+# backend/app/services/bulk_import.py
+# ナレッジ文書の一括取り込み（複数ファイル / zip・tar アーカイブ）
+#
+# - アーカイブは丸ごと読まず、中のファイルを 1 つずつ読んで取り込む
+# - 大きなファイル（INGEST_STREAM_BYTES 超）は少しずつ読み、UTF-8 に変換しながら
+#   本文を knowledge_docs.content（先頭）と knowledge_doc_parts（続き）に順に書き込む
+#   （ファイル全体をメモリに載せないので、上限を数百 MB にできる。取り込みのワーカーも
+#   knowledge_doc_parts を 1 つずつ読みながらチャンクに分ける）
+# - PDF / DOCX / HTML は extractors.py でテキストを取り出してから登録する（別プロセスで実行）
+#   API からは run_upload で専用のスレッドで動かす（取り出しを待つ間、API のスレッドプールを使わない）
+# - 同じ内容（本文の sha256）の文書は登録しない
+#   （既存の文書との照合は、まとめた件数ごとに IN の 1 クエリ）
+# - 同じ名前で内容が変わった文書は、新しく登録せずにその文書を差し替える
+#   （取り込みでは変わったチャンクだけ埋め込み直す、retrievers.reuse_vectors）
+# - 登録は INSERT / UPDATE をまとめて行い、最後に取り込みジョブをまとめて登録する
+#   （ワーカーは溜まったジョブをまとめて取るので、インデックスの更新は 1 回）
+
+from __future__ import annotations
+
+import asyncio
+import codecs
+import hashlib
+import itertools
+import os
+import tarfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Collection, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.knowledge import DOC_PENDING, KnowledgeDoc, KnowledgeDocPart
+from app.services.extractors import (
+    EXTRACT_MAX_FILE_BYTES,
+    ExtractError,
+    content_type_for_ext,
+    extract_text,
+    needs_extraction,
+)
+from app.services.ingest_service import enqueue_docs
+
+# 1 ファイルの上限（バイト）
+INGEST_MAX_FILE_BYTES = int(os.getenv("INGEST_MAX_FILE_BYTES", str(512 * 1024 * 1024)))
+# これより大きいファイルは少しずつ読んで DB に書き込む（小さいものはまとめて INSERT）
+INGEST_STREAM_BYTES = int(os.getenv("INGEST_STREAM_BYTES", str(4 * 1024 * 1024)))
+# 本文を分けて保存するときの 1 つの大きさ（文字数）
+INGEST_PART_CHARS = int(os.getenv("INGEST_PART_CHARS", "1000000"))
+# 1 回の一括取り込みで扱うファイル数の上限（アーカイブの中身も数える）
+INGEST_BULK_MAX_FILES = int(os.getenv("INGEST_BULK_MAX_FILES", "10000"))
+# アップロードの取り込みを動かすスレッド数（同時に処理するアップロードの数）
+INGEST_UPLOAD_WORKERS = int(os.getenv("INGEST_UPLOAD_WORKERS", "4"))
+# 重複の確認・INSERT をまとめて行う件数
+INGEST_INSERT_BATCH = 500
+# ファイルを読む単位（バイト）
+_READ_BLOCK = 1024 * 1024
+
+ARCHIVE_EXT = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+_upload_pool: Optional[ThreadPoolExecutor] = None
+_upload_pool_lock = threading.Lock()
+
+
+def _get_upload_pool() -> ThreadPoolExecutor:
+    global _upload_pool
+
+    if _upload_pool is None:
+        with _upload_pool_lock:
+            if _upload_pool is None:
+                _upload_pool = ThreadPoolExecutor(
+                    max_workers=INGEST_UPLOAD_WORKERS, thread_name_prefix="knowledge-upload"
+                )
+    return _upload_pool
+
+
+async def run_upload(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    アップロードの取り込み（ファイルの読み込み・テキストの取り出し・DB 保存）を専用のスレッドで実行して待つ
+    - 取り出しは 1 ファイル数十秒かかることがあるので、API のスレッドプール（他のリクエストと共有）を使わない
+    """
+    return await asyncio.wrap_future(_get_upload_pool().submit(fn, *args))
+
+
+class Entry(NamedTuple):
+    """
+    取り込み対象のファイル 1 つ
+    - data: 中身（小さいファイル）
+    - blocks: 大きいファイルの中身を少しずつ返すイテレータ（data の代わり、その場で読み切ること）
+    - skipped: 取り込まない理由（あれば）
+    """
+
+    name: str
+    data: bytes
+    skipped: str = ""
+    blocks: Optional[Iterator[bytes]] = None
+
+
+def read_blocks(f: BinaryIO, block: int = _READ_BLOCK) -> Iterator[bytes]:
+    """ファイルを block バイトずつ読む"""
+    return iter(lambda: f.read(block), b"")
+
+
+def decode_text(raw: bytes) -> str:
+    """テキストに変換（UTF-8 基本、失敗したら errors='ignore'）"""
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("utf-8", errors="ignore")
+
+
+def entry_text(entry: Entry) -> str:
+    """
+    ファイルの中身をテキストにする
+    - PDF / DOCX / HTML は別プロセスで取り出す（失敗したら ExtractError）
+    """
+    if needs_extraction(Path(entry.name).suffix):
+        return extract_text(entry.name, entry.data)
+    return decode_text(entry.data)
+
+
+def content_hash(text: str) -> str:
+    """本文の sha256（16 進 64 文字）"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def content_type_for(name: str) -> str:
+    return content_type_for_ext(Path(name).suffix.lower())
+
+
+def is_archive(name: str) -> bool:
+    return name.lower().endswith(ARCHIVE_EXT)
+
+
+def _hidden(path: str) -> bool:
+    """隠しファイル・macOS の付属ファイル（__MACOSX/ や ._xxx）"""
+    return any(p.startswith(".") or p == "__MACOSX" for p in path.replace("\\", "/").split("/") if p)
+
+
+def _zip_name(info: zipfile.ZipInfo) -> str:
+    """UTF-8 の印が無い zip（Windows で作ったものなど）は Shift_JIS として読み直す"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("cp932")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _read_entry(name: str, f: BinaryIO, allowed: Collection[str]) -> Entry:
+    ext = Path(name).suffix.lower()
+    if ext not in allowed:
+        return Entry(name, b"", f"未対応形式です: {ext or '(拡張子なし)'}")
+
+    if needs_extraction(ext):
+        # PDF などは丸ごと読んで取り出しに渡す（少しずつは読めない）
+        data = f.read(EXTRACT_MAX_FILE_BYTES + 1)
+        if len(data) > EXTRACT_MAX_FILE_BYTES:
+            return Entry(name, b"", f"ファイルが大きすぎます（{ext} の上限{EXTRACT_MAX_FILE_BYTES // (1024 * 1024)}MB）")
+        if not data:
+            return Entry(name, b"", "空ファイルです")
+        return Entry(name, data)
+
+    data = f.read(INGEST_STREAM_BYTES + 1)
+    if len(data) > INGEST_STREAM_BYTES:
+        # 大きいファイルは読んだ分 + 残りを少しずつ
+        return Entry(name, b"", blocks=itertools.chain([data], read_blocks(f)))
+    if not data.strip():
+        return Entry(name, b"", "空ファイルです")
+    return Entry(name, data)
+
+
+def iter_entries(name: str, fileobj: BinaryIO, allowed: Collection[str]) -> Iterator[Entry]:
+    """
+    アップロードされた 1 ファイルから取り込み対象を 1 つずつ取り出す
+    - zip / tar（gz・bz2・xz）は中のファイルを順に読む（ディレクトリ・隠しファイルは飛ばす）
+    - それ以外はそのファイル自体
+    - 大きいファイルは blocks 付きで返す（次を取り出す前に読み切ること）
+    - 壊れたアーカイブは、そこまでに読めた分 + 理由付きの skipped を返す
+    """
+    if not is_archive(name):
+        yield _read_entry(name, fileobj, allowed)
+        return
+
+    try:
+        if name.lower().endswith(".zip"):
+            with zipfile.ZipFile(fileobj) as zf:
+                for info in zf.infolist():
+                    path = _zip_name(info)
+                    if info.is_dir() or _hidden(path):
+                        continue
+                    with zf.open(info) as f:
+                        yield _read_entry(path, f, allowed)
+        else:
+            # "r|*" はシークせず先頭から順に読む（圧縮形式は自動判定）
+            with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+                for member in tf:
+                    if not member.isfile() or _hidden(member.name):
+                        continue
+                    f = tf.extractfile(member)
+                    if f is not None:
+                        yield _read_entry(member.name, f, allowed)
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        yield Entry(name, b"", f"アーカイブを読めません: {e}")
+
+
+def import_docs(
+    db: Session,
+    entries: Iterable[Entry],
+    inline: Optional[bool] = None,
+    max_files: int = INGEST_BULK_MAX_FILES,
+    max_bytes: int = INGEST_MAX_FILE_BYTES,
+) -> Dict[str, Any]:
+    """
+    ファイルをまとめて knowledge_docs に登録し、取り込みジョブをまとめて登録する
+    - 同じ内容の文書（今回の中でも、既存の文書とも）は duplicates に入れて登録しない
+    - テキストを取り出せなかったファイルは skipped
+    - 同じ名前の文書があれば、新しく登録せずに本文を差し替える（updated）
+      今回の中に同じ名前のファイルが複数あれば最後のものだけを使う（前のものは skipped）
+    - 大きいファイル（blocks）は 1 件ずつ読みながら書き込む（_save_stream）
+    - inline: enqueue_docs と同じ（False なら登録だけしてワーカーに任せる）
+    - 戻り値: added / updated（id, original_name）/ duplicates（name, 既存の文書の id）/
+      skipped（name, reason）/ job_ids
+    """
+    result: Dict[str, Any] = {"added": [], "updated": [], "duplicates": [], "skipped": [], "job_ids": []}
+    seen: Set[str] = set()
+    batch: Dict[str, Dict[str, Any]] = {}  # 名前 → 登録する行（同じ名前は後のもので置き換える）
+    count = 0
+
+    for entry in entries:
+        count += 1
+        if count > max_files:
+            result["skipped"].append({"name": entry.name, "reason": f"ファイル数の上限（{max_files}）を超えました"})
+            break
+        if entry.skipped:
+            result["skipped"].append({"name": entry.name, "reason": entry.skipped})
+            continue
+        if entry.blocks is not None:
+            for key, items in _save_stream(db, entry.name, entry.blocks, max_bytes).items():
+                result[key].extend(items)
+            continue
+        if len(entry.data) > max_bytes:
+            result["skipped"].append({"name": entry.name, "reason": f"ファイルが大きすぎます（上限{max_bytes // (1024 * 1024)}MB）"})
+            continue
+
+        try:
+            text = entry_text(entry)
+        except ExtractError as e:
+            result["skipped"].append({"name": entry.name, "reason": str(e)})
+            continue
+        if not text.strip():
+            result["skipped"].append({"name": entry.name, "reason": "テキストを取り出せませんでした（画像だけの PDF など）"})
+            continue
+        digest = content_hash(text)
+        if digest in seen:
+            result["duplicates"].append({"name": entry.name, "id": None})
+            continue
+        seen.add(digest)
+
+        previous = batch.pop(entry.name, None)
+        if previous is not None:
+            seen.discard(previous["content_hash"])
+            result["skipped"].append({"name": entry.name, "reason": "同じ名前のファイルが後にあるため、そちらを使いました"})
+        batch[entry.name] = {
+            "original_name": entry.name,
+            "stored_name": None,  # 物理ファイルは保存しない
+            "size": len(entry.data),
+            "content_type": content_type_for(entry.name),
+            "content": text,
+            "content_hash": digest,
+            "status": DOC_PENDING,
+            "chunk_count": 0,
+            "part_count": 0,
+            "created_at": datetime.utcnow(),
+        }
+        if len(batch) >= INGEST_INSERT_BATCH:
+            _save_batch(db, list(batch.values()), result)
+            batch = {}
+
+    if batch:
+        _save_batch(db, list(batch.values()), result)
+
+    doc_ids = [d["id"] for d in result["added"] + result["updated"]]
+    result["job_ids"] = enqueue_docs(db, doc_ids, inline=inline)
+    return result
+
+
+def _save_batch(db: Session, rows: List[Dict[str, Any]], result: Dict[str, Any]) -> None:
+    """
+    既存の文書と同じ内容のものを除き、同じ名前の文書は差し替え、残りを登録する
+    - 照合は内容・名前それぞれ IN の 1 クエリ、登録・差し替えもそれぞれ 1 回
+    - 同時に同じ内容が登録されてユニークインデックスに当たったら、照合からやり直す
+    """
+    try:
+        saved = _save_batch_once(db, rows)
+    except IntegrityError:
+        db.rollback()
+        saved = _save_batch_once(db, rows)
+
+    for name, items in saved.items():
+        result[name].extend(items)
+
+
+def _save_batch_once(db: Session, rows: List[Dict[str, Any]]) -> Dict[str, list]:
+    existing = dict(db.execute(
+        select(KnowledgeDoc.content_hash, KnowledgeDoc.id)
+        .where(KnowledgeDoc.content_hash.in_([r["content_hash"] for r in rows]))
+    ).all())
+    saved: Dict[str, list] = {"added": [], "updated": [], "duplicates": []}
+    fresh = []
+    for r in rows:
+        if r["content_hash"] in existing:
+            saved["duplicates"].append({"name": r["original_name"], "id": existing[r["content_hash"]]})
+        else:
+            fresh.append(r)
+    if not fresh:
+        return saved
+
+    # 同じ名前の文書が複数あるときは新しいほうを差し替える
+    same_name = dict(db.execute(
+        select(KnowledgeDoc.original_name, KnowledgeDoc.id)
+        .where(KnowledgeDoc.original_name.in_({r["original_name"] for r in fresh}))
+        .order_by(KnowledgeDoc.id)
+    ).all())
+    changed = []
+    new = []
+    for r in fresh:
+        doc_id = same_name.get(r["original_name"])
+        if doc_id is None:
+            new.append(r)
+        else:
+            row = {k: v for k, v in r.items() if k != "created_at"}
+            changed.append({
+                **row, "id": doc_id, "part_count": 0, "error_message": None, "updated_at": datetime.utcnow(),
+            })
+
+    if changed:
+        # 主キー付きの辞書の列なので、1 回の executemany の UPDATE になる
+        db.execute(update(KnowledgeDoc), changed)
+        db.execute(delete(KnowledgeDocPart).where(KnowledgeDocPart.doc_id.in_([r["id"] for r in changed])))
+    ids = []
+    if new:
+        ids = db.scalars(
+            insert(KnowledgeDoc).returning(KnowledgeDoc.id, sort_by_parameter_order=True),
+            new,
+        ).all()
+    db.commit()
+
+    saved["updated"] = [{"id": r["id"], "original_name": r["original_name"]} for r in changed]
+    saved["added"] = [{"id": doc_id, "original_name": r["original_name"]} for doc_id, r in zip(ids, new)]
+    return saved
+
+
+class _TooLarge(Exception):
+    pass
+
+
+def _save_stream(db: Session, name: str, blocks: Iterator[bytes], max_bytes: int) -> Dict[str, list]:
+    """
+    大きいファイルを少しずつ読み、UTF-8 に変換しながら本文を書き込む
+    - まず pending の行を作り、INGEST_PART_CHARS 文字ごとに content（先頭）/ knowledge_doc_parts（続き）へ
+      （書き込みは SQL の UPDATE / INSERT だけで、セッションに本文を持ち続けない）
+    - 読み終わってから sha256 で重複を確認する（重複・空・上限超えなら作った行を消す）
+    - 同じ名前の文書があれば、書き込んだ本文をその文書に付け替える（id は変わらない）
+    """
+    saved: Dict[str, list] = {"added": [], "updated": [], "duplicates": [], "skipped": []}
+    doc_id = db.scalar(
+        insert(KnowledgeDoc)
+        .values(
+            original_name=name,
+            stored_name=None,  # 物理ファイルは保存しない
+            size=0,
+            content_type=content_type_for(name),
+            content="",
+            status=DOC_PENDING,
+            chunk_count=0,
+            part_count=0,
+            created_at=datetime.utcnow(),
+        )
+        .returning(KnowledgeDoc.id)
+    )
+    # 同じ id の古い続きが残っていたら消しておく（SQLite は削除した id を使い回すことがある）
+    db.execute(delete(KnowledgeDocPart).where(KnowledgeDocPart.doc_id == doc_id))
+    db.commit()
+
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    hasher = hashlib.sha256()
+    state = {"size": 0, "pieces": 0, "blank": True}
+    buf: List[str] = []
+
+    def flush() -> None:
+        piece = "".join(buf)
+        buf.clear()
+        if not piece:
+            return
+        hasher.update(piece.encode("utf-8"))
+        state["blank"] = state["blank"] and not piece.strip()
+        if state["pieces"] == 0:
+            db.execute(update(KnowledgeDoc).where(KnowledgeDoc.id == doc_id).values(content=piece))
+        else:
+            db.execute(insert(KnowledgeDocPart).values(doc_id=doc_id, seq=state["pieces"], content=piece))
+        state["pieces"] += 1
+        db.commit()
+
+    try:
+        buffered = 0
+        for block in blocks:
+            state["size"] += len(block)
+            if state["size"] > max_bytes:
+                raise _TooLarge()
+            text = decoder.decode(block)
+            buf.append(text)
+            buffered += len(text)
+            if buffered >= INGEST_PART_CHARS:
+                flush()
+                buffered = 0
+        buf.append(decoder.decode(b"", final=True))
+        flush()
+    except _TooLarge:
+        _drop_doc(db, doc_id)
+        saved["skipped"].append({"name": name, "reason": f"ファイルが大きすぎます（上限{max_bytes // (1024 * 1024)}MB）"})
+        return saved
+    except Exception:
+        db.rollback()
+        _drop_doc(db, doc_id)
+        raise
+
+    if state["blank"]:
+        _drop_doc(db, doc_id)
+        saved["skipped"].append({"name": name, "reason": "空ファイルです"})
+        return saved
+
+    digest = hasher.hexdigest()
+    existing = db.scalar(select(KnowledgeDoc.id).where(KnowledgeDoc.content_hash == digest))
+    if existing is not None:
+        _drop_doc(db, doc_id)
+        saved["duplicates"].append({"name": name, "id": existing})
+        return saved
+
+    fields = {
+        "size": state["size"],
+        "content_hash": digest,
+        "part_count": state["pieces"] - 1,
+    }
+    old_id = db.scalar(
+        select(KnowledgeDoc.id)
+        .where(KnowledgeDoc.original_name == name, KnowledgeDoc.id != doc_id)
+        .order_by(KnowledgeDoc.id.desc())
+        .limit(1)
+    )
+    try:
+        if old_id is None:
+            db.execute(update(KnowledgeDoc).where(KnowledgeDoc.id == doc_id).values(**fields))
+            db.commit()
+            saved["added"].append({"id": doc_id, "original_name": name})
+            return saved
+
+        # 同じ名前の文書に付け替える（先頭の本文は DB の中でコピー）
+        first = select(KnowledgeDoc.content).where(KnowledgeDoc.id == doc_id).scalar_subquery()
+        db.execute(delete(KnowledgeDocPart).where(KnowledgeDocPart.doc_id == old_id))
+        db.execute(update(KnowledgeDocPart).where(KnowledgeDocPart.doc_id == doc_id).values(doc_id=old_id))
+        db.execute(
+            update(KnowledgeDoc)
+            .where(KnowledgeDoc.id == old_id)
+            .values(
+                content=first,
+                content_type=content_type_for(name),
+                status=DOC_PENDING,
+                error_message=None,
+                updated_at=datetime.utcnow(),
+                **fields,
+            )
+        )
+        db.execute(delete(KnowledgeDoc).where(KnowledgeDoc.id == doc_id))
+        db.commit()
+        saved["updated"].append({"id": old_id, "original_name": name})
+        return saved
+    except IntegrityError:
+        # 同時に同じ内容が登録された
+        db.rollback()
+        _drop_doc(db, doc_id)
+        saved["duplicates"].append({"name": name, "id": None})
+        return saved
+
+
+def _drop_doc(db: Session, doc_id: int) -> None:
+    """書きかけの文書（本文の続きも）を消す"""
+    db.execute(delete(KnowledgeDocPart).where(KnowledgeDocPart.doc_id == doc_id))
+    db.execute(delete(KnowledgeDoc).where(KnowledgeDoc.id == doc_id))
+    db.commit()
@@ -0,0 +1,174 @@
+# backend/app/services/chunker.py
+# 文書のチャンク分割（取り込み時に 1 回だけ実行）
+#
+# - Markdown の見出し（# ...）でセクションを区切り、チャンクはセクションをまたがない
+# - セクション内は空行区切りの段落をまとめて、CHUNK_MAX_TOKENS 以内に詰める
+# - 1 段落が大きすぎるときは行単位で分ける
+# - 隣のチャンクとは CHUNK_OVERLAP_LINES 行だけ重ねる（文脈の切れ目対策）
+# - チャンクは「行番号の範囲」で表す（検索インデックスの行とそのまま対応）
+# - 本文は少しずつ受け取れる（iter_lines / ChunkBuilder）。大きな文書でも本文をつなげたり、
+#   全行のリストを作ったりしない（持つのはチャンクにしていない末尾の行のトークン数だけ）
+
+from __future__ import annotations
+
+import os
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+
+CHUNK_MAX_TOKENS = int(os.getenv("KNOWLEDGE_CHUNK_TOKENS", "300"))
+CHUNK_OVERLAP_LINES = int(os.getenv("KNOWLEDGE_CHUNK_OVERLAP", "1"))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の簡易見積もり
+    - 日本語・中国語などの非 ASCII 文字は 1 文字 ≒ 1 トークン
+    - ASCII は 4 文字 ≒ 1 トークン
+    """
+    non_ascii = sum(1 for c in text if ord(c) > 0x7F)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+class TextLine(NamedTuple):
+    text: str
+    para_break: bool  # 直前に空行があった（新しい段落の始まり）
+    heading: bool  # Markdown の見出し行
+
+
+def _unterminated(line: str) -> bool:
+    """改行で終わっていない（CR だけで終わっている行も、続きが LF かもしれないので含める）"""
+    return line.endswith("\r") or line.splitlines()[0] == line
+
+
+def iter_lines(pieces: Iterable[str]) -> Iterator[TextLine]:
+    """
+    少しずつ受け取った本文を行に分割する（空行は捨て、段落の区切りとして記録する）
+    - pieces の区切りは行の途中でもよい（行の残りは次の piece とつなげる）
+    - CRLF, LF 両方に対応（piece の区切りが CR と LF の間でもよい）
+    """
+    blank = False
+    rest = ""
+    for piece in pieces:
+        raw = (rest + piece).splitlines(keepends=True)
+        # 最後の行は続きがあるかもしれない（改行で終わっていない / CR で終わっている）
+        rest = raw.pop() if raw and _unterminated(raw[-1]) else ""
+        for line in raw:
+            s = line.strip()
+            if not s:
+                blank = True
+                continue
+            yield TextLine(s, blank, s.startswith("#"))
+            blank = False
+    s = rest.strip()
+    if s:
+        yield TextLine(s, blank, s.startswith("#"))
+
+
+def split_lines(text: str) -> List[TextLine]:
+    """本文を行に分割する（iter_lines の一括版）"""
+    return list(iter_lines([text]))
+
+
+# (開始行, 終了行, 見出し行, 見出しを含めたトークン数)
+Chunk = Tuple[int, int, int, int]
+
+
+class ChunkBuilder:
+    """
+    1 文書分の行を 1 行ずつ受け取り、できあがったチャンクから順に返す
+    - セクション（見出しで区切る）→ 段落 → 大きすぎる段落は行ごと、という単位に分け、
+      単位を max_tokens 以内に詰める（前のチャンクの末尾 overlap 行を重ねる）
+    - 段落が max_tokens を超えた時点で、その段落は行ごとの単位にする（段落の終わりを待たない）
+    - 持っておくのはまだチャンクにしていない行のトークン数だけ
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP_LINES):
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self._n = 0  # 受け取った行数
+        self._tokens: Dict[int, int] = {}  # 行番号 → トークン数（詰めている途中のチャンクの先頭から）
+        self._head = -1  # セクションの見出し行
+        self._head_tokens = 0
+        self._cur = 0  # 詰めている途中のチャンクの先頭行
+        self._cur_tokens = 0
+        self._para = 0  # 段落の先頭行
+        self._para_tokens = 0
+        self._para_split = False  # この段落は行ごとの単位にする
+
+    def add(self, line: TextLine, tokens: int) -> List[Chunk]:
+        """1 行を受け取り、この行の手前までででき上がったチャンクを返す"""
+        out: List[Chunk] = []
+        i = self._n
+        if line.heading and i > 0:
+            self._end_section(i, out)
+        elif line.para_break and i > 0:
+            self._end_paragraph(i, out)
+        if line.heading:
+            self._head, self._head_tokens = i, tokens
+
+        self._tokens[i] = tokens
+        self._n += 1
+        if self._para_split:
+            self._add_unit(i, i + 1, out)
+        else:
+            self._para_tokens += tokens
+            if self._para_tokens > self.max_tokens:
+                self._para_split = True
+                for j in range(self._para, i + 1):
+                    self._add_unit(j, j + 1, out)
+        return out
+
+    def finish(self) -> List[Chunk]:
+        """残りの行をチャンクにして返す（文書の終わりに 1 回呼ぶ）"""
+        out: List[Chunk] = []
+        if self._n:
+            self._end_section(self._n, out)
+        return out
+
+    def _end_paragraph(self, i: int, out: List[Chunk]) -> None:
+        if not self._para_split and self._para < i:
+            self._add_unit(self._para, i, out)
+        self._para, self._para_tokens, self._para_split = i, 0, False
+
+    def _end_section(self, e: int, out: List[Chunk]) -> None:
+        self._end_paragraph(e, out)
+        if e > self._cur:
+            self._emit(self._cur, e, out)
+        self._tokens.clear()
+        self._head, self._head_tokens = -1, 0
+        self._cur, self._cur_tokens = e, 0
+
+    def _add_unit(self, us: int, ue: int, out: List[Chunk]) -> None:
+        unit_tokens = sum(self._tokens[j] for j in range(us, ue))
+        if us > self._cur and self._cur_tokens + unit_tokens > self.max_tokens:
+            self._emit(self._cur, us, out)
+            cur = max(us - self.overlap, self._cur + 1)
+            for j in range(self._cur, cur):
+                del self._tokens[j]
+            self._cur = cur
+            self._cur_tokens = sum(self._tokens[j] for j in range(cur, us))
+        self._cur_tokens += unit_tokens
+
+    def _emit(self, a: int, b: int, out: List[Chunk]) -> None:
+        head = self._head
+        n = sum(self._tokens[j] for j in range(a, b)) + (self._head_tokens if 0 <= head < a else 0)
+        out.append((a, b, head, n))
+
+
+def chunk_ranges(
+    lines: Sequence[TextLine],
+    tokens: Sequence[int],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap: int = CHUNK_OVERLAP_LINES,
+) -> List[Tuple[int, int, int]]:
+    """
+    1 文書分の行をチャンクに分ける（ChunkBuilder の一括版）
+    - tokens: 各行のトークン数
+    - 戻り値: (開始行, 終了行, 見出し行) のリスト（見出しが無ければ -1）
+      チャンクの途中から始まるときに、見出しを付けて渡せるようにする
+    """
+    builder = ChunkBuilder(max_tokens, overlap)
+    chunks: List[Chunk] = []
+    for line, n in zip(lines, tokens):
+        chunks.extend(builder.add(line, n))
+    chunks.extend(builder.finish())
+    return [(a, b, head) for a, b, head, _ in chunks]
@@ -0,0 +1,297 @@
+# backend/app/services/conversation_service.py
+# 会話の保存（クライアントは毎回履歴を送らず、conversation_id だけを送る）
+#
+# - メッセージは conversation_messages に保存し、プロンプトには末尾だけを入れる
+#   （新しい順に CONVERSATION_HISTORY_TOKENS 以内、最大 CONVERSATION_MAX_MESSAGES 件）
+# - それより古いやり取りは conversations.summary にまとめておく（ローリング要約）
+#   - 要約に入れたメッセージは summary_upto 以前になり、以後は読まない
+#   - 要約を作り直すのは、まだ要約していない分が予算を超えたときだけ（回答を返した後にバックグラウンドで）
+#   - 要約は LLM で作り、使えないときは各発言の先頭を並べたものにする
+# - DB の処理は同期なので、API 側からは run_in_threadpool で呼ぶ（compact_conversation を除く）
+
+from __future__ import annotations
+
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, select, update
+from starlette.concurrency import run_in_threadpool
+
+from app.db import SessionLocal
+from app.models.conversation import Conversation, ConversationMessage
+from app.services.chunker import estimate_tokens
+from app.services.llm_service import summarize_history_async
+from app.services.token_budget import clip_tokens
+
+# プロンプトに入れる履歴（要約を含む）のトークン数の上限
+CONVERSATION_HISTORY_TOKENS = int(os.getenv("CONVERSATION_HISTORY_TOKENS", "2000"))
+# 要約のトークン数の上限
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "400"))
+# 1 回に読む末尾のメッセージ数の上限
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "40"))
+# 要約するときは、まだ要約していない分がこの割合になるまで古いものから畳む
+# （毎ターン要約し直さないように、予算より少し下まで減らす）
+_COMPACT_TARGET = 0.5
+# 要約に入れず、必ず残す最新のメッセージ数
+_KEEP_RECENT = 2
+_TITLE_CHARS = 40
+_FALLBACK_CHARS = 120
+
+SUMMARY_PREFIX = "以下はこれまでの会話の要約です：\n"
+
+_compacting: Set[int] = set()
+_compacting_lock = threading.Lock()
+
+
+def _title(question: str) -> str:
+    title = " ".join(question.split())
+    return title[:_TITLE_CHARS] + ("…" if len(title) > _TITLE_CHARS else "")
+
+
+def get_or_create_conversation(
+    user_id: int,
+    conversation_id: Optional[int],
+    question: str,
+) -> Optional[int]:
+    """
+    ユーザーの会話の id を返す（conversation_id が無ければ新しく作る）
+    - 他人の会話・存在しない会話なら None
+    """
+    with SessionLocal() as db:
+        if conversation_id is not None:
+            return db.execute(
+                select(Conversation.id).where(
+                    Conversation.id == conversation_id,
+                    Conversation.user_id == user_id,
+                )
+            ).scalar()
+
+        conv = Conversation(user_id=user_id, title=_title(question))
+        db.add(conv)
+        db.commit()
+        return conv.id
+
+
+def load_history(conversation_id: int) -> List[Dict[str, str]]:
+    """
+    プロンプトに入れる履歴（build_messages にそのまま渡せる形）
+    - 要約があれば先頭に system メッセージとして入れる
+    - 続けて、要約していないメッセージを新しい順に予算に入るだけ（古い順に並べ直す）
+    - 保存時に見積もった tokens も付けておく（プロンプトの予算を計算するときに数え直さない）
+    """
+    with SessionLocal() as db:
+        summary, upto = db.execute(
+            select(Conversation.summary, Conversation.summary_upto)
+            .where(Conversation.id == conversation_id)
+        ).one()
+        rows = db.execute(
+            select(ConversationMessage.role, ConversationMessage.content, ConversationMessage.tokens)
+            .where(
+                ConversationMessage.conversation_id == conversation_id,
+                ConversationMessage.id > upto,
+            )
+            .order_by(ConversationMessage.id.desc())
+            .limit(CONVERSATION_MAX_MESSAGES)
+        ).all()
+
+    history: List[Dict[str, str]] = []
+    budget = CONVERSATION_HISTORY_TOKENS
+    if summary:
+        history.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+        budget -= estimate_tokens(summary)
+
+    recent: List[Dict[str, str]] = []
+    for row in rows:
+        budget -= row.tokens
+        if budget < 0:
+            break
+        recent.append({"role": row.role, "content": row.content, "tokens": row.tokens})
+    recent.reverse()
+    return history + recent
+
+
+def append_turn(conversation_id: int, question: str, answer: str) -> bool:
+    """
+    質問と回答を保存する
+    - 戻り値：まだ要約していない分が予算を超えた（compact_conversation を呼ぶべき）
+    """
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        db.add_all([
+            ConversationMessage(
+                conversation_id=conversation_id,
+                role="user",
+                content=question,
+                tokens=estimate_tokens(question),
+                created_at=now,
+            ),
+            ConversationMessage(
+                conversation_id=conversation_id,
+                role="assistant",
+                content=answer,
+                tokens=estimate_tokens(answer),
+                created_at=now,
+            ),
+        ])
+        db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id)
+            .values(updated_at=now)
+        )
+        db.commit()
+
+        upto = select(Conversation.summary_upto).where(Conversation.id == conversation_id).scalar_subquery()
+        pending = db.execute(
+            select(func.coalesce(func.sum(ConversationMessage.tokens), 0)).where(
+                ConversationMessage.conversation_id == conversation_id,
+                ConversationMessage.id > upto,
+            )
+        ).scalar()
+    return pending > CONVERSATION_HISTORY_TOKENS
+
+
+def _fallback_summary(previous: Optional[str], messages: List[Dict[str, str]]) -> str:
+    """LLM が使えないときの要約：各発言の先頭を並べる"""
+    lines = [previous] if previous else []
+    for msg in messages:
+        name = "学生" if msg["role"] == "user" else "先生"
+        text = " ".join(msg["content"].split())
+        lines.append(f"{name}：{text[:_FALLBACK_CHARS]}")
+    return "\n".join(lines)
+
+
+def _load_for_compaction(
+    conversation_id: int,
+) -> Optional[Tuple[Optional[str], int, List[Dict[str, str]], int]]:
+    """
+    畳むメッセージを決める
+    - 戻り値：(今の要約, 今の summary_upto, 畳むメッセージ, 新しい summary_upto)、畳まなくてよければ None
+    """
+    with SessionLocal() as db:
+        row = db.execute(
+            select(Conversation.summary, Conversation.summary_upto)
+            .where(Conversation.id == conversation_id)
+        ).first()
+        if row is None:
+            return None
+        rows = db.execute(
+            select(
+                ConversationMessage.id,
+                ConversationMessage.role,
+                ConversationMessage.content,
+                ConversationMessage.tokens,
+            )
+            .where(
+                ConversationMessage.conversation_id == conversation_id,
+                ConversationMessage.id > row.summary_upto,
+            )
+            .order_by(ConversationMessage.id)
+        ).all()
+
+    total = sum(r.tokens for r in rows)
+    if total <= CONVERSATION_HISTORY_TOKENS:
+        return None
+
+    target = int(CONVERSATION_HISTORY_TOKENS * _COMPACT_TARGET)
+    folded = []
+    for r in rows[:-_KEEP_RECENT]:
+        if total <= target:
+            break
+        folded.append(r)
+        total -= r.tokens
+    if not folded:
+        return None
+    messages = [{"role": r.role, "content": r.content} for r in folded]
+    return row.summary, row.summary_upto, messages, folded[-1].id
+
+
+def _save_summary(conversation_id: int, old_upto: int, summary: str, new_upto: int) -> None:
+    with SessionLocal() as db:
+        # 同時に別のプロセスが畳んでいたら（summary_upto が変わっていたら）書かない
+        db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id, Conversation.summary_upto == old_upto)
+            .values(summary=summary, summary_upto=new_upto)
+        )
+        db.commit()
+
+
+async def compact_conversation(conversation_id: int) -> None:
+    """
+    まだ要約していない分が予算を超えていたら、古いものから要約に畳む（回答を返した後に呼ぶ）
+    - 同じ会話を同時に畳まない（このプロセス内）
+    """
+    with _compacting_lock:
+        if conversation_id in _compacting:
+            return
+        _compacting.add(conversation_id)
+    try:
+        plan = await run_in_threadpool(_load_for_compaction, conversation_id)
+        if plan is None:
+            return
+        previous, old_upto, messages, new_upto = plan
+
+        summary = await summarize_history_async(previous, messages, CONVERSATION_SUMMARY_TOKENS)
+        if not summary:
+            summary = _fallback_summary(previous, messages)
+        summary = clip_tokens(summary, CONVERSATION_SUMMARY_TOKENS, keep_tail=True)
+
+        await run_in_threadpool(_save_summary, conversation_id, old_upto, summary, new_upto)
+    finally:
+        with _compacting_lock:
+            _compacting.discard(conversation_id)
+
+
+# ========== 一覧・閲覧・削除 ==========
+
+def list_conversations(user_id: int, limit: int = 50) -> List[Conversation]:
+    with SessionLocal() as db:
+        return list(db.execute(
+            select(Conversation)
+            .where(Conversation.user_id == user_id)
+            .order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+            .limit(limit)
+        ).scalars())
+
+
+def list_messages(
+    user_id: int,
+    conversation_id: int,
+    before: Optional[int] = None,
+    limit: int = 50,
+) -> Optional[List[ConversationMessage]]:
+    """
+    会話のメッセージ（古い順）。before を指定するとその id より前の limit 件（さかのぼって読む）
+    - 他人の会話・存在しない会話なら None
+    """
+    with SessionLocal() as db:
+        owner = db.execute(
+            select(Conversation.user_id).where(Conversation.id == conversation_id)
+        ).scalar()
+        if owner != user_id:
+            return None
+
+        stmt = select(ConversationMessage).where(ConversationMessage.conversation_id == conversation_id)
+        if before is not None:
+            stmt = stmt.where(ConversationMessage.id < before)
+        rows = list(db.execute(stmt.order_by(ConversationMessage.id.desc()).limit(limit)).scalars())
+    rows.reverse()
+    return rows
+
+
+def delete_conversation(user_id: int, conversation_id: int) -> bool:
+    with SessionLocal() as db:
+        deleted = db.execute(
+            delete(Conversation).where(
+                Conversation.id == conversation_id,
+                Conversation.user_id == user_id,
+            )
+        ).rowcount
+        if deleted:
+            db.execute(
+                delete(ConversationMessage).where(ConversationMessage.conversation_id == conversation_id)
+            )
+        db.commit()
+    return bool(deleted)
@@ -0,0 +1,150 @@
+# backend/app/services/embeddings.py
+# ナレッジ検索用の埋め込み（ローカル・CPU のみ）
+#
+# - EMBEDDING_MODEL に sentence-transformers のモデル名（またはローカルのパス）を指定する
+# - "hash" を指定したとき / sentence-transformers が無いとき / モデルを読めないときは
+#   ハッシュで作る埋め込み（決まった結果になる、テスト・開発用）を使う
+# - どちらも長さ 1 に正規化した float32 を返す（内積 = コサイン類似度）
+
+from __future__ import annotations
+
+import importlib.util
+import math
+import os
+import re
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.knowledge_index import tokenize
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+EMBEDDING_HASH_DIM = int(os.getenv("EMBEDDING_HASH_DIM", "512"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+
+class Embedder(ABC):
+    """
+    埋め込みのインターフェイス（embed_documents が無い実装は作った時点でエラー）
+    - id: ファイル名に使える識別子（保存したベクトルを使い回せるかの判定に使う）
+    - dim: 次元数
+    - semantic: 意味の近さを表すか（False なら語の重なりしか見ない）
+    """
+
+    id = ""
+    dim = 0
+    semantic = True
+
+    @abstractmethod
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray:
+        """(件数, dim) の float32（各行は長さ 1）"""
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+
+class HashingEmbedder(Embedder):
+    """
+    ハッシュで作る埋め込み（BM25 と同じ語の区切り、語ごとに crc32 で次元と符号を決める）
+    - モデル不要・決まった結果になるので、テストやモデルが無い環境用
+    - 意味の近さは見ない（語が重なっているほど近い）
+    """
+
+    semantic = False
+
+    def __init__(self, dim: int = EMBEDDING_HASH_DIM) -> None:
+        self.dim = dim
+        self.id = f"hash{dim}"
+        self._slots: Dict[str, Tuple[int, float]] = {}
+
+    def _slot(self, term: str) -> Tuple[int, float]:
+        slot = self._slots.get(term)
+        if slot is None:
+            h = zlib.crc32(term.encode("utf-8"))
+            slot = (h % self.dim, 1.0 if h & 0x80000000 else -1.0)
+            if len(self._slots) < 1_000_000:
+                self._slots[term] = slot
+        return slot
+
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts: Dict[str, int] = {}
+            for t in tokenize(text):
+                counts[t] = counts.get(t, 0) + 1
+            row = out[i]
+            for t, tf in counts.items():
+                idx, sign = self._slot(t)
+                row[idx] += sign * (1.0 + math.log(tf))
+        return _normalize(out)
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """sentence-transformers のモデル（CPU で実行）"""
+
+    def __init__(self, model_name: str) -> None:
+        from sentence_transformers import SentenceTransformer
+
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.dim = int(self._model.get_sentence_embedding_dimension())
+        self.id = re.sub(r"[^0-9A-Za-z._-]", "_", model_name)
+
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        vecs = self._model.encode(
+            list(texts),
+            batch_size=EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        return np.ascontiguousarray(vecs, dtype=np.float32)
+
+
+def _normalize(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    mat /= norms
+    return mat
+
+
+_embedder: Optional[Embedder] = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> Embedder:
+    """
+    埋め込みを取得する（最初に呼ばれたときに 1 回だけ読み込む）
+    """
+    global _embedder
+
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = _load_embedder(EMBEDDING_MODEL)
+    return _embedder
+
+
+def _load_embedder(name: str) -> Embedder:
+    if name and name != "hash":
+        if importlib.util.find_spec("sentence_transformers") is None:
+            print("[Embedding] sentence-transformers が無いため、ハッシュ埋め込みを使います。")
+        else:
+            try:
+                return SentenceTransformerEmbedder(name)
+            except Exception as e:
+                print(f"[Embedding] モデル {name} を読み込めないため、ハッシュ埋め込みを使います: {e}")
+    return HashingEmbedder()
+
+
+def embed_texts(embedder: Embedder, texts: List[str]) -> np.ndarray:
+    """大量の文書を EMBEDDING_BATCH_SIZE ずつ埋め込んで 1 つの行列にする"""
+    mat = np.empty((len(texts), embedder.dim), dtype=np.float32)
+    step = max(EMBEDDING_BATCH_SIZE, 1) * 16
+    for i in range(0, len(texts), step):
+        mat[i:i + step] = embedder.embed_documents(texts[i:i + step])
+    return mat
@@ -0,0 +1,375 @@
+# backend/app/services/extractors.py
+# PDF / DOCX / HTML などからテキストを取り出す（拡張子ごとの登録制）
+#
+# - テキスト（.txt / .md）はそのまま UTF-8 で読む（ここは通らない）
+# - それ以外は EXTRACTORS に登録した関数で取り出す（@register_extractor(".xxx")）
+#   - .html / .htm: 標準ライブラリの html.parser（script / style は飛ばす）
+#   - .docx: 標準ライブラリの zipfile + ElementTree（word/document.xml を順に読む）
+#   - .pdf: pypdf（純 Python。入っていなければ .pdf は未対応のまま）
+#   見出しは Markdown の「# 」にして、チャンク分割（chunker.py）の区切りに使えるようにする
+# - 取り出しは別プロセス（ProcessPoolExecutor）で行う
+#   （重い解析で API のスレッドやイベントループを止めない）
+#   - 1 ファイルごとに時間の上限（EXTRACT_TIMEOUT）、プロセスごとにメモリの上限（EXTRACT_MAX_MEMORY_MB）
+#   - 上限を超えた・プロセスが落ちたときは ExtractError（そのファイルだけ取り込まない）
+#   - 止まらないプロセスがあるときは、次からは新しいプールを使い、古いプールは実行中の
+#     他のファイルが終わってから止める（他のアップロードの取り出しを巻き込まない）
+# - 登録はこのモジュールの読み込み時に行う（別プロセスでもこのモジュールを読み込んで使うため）
+
+from __future__ import annotations
+
+import importlib.util
+import io
+import multiprocessing
+import os
+import signal
+import threading
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional, Set
+from xml.etree import ElementTree
+
+# そのまま UTF-8 で読む形式
+TEXT_EXT = {".txt", ".md", ".markdown"}
+
+# 取り出しのプロセス数（0 ならプロセスを分けずにその場で実行する）
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "2"))
+# 1 ファイルの取り出しにかけてよい秒数
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "60"))
+# 取り出しプロセス 1 つのメモリの上限（MB、0 なら制限しない。Linux / macOS のみ）
+EXTRACT_MAX_MEMORY_MB = int(os.getenv("EXTRACT_MAX_MEMORY_MB", "1024"))
+# 取り出しが必要な形式の 1 ファイルの上限（丸ごと読んで渡すので、テキストより小さくする）
+EXTRACT_MAX_FILE_BYTES = int(os.getenv("EXTRACT_MAX_FILE_BYTES", str(50 * 1024 * 1024)))
+
+Extractor = Callable[[bytes], str]
+
+EXTRACTORS: Dict[str, Extractor] = {}
+CONTENT_TYPES: Dict[str, str] = {
+    ".md": "text/markdown",
+    ".markdown": "text/markdown",
+}
+
+
+class ExtractError(Exception):
+    """テキストを取り出せなかった（理由はメッセージ）"""
+
+
+def register_extractor(*exts: str, content_type: str = "application/octet-stream") -> Callable[[Extractor], Extractor]:
+    """拡張子に取り出し関数を登録する（このモジュールの読み込み時に呼ぶ）"""
+    def deco(fn: Extractor) -> Extractor:
+        for ext in exts:
+            EXTRACTORS[ext.lower()] = fn
+            CONTENT_TYPES[ext.lower()] = content_type
+        return fn
+    return deco
+
+
+def supported_extensions() -> set:
+    """取り込める拡張子（テキスト + 登録済みの形式）"""
+    return TEXT_EXT | set(EXTRACTORS)
+
+
+def needs_extraction(ext: str) -> bool:
+    return ext.lower() in EXTRACTORS
+
+
+def content_type_for_ext(ext: str) -> str:
+    return CONTENT_TYPES.get(ext.lower(), "text/plain")
+
+
+# ---- HTML ----
+
+_HTML_SKIP = {"script", "style", "noscript", "template", "svg"}
+_HTML_BLOCK = {
+    "p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article",
+    "header", "footer", "blockquote", "pre", "dd", "dt", "hr", "title",
+}
+_HTML_HEADING = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+
+
+class _HtmlText(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.lines: List[str] = []
+        self._buf: List[str] = []
+        self._skip = 0
+
+    def _newline(self) -> None:
+        line = " ".join("".join(self._buf).split())
+        self._buf.clear()
+        if line:
+            self.lines.append(line)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _HTML_SKIP:
+            self._skip += 1
+        elif tag in _HTML_HEADING:
+            self._newline()
+            self._buf.append("#" * _HTML_HEADING[tag] + " ")
+        elif tag in _HTML_BLOCK:
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in _HTML_SKIP:
+            self._skip = max(0, self._skip - 1)
+        elif tag in _HTML_HEADING:
+            self._newline()
+            self.lines.append("")
+        elif tag in _HTML_BLOCK:
+            self._newline()
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._buf.append(data)
+
+
+def _decode_html(raw: bytes) -> str:
+    """<meta charset> を見て変換（無ければ UTF-8、だめなら cp932）"""
+    head = raw[:2048].lower()
+    for enc in ("shift_jis", "shift-jis", "sjis", "euc-jp", "iso-2022-jp"):
+        if f"charset={enc}".encode() in head or f'charset="{enc}"'.encode() in head:
+            return raw.decode(enc, errors="ignore")
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("cp932", errors="ignore")
+
+
+@register_extractor(".html", ".htm", content_type="text/html")
+def extract_html(raw: bytes) -> str:
+    parser = _HtmlText()
+    parser.feed(_decode_html(raw))
+    parser.close()
+    parser._newline()
+    return "\n".join(parser.lines).strip()
+
+
+# ---- DOCX ----
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _docx_heading_styles(zf: zipfile.ZipFile) -> Dict[str, int]:
+    """スタイル id → 見出しレベル（日本語版 Word は id が "1" などなので、名前の heading N で見る）"""
+    try:
+        root = ElementTree.fromstring(zf.read("word/styles.xml"))
+    except KeyError:
+        return {}
+    levels = {}
+    for style in root.iter(f"{_W}style"):
+        name = style.find(f"{_W}name")
+        if name is None:
+            continue
+        value = (name.get(f"{_W}val") or "").lower()
+        if value.startswith("heading ") and value[8:].isdigit():
+            levels[style.get(f"{_W}styleId")] = int(value[8:])
+        elif value == "title":
+            levels[style.get(f"{_W}styleId")] = 1
+    return levels
+
+
+@register_extractor(
+    ".docx",
+    content_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+)
+def extract_docx(raw: bytes) -> str:
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(raw))
+    except zipfile.BadZipFile as e:
+        raise ExtractError(f"DOCX を読めません: {e}") from e
+
+    with zf:
+        headings = _docx_heading_styles(zf)
+        lines: List[str] = []
+        try:
+            f = zf.open("word/document.xml")
+        except KeyError as e:
+            raise ExtractError("DOCX の本文（word/document.xml）がありません") from e
+        with f:
+            # 段落ごとに読んで捨てる（大きな文書でも木全体を持たない）
+            for _, elem in ElementTree.iterparse(f, events=("end",)):
+                if elem.tag != f"{_W}p":
+                    continue
+                parts = []
+                for node in elem.iter():
+                    if node.tag == f"{_W}t" and node.text:
+                        parts.append(node.text)
+                    elif node.tag == f"{_W}tab":
+                        parts.append("\t")
+                    elif node.tag in (f"{_W}br", f"{_W}cr"):
+                        parts.append("\n")
+                text = "".join(parts).strip()
+                style = elem.find(f"{_W}pPr/{_W}pStyle")
+                level = headings.get(style.get(f"{_W}val")) if style is not None else None
+                if level and text:
+                    lines.extend(["", "#" * level + " " + text.replace("\n", " "), ""])
+                elif text:
+                    lines.append(text)
+                elem.clear()
+    return "\n".join(lines).strip()
+
+
+# ---- PDF（pypdf があるときだけ）----
+
+if importlib.util.find_spec("pypdf") is not None:
+
+    @register_extractor(".pdf", content_type="application/pdf")
+    def extract_pdf(raw: bytes) -> str:
+        from pypdf import PdfReader
+        from pypdf.errors import PdfReadError
+
+        try:
+            reader = PdfReader(io.BytesIO(raw))
+            if reader.is_encrypted:
+                raise ExtractError("パスワード付きの PDF は読めません")
+            # ページの間は空行（段落の区切りとして扱われる）
+            return "\n\n".join((page.extract_text() or "").strip() for page in reader.pages).strip()
+        except PdfReadError as e:
+            raise ExtractError(f"PDF を読めません: {e}") from e
+
+
+# ---- 別プロセスでの実行 ----
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+# プールごとの実行中の取り出し（止まらないプロセスがあるプールを止める前に、他の分を待つ）
+_running: Dict[ProcessPoolExecutor, Set[Future]] = {}
+
+
+def _init_worker(max_memory_mb: int) -> None:
+    """取り出しプロセスの初期化：メモリの上限を付ける"""
+    if max_memory_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:  # Windows
+        return
+    limit = max_memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _on_timeout(signum, frame):
+    raise TimeoutError()
+
+
+def _run_extractor(ext: str, raw: bytes, timeout: float) -> str:
+    """取り出しプロセスで実行する（時間の上限はプロセスの中のタイマーで止める）"""
+    use_alarm = timeout > 0 and hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return EXTRACTORS[ext](raw)
+    except TimeoutError:
+        raise ExtractError(f"テキストの取り出しが {timeout:g} 秒で終わりませんでした") from None
+    except MemoryError:
+        raise ExtractError(f"テキストの取り出しがメモリの上限（{EXTRACT_MAX_MEMORY_MB}MB）を超えました") from None
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # fork だと親（埋め込みモデルなど）のメモリを引き継いで上限に当たるので spawn
+                _pool = ProcessPoolExecutor(
+                    max_workers=EXTRACT_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(EXTRACT_MAX_MEMORY_MB,),
+                )
+    return _pool
+
+
+def _reset_pool(pool: ProcessPoolExecutor) -> None:
+    """止まらない・落ちたプロセスごとプールを作り直す（次の呼び出しで新しく作る）"""
+    global _pool
+
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+        _running.pop(pool, None)
+    for proc in list((getattr(pool, "_processes", None) or {}).values()):
+        proc.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _retire_pool(pool: ProcessPoolExecutor, stuck: Future) -> None:
+    """
+    止まらないプロセスのあるプールを外す（次の呼び出しからは新しいプールを使う）
+    - 同じプールで実行中の他のファイルは終わるまで（それぞれの時間の上限まで）待ち、
+      それからプロセスごと止める（1 つのプロセスを止めるとプール全体が使えなくなるため）
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+        others = [f for f in _running.get(pool, ()) if f is not stuck]
+
+    def finish() -> None:
+        wait_futures(others, timeout=EXTRACT_TIMEOUT + 10 if EXTRACT_TIMEOUT > 0 else None)
+        _reset_pool(pool)
+
+    threading.Thread(target=finish, name="extract-retire", daemon=True).start()
+
+
+def extract_text(name: str, raw: bytes, timeout: float = EXTRACT_TIMEOUT) -> str:
+    """
+    登録済みの形式のファイルからテキストを取り出す（別プロセスで実行し、終わるまで待つ）
+    - 取り出せなかったときは ExtractError
+    """
+    ext = os.path.splitext(name)[1].lower()
+    if ext not in EXTRACTORS:
+        raise ExtractError(f"未対応形式です: {ext or '(拡張子なし)'}")
+
+    if EXTRACT_WORKERS <= 0:
+        try:
+            return _run_extractor(ext, raw, 0)
+        except ExtractError:
+            raise
+        except Exception as e:
+            raise ExtractError(f"テキストを取り出せません: {type(e).__name__}: {e}") from e
+
+    pool = _get_pool()
+    future: Optional[Future] = None
+    try:
+        future = pool.submit(_run_extractor, ext, raw, timeout)
+        with _pool_lock:
+            _running.setdefault(pool, set()).add(future)
+        # プロセスの中のタイマーで止まらなかったとき（C の処理の中など）の保険
+        return future.result(timeout=timeout + 10 if timeout > 0 else None)
+    except FutureTimeoutError:
+        _retire_pool(pool, future)
+        raise ExtractError(f"テキストの取り出しが {timeout:g} 秒で終わりませんでした") from None
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        raise ExtractError("テキストの取り出し中にプロセスが停止しました（メモリ不足など）") from None
+    except MemoryError:
+        # ファイルを受け取る時点で上限を超えた
+        raise ExtractError(f"テキストの取り出しがメモリの上限（{EXTRACT_MAX_MEMORY_MB}MB）を超えました") from None
+    except ExtractError:
+        raise
+    except Exception as e:
+        raise ExtractError(f"テキストを取り出せません: {type(e).__name__}: {e}") from e
+    finally:
+        if future is not None:
+            with _pool_lock:
+                _running.get(pool, set()).discard(future)
+
+
+def shutdown_extractors() -> None:
+    global _pool
+
+    with _pool_lock:
+        pool, _pool = _pool, None
+        _running.clear()
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
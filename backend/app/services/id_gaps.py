@@ -0,0 +1,66 @@
+# backend/app/services/id_gaps.py
+# 「前回読んだ id より大きい行」だけを読む同期で、id の抜けを覚えておく
+#
+# - id は採番した順だが、コミットの順は前後することがある（PostgreSQL で同時に書き込んだとき）
+#   大きい id が先に見えて読み進めると、後からコミットされた小さい id を読み飛ばしてしまう
+# - 読んだ範囲で抜けていた id を覚えておき、次の同期ではそれも読む（IN で引く）
+# - ロールバックなどで永久に来ない id もあるので、ID_GAP_TIMEOUT 秒たったら諦める
+# - knowledge_events（knowledge_service）/ revoked_tokens（token_revocation）/
+#   user_invalidations（principal_cache）で使う
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+# 抜けている id を待つ秒数（書き込みのトランザクションがこれより長く開いていることはない）
+ID_GAP_TIMEOUT = float(os.getenv("ID_GAP_TIMEOUT", "60"))
+# 覚えておく抜けの数の上限（大きく飛んだときは新しい方だけ）
+_MAX_GAPS = 1000
+
+
+class IdGaps:
+    """まだ見えていない id → 最初に気づいた時刻"""
+
+    def __init__(self, timeout: float = ID_GAP_TIMEOUT, limit: int = _MAX_GAPS):
+        self.timeout = timeout
+        self.limit = limit
+        self._gaps: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def pending(self) -> List[int]:
+        """まだ待っている id（時間切れのものは捨てる）"""
+        now = time.monotonic()
+        with self._lock:
+            for i in [i for i, since in self._gaps.items() if now - since > self.timeout]:
+                del self._gaps[i]
+            return sorted(self._gaps)
+
+    def update(self, after: int, seen: Iterable[int], upto: Optional[int] = None) -> None:
+        """
+        after より後を読んだ結果を記録する
+        - seen: 読めた id（抜けとして待っていたものも含む）
+        - upto: 読んだ範囲の終わり（省略時は seen の最大）。after < id <= upto で見えなかった id を抜けとして覚える
+        """
+        seen = set(seen)
+        if upto is None:
+            upto = max(seen, default=after)
+        now = time.monotonic()
+        with self._lock:
+            for i in seen:
+                self._gaps.pop(i, None)
+            for i in range(max(after + 1, upto - self.limit + 1), upto + 1):
+                if i not in seen:
+                    self._gaps.setdefault(i, now)
+            if len(self._gaps) > self.limit:
+                for i in sorted(self._gaps)[:len(self._gaps) - self.limit]:
+                    del self._gaps[i]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._gaps.clear()
+
+    def __len__(self) -> int:
+        return len(self._gaps)
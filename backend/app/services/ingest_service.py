@@ -0,0 +1,355 @@
+# backend/app/services/ingest_service.py
+# ナレッジ取り込みのジョブキュー（プロセス内のワーカー + DB の knowledge_jobs テーブル）
+#
+# - アップロードは文書を status=pending で保存し、ジョブを登録するだけ（すぐ返す）
+# - ワーカーがジョブを取り、チャンク分割 → 検索用インデックス / 埋め込み → ナレッジに反映
+#   （溜まっているジョブはまとめて取り、1 つのセグメントで 1 回だけ反映する）
+#   本文は knowledge_doc_parts から 1 つずつ読みながら行・チャンクに分ける（本文全体をつなげない）
+# - 文書の status は pending → indexing → ready（失敗したら error と理由）
+#   INGEST_MAX_DOC_CHARS を指定すると、それを超える文書は読み込まずに error にする
+# - ジョブは DB にあるので、再起動しても続きから処理される
+#   （複数ワーカーでも pending → running の UPDATE に成功した 1 つだけが処理する）
+
+from __future__ import annotations
+
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.orm import Session
+
+from app.db import SessionLocal
+from app.models.knowledge import (
+    DOC_ERROR,
+    DOC_INDEXING,
+    DOC_READY,
+    JOB_CANCELLED,
+    JOB_DONE,
+    JOB_ERROR,
+    JOB_PENDING,
+    JOB_RUNNING,
+    KnowledgeDoc,
+    KnowledgeDocPart,
+    KnowledgeJob,
+)
+from app.services.knowledge_index import KnowledgeSnapshot, Segment, db_doc_key
+from app.services.knowledge_service import get_snapshot, iter_doc_content, upsert_knowledge_docs
+from app.services.retrievers import get_retriever, reuse_vectors
+
+# ワーカーのスレッド数（0 ならアップロードのリクエスト内でそのまま処理する）
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# 新しいジョブを確認する間隔（秒）。同じプロセスで登録したジョブはすぐに起こす
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "2"))
+# running のままこの秒数を過ぎたジョブは、ワーカーが落ちたとみなしてやり直す
+INGEST_STALE_AFTER = float(os.getenv("INGEST_STALE_AFTER", "600"))
+# やり直しの上限（超えたら error）
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+# 溜まっているジョブをまとめて取る上限（まとめた分は 1 つのセグメント・1 回の反映になる）
+INGEST_BATCH_DOCS = int(os.getenv("INGEST_BATCH_DOCS", "5000"))
+# 1 文書の本文の上限（文字数、0 なら制限しない）。検索用のインデックスは全行をメモリに持つので、
+# ワーカーのメモリが少ないときに指定する（超えた文書は error にする）
+INGEST_MAX_DOC_CHARS = int(os.getenv("INGEST_MAX_DOC_CHARS", "0"))
+
+_wake = threading.Event()
+_stop = threading.Event()
+_workers: List[threading.Thread] = []
+
+
+def enqueue_docs(db: Session, doc_ids: List[int], inline: Optional[bool] = None) -> List[int]:
+    """
+    文書の取り込みジョブを 1 回の INSERT でまとめて登録し、ジョブの id を返す
+    - inline: その場で処理するか（None ならこのプロセスでワーカーが動いていないときだけ）
+      False なら登録だけして、サーバーのワーカーに任せる（tools のスクリプトなど）
+    """
+    if not doc_ids:
+        return []
+
+    job_ids = list(db.scalars(
+        insert(KnowledgeJob).returning(KnowledgeJob.id, sort_by_parameter_order=True),
+        [{"doc_id": doc_id, "status": JOB_PENDING} for doc_id in doc_ids],
+    ).all())
+    db.commit()
+
+    if inline is None:
+        inline = not _workers
+    if inline:
+        claimed = _claim(db, job_ids)
+        if claimed:
+            run_jobs(db, claimed)
+    else:
+        _wake.set()
+    return job_ids
+
+
+def _claim(db: Session, job_ids: List[int]) -> List[int]:
+    """
+    pending のジョブをまとめて running にし、取れたものの id を返す
+    - 他のワーカーが先に取っていたものは含まない（claimed_by で自分の分を見分ける）
+    """
+    if not job_ids:
+        return []
+
+    token = uuid.uuid4().hex
+    (
+        db.query(KnowledgeJob)
+        .filter(KnowledgeJob.id.in_(job_ids), KnowledgeJob.status == JOB_PENDING)
+        .update(
+            {
+                KnowledgeJob.status: JOB_RUNNING,
+                KnowledgeJob.claimed_by: token,
+                KnowledgeJob.started_at: datetime.utcnow(),
+                KnowledgeJob.attempts: KnowledgeJob.attempts + 1,
+            },
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    rows = (
+        db.query(KnowledgeJob.id)
+        .filter(KnowledgeJob.id.in_(job_ids), KnowledgeJob.claimed_by == token)
+        .order_by(KnowledgeJob.id)
+        .all()
+    )
+    return [row.id for row in rows]
+
+
+def _claim_next(db: Session, limit: int = INGEST_BATCH_DOCS) -> List[int]:
+    """古いものから pending のジョブを最大 limit 件まとめて取る"""
+    rows = (
+        db.query(KnowledgeJob.id)
+        .filter(KnowledgeJob.status == JOB_PENDING)
+        .order_by(KnowledgeJob.id)
+        .limit(limit)
+        .all()
+    )
+    return _claim(db, [row.id for row in rows])
+
+
+def run_jobs(db: Session, job_ids: List[int]) -> None:
+    """
+    取り込みジョブをまとめて処理する（running にしてから呼ぶ）
+    - 全文書で 1 つのセグメントを作り、ナレッジへの反映も 1 回にする
+    - 差し替えの文書は、変わったチャンクだけ埋め込み直す
+    - チャンク分割・検索用インデックス・埋め込みはナレッジに反映する前にここで作る
+      （反映のときにロックを持ったまま重い処理をしない）
+    - まとめて失敗したときは 1 件ずつやり直し、失敗した文書だけを error にする
+    """
+    jobs = db.query(KnowledgeJob).filter(KnowledgeJob.id.in_(job_ids)).all()
+    if not jobs:
+        return
+    # 本文は読まない（セグメントを作るときに 1 文書ずつ、続きも 1 つずつ読む）
+    # 本文の文字数と続きの数は先に読んでおく（ORM のオブジェクトにしない：処理中に削除されても読み直しで失敗しない）
+    docs = {
+        row.id: row
+        for row in db.query(
+            KnowledgeDoc.id,
+            func.coalesce(func.length(KnowledgeDoc.content), 0).label("chars"),
+            KnowledgeDoc.part_count,
+        )
+        .filter(KnowledgeDoc.id.in_({j.doc_id for j in jobs}))
+    }
+
+    # 取り込み前に削除された文書のジョブは何もせず終わり
+    doc_ids = sorted(docs)
+    _set_status(db, doc_ids, DOC_INDEXING)
+
+    # 長すぎる文書は本文を読まずに error にする（ジョブも error）
+    too_long = _oversized_docs(db, docs) if INGEST_MAX_DOC_CHARS > 0 else set()
+    if too_long:
+        message = f"本文が長すぎます（上限 {INGEST_MAX_DOC_CHARS} 文字）"
+        print(f"[Ingest] 文書 {sorted(too_long)} は{message}")
+        _set_status(db, sorted(too_long), DOC_ERROR, message=message)
+        for job in jobs:
+            if job.doc_id in too_long:
+                job.status = JOB_ERROR
+                job.error_message = message
+                job.finished_at = datetime.utcnow()
+        jobs = [job for job in jobs if job.doc_id not in too_long]
+        doc_ids = [doc_id for doc_id in doc_ids if doc_id not in too_long]
+    db.commit()
+    if not jobs:
+        return
+
+    try:
+        seg = Segment.build(
+            (db_doc_key(doc_id), iter_doc_content(db, doc_id, docs[doc_id].part_count))
+            for doc_id in doc_ids
+        )
+        # 差し替えの文書は、変わっていないチャンクの埋め込みを前の版から引き継ぐ
+        reused = reuse_vectors(seg, get_snapshot())
+        if reused:
+            print(f"[Ingest] 変わっていない {reused} / {len(seg.chunk_starts)} チャンクの埋め込みを引き継ぎました。")
+        get_retriever().prepare(KnowledgeSnapshot.from_segment(seg, 0))
+
+        # 他のワーカーは DB の status を見て反映するので、先に ready にしておく
+        # （処理中に削除された文書は UPDATE されないので、残っている文書だけを反映する）
+        if doc_ids:
+            db.execute(
+                update(KnowledgeDoc.__table__)
+                .where(KnowledgeDoc.__table__.c.id == bindparam("doc_id"))
+                .values(chunk_count=bindparam("chunk_count")),
+                [
+                    {"doc_id": doc_id, "chunk_count": len(seg.doc_chunks(db_doc_key(doc_id)))}
+                    for doc_id in doc_ids
+                ],
+            )
+        if _set_status(db, doc_ids, DOC_READY, DOC_INDEXING) != len(doc_ids):
+            doc_ids = [
+                row.id for row in db.query(KnowledgeDoc.id)
+                .filter(KnowledgeDoc.id.in_(doc_ids), KnowledgeDoc.status == DOC_READY)
+            ]
+        db.commit()
+
+        if doc_ids:
+            upsert_knowledge_docs(doc_ids, seg, db=db)
+        status, message = JOB_DONE, None
+    except Exception as e:
+        db.rollback()
+        if len(jobs) > 1:
+            print(f"[Ingest] {len(jobs)} 件まとめての取り込みに失敗したため、1 件ずつやり直します: {e}")
+            for job in jobs:
+                run_jobs(db, [job.id])
+            return
+
+        print(f"[Ingest] 文書 {jobs[0].doc_id} の取り込みに失敗しました: {e}")
+        status, message = JOB_ERROR, f"{type(e).__name__}: {e}"[:1000]
+        _set_status(db, doc_ids, DOC_ERROR, message=message)
+
+    now = datetime.utcnow()
+    for job in jobs:
+        job.status = status
+        job.error_message = message
+        job.finished_at = now
+    db.commit()
+
+
+def _oversized_docs(db: Session, docs: Dict[int, Any]) -> Set[int]:
+    """
+    本文（content と knowledge_doc_parts の続き）が INGEST_MAX_DOC_CHARS を超える文書の id
+    - 続きの文字数は DB で数える（本文は読まない）
+    """
+    sizes = {doc_id: row.chars for doc_id, row in docs.items()}
+    long_ids = [doc_id for doc_id, row in docs.items() if row.part_count]
+    if long_ids:
+        rows = (
+            db.query(KnowledgeDocPart.doc_id, func.sum(func.length(KnowledgeDocPart.content)))
+            .join(KnowledgeDoc, KnowledgeDoc.id == KnowledgeDocPart.doc_id)
+            .filter(KnowledgeDocPart.doc_id.in_(long_ids), KnowledgeDocPart.seq <= KnowledgeDoc.part_count)
+            .group_by(KnowledgeDocPart.doc_id)
+        )
+        for doc_id, chars in rows:
+            sizes[doc_id] += int(chars or 0)
+    return {doc_id for doc_id, chars in sizes.items() if chars > INGEST_MAX_DOC_CHARS}
+
+
+def _set_status(
+    db: Session,
+    doc_ids: List[int],
+    status: str,
+    current: Optional[str] = None,
+    message: Optional[str] = None,
+) -> int:
+    """
+    文書の status を UPDATE でまとめて変え、変わった件数を返す（commit は呼び出し側）
+    - 削除済みの文書は対象にならない（ORM で書くと StaleDataError になる）
+    - current を指定すると、その status の文書だけを変える
+    """
+    if not doc_ids:
+        return 0
+    stmt = update(KnowledgeDoc).where(KnowledgeDoc.id.in_(doc_ids))
+    if current is not None:
+        stmt = stmt.where(KnowledgeDoc.status == current)
+    return db.execute(
+        stmt.values(status=status, error_message=message),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+
+
+def cancel_doc_jobs(db: Session, doc_id: int) -> int:
+    """
+    文書を削除するときに、まだ始まっていないジョブを取り消す（commit は呼び出し側）
+    - 処理中のジョブは、ready にするときの UPDATE が当たらないので反映されない
+    """
+    return (
+        db.query(KnowledgeJob)
+        .filter(KnowledgeJob.doc_id == doc_id, KnowledgeJob.status == JOB_PENDING)
+        .update(
+            {
+                KnowledgeJob.status: JOB_CANCELLED,
+                KnowledgeJob.finished_at: datetime.utcnow(),
+            },
+            synchronize_session=False,
+        )
+    )
+
+
+def recover_stale_jobs(db: Session) -> int:
+    """
+    running のまま止まっているジョブ（ワーカーが落ちた）を pending に戻す
+    - やり直しの上限を超えたものは error にする
+    """
+    limit = datetime.utcnow() - timedelta(seconds=INGEST_STALE_AFTER)
+    stale = (
+        db.query(KnowledgeJob)
+        .filter(KnowledgeJob.status == JOB_RUNNING, KnowledgeJob.started_at < limit)
+        .all()
+    )
+    for job in stale:
+        if job.attempts >= INGEST_MAX_ATTEMPTS:
+            job.status = JOB_ERROR
+            job.error_message = "処理中にワーカーが停止しました"
+            job.finished_at = datetime.utcnow()
+            _set_status(db, [job.doc_id], DOC_ERROR, message=job.error_message)
+        else:
+            job.status = JOB_PENDING
+    db.commit()
+    return len(stale)
+
+
+def _worker_loop(poll: float) -> None:
+    while not _stop.is_set():
+        try:
+            with SessionLocal() as db:
+                recover_stale_jobs(db)
+                job_ids = _claim_next(db)
+                if job_ids:
+                    run_jobs(db, job_ids)
+                    continue
+        except Exception as e:
+            print(f"[Ingest] ワーカーでエラーが発生しました: {e}")
+
+        _wake.wait(poll)
+        _wake.clear()
+
+
+def start_ingest_workers(workers: int = INGEST_WORKERS, poll: float = INGEST_POLL_INTERVAL) -> None:
+    """取り込みワーカーを起動する（起動時に 1 回呼ぶ）"""
+    if workers <= 0 or _workers:
+        return
+
+    _stop.clear()
+    for i in range(workers):
+        t = threading.Thread(target=_worker_loop, args=(poll,), name=f"knowledge-ingest-{i}", daemon=True)
+        t.start()
+        _workers.append(t)
+
+
+def stop_ingest_workers() -> None:
+    _stop.set()
+    _wake.set()
+    _workers.clear()
+
+
+def get_ingest_stats(db: Session) -> Dict[str, int]:
+    """管理画面用：状態ごとのジョブ数"""
+    rows = (
+        db.query(KnowledgeJob.status, func.count(KnowledgeJob.id))
+        .group_by(KnowledgeJob.status)
+        .all()
+    )
+    stats = {JOB_PENDING: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_ERROR: 0, JOB_CANCELLED: 0}
+    stats.update({status: count for status, count in rows})
+    return stats
@@ -0,0 +1,303 @@
+# backend/app/services/knowledge_index.py
+# ナレッジ検索用のインデックス（セグメント単位）
+#
+# - 全件読み込み時は全文書で 1 つのセグメントを作る
+# - 文書の追加/差し替えは、その文書だけの小さなセグメントを追加する
+# - 文書の削除は、その文書の行を「削除済み」として扱う（セグメント自体は作り直さない）
+# - セグメントが増えすぎたら、生きている文書だけで 1 つにまとめ直す
+# - 全体は KnowledgeSnapshot（変更しない）として持ち、更新のたびに丸ごと差し替える
+# - 行はさらにチャンク（見出し・段落単位の行範囲、chunker.py）にまとめておき、
+#   プロンプトにはチャンク単位で渡す
+
+from __future__ import annotations
+
+import re
+from array import array
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, List, Mapping, NamedTuple, Set, Tuple, Union
+
+from app.services.chunker import ChunkBuilder, estimate_tokens, iter_lines
+
+
+def normalize_text(query: str) -> str:
+    """
+    日本語クエリ用の簡易正規化：
+    - 全角/半角の「?」「？」「。」「、」などの記号・空白を削除
+    - 文字だけを残す
+    """
+    q = query.strip()
+    # 記号・空白をざっくり削る
+    q = re.sub(r"[？\?！!。、．\.,\s・]", "", q)
+    return q
+
+
+def cache_query_key(query: str) -> str:
+    """
+    キャッシュのキーにする質問（前後の空白を削り、連続する空白を 1 つにするだけ）
+    - normalize_text は記号も消すので、"3.5" と "35" のような別の質問が同じになる。キーには使わない
+    """
+    return " ".join(query.split())
+
+
+# 英数字の単語 / それ以外（日本語など）の連続。記号・全角の句読点は区切り
+_TOKEN_RE = re.compile(r"[0-9a-z]+|[^\x00-\x7f　-〿・！-／：-＠]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    検索用の語に分ける（BM25・ハッシュ埋め込みで使う）
+    - 英数字は小文字の単語
+    - 日本語などは 2 文字ずつ（1 文字だけのときはその 1 文字）
+    """
+    out: List[str] = []
+    for m in _TOKEN_RE.finditer(text.lower()):
+        w = m.group()
+        if w.isascii() or len(w) == 1:
+            out.append(w)
+        else:
+            out.extend(w[i:i + 2] for i in range(len(w) - 1))
+    return out
+
+
+def db_doc_key(doc_id: int) -> str:
+    """knowledge_docs テーブルの文書キー"""
+    return f"db:{doc_id}"
+
+
+def file_doc_key(name: str) -> str:
+    """静的ファイル（company_docs）の文書キー"""
+    return f"file:{name}"
+
+
+class Segment:
+    """
+    1 つ以上の文書の行をまとめた検索単位（構築後は変更しない）
+
+    - lines / norms / denoms はセグメント内の行番号で対応
+      - norms: 正規化済みの行
+      - denoms: 長さペナルティの分母 max(5, len) ** 0.5
+    - postings: 正規化後の文字 → 行番号リスト（昇順、重複なし）
+    - doc_ranges: 文書キー → (開始行, 終了行)
+    - chunk_*: チャンク番号で対応（チャンクは文書をまたがない、文書内では開始行の昇順）
+      - chunk_starts / chunk_ends: 行範囲 [開始行, 終了行)
+      - chunk_heads: セクションの見出し行（無ければ -1）
+      - chunk_tokens: 見出しを含めたトークン数の見積もり
+    - line_chunk: 行番号 → その行を含む最初のチャンク
+    """
+
+    __slots__ = (
+        "lines", "norms", "denoms", "postings", "doc_ranges",
+        "chunk_starts", "chunk_ends", "chunk_heads", "chunk_tokens", "line_chunk",
+        "__weakref__",
+    )
+
+    def __init__(self) -> None:
+        self.lines: List[str] = []
+        self.norms: List[str] = []
+        self.denoms = array("d")
+        self.postings: Dict[str, List[int]] = {}
+        self.doc_ranges: Dict[str, Tuple[int, int]] = {}
+        self.chunk_starts = array("Q")
+        self.chunk_ends = array("Q")
+        self.chunk_heads = array("q")
+        self.chunk_tokens = array("I")
+        self.line_chunk = array("I")
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def _append(self, line: str, line_norm: str) -> None:
+        idx = len(self.lines)
+        self.lines.append(line)
+        self.norms.append(line_norm)
+        self.denoms.append(max(5, len(line_norm)) ** 0.5)
+        for c in set(line_norm):
+            self.postings.setdefault(c, []).append(idx)
+
+    def _append_chunk(self, start: int, end: int, head: int, tokens: int) -> None:
+        cid = len(self.chunk_starts)
+        self.chunk_starts.append(start)
+        self.chunk_ends.append(end)
+        self.chunk_heads.append(head)
+        self.chunk_tokens.append(tokens)
+        # 重なっている行は前のチャンクのまま
+        if len(self.line_chunk) < end:
+            self.line_chunk.extend([cid] * (end - len(self.line_chunk)))
+
+    @classmethod
+    def build(cls, docs: Iterable[Tuple[str, Union[str, Iterable[str]]]]) -> "Segment":
+        """
+        (文書キー, 本文) の列からセグメントを作る
+        - 本文は文字列か、少しずつ返すイテレータ（長い文書の knowledge_doc_parts など）
+          イテレータのときは 1 つずつ読みながら行・チャンクに分ける（本文全体をつなげない）
+        - 本文は行に分割し、空行は捨てる（CRLF, LF 両方に対応）
+        - 空行・見出しをもとにチャンクに分ける
+        """
+        seg = cls()
+        for key, text in docs:
+            start = len(seg.lines)
+            builder = ChunkBuilder()
+            for t in iter_lines([text] if isinstance(text, str) else text):
+                seg._append(t.text, normalize_text(t.text))
+                seg._append_chunks(start, builder.add(t, estimate_tokens(t.text)))
+            seg._append_chunks(start, builder.finish())
+            seg.doc_ranges[key] = (start, len(seg.lines))
+        return seg
+
+    def _append_chunks(self, start: int, chunks: Iterable[Tuple[int, int, int, int]]) -> None:
+        """ChunkBuilder のチャンク（文書内の行番号）を、start だけずらして追加する"""
+        for a, b, head, n in chunks:
+            self._append_chunk(start + a, start + b, start + head if head >= 0 else -1, n)
+
+    @classmethod
+    def merge(cls, parts: Iterable[Tuple["Segment", Iterable[str]]]) -> "Segment":
+        """
+        (セグメント, 残す文書キー) の列から、生きている文書だけで 1 つにまとめる
+        - 正規化済みの行・チャンクをそのまま使うので、正規表現・分割はかけ直さない
+        """
+        seg = cls()
+        for src, keys in parts:
+            for key in keys:
+                a, b = src.doc_ranges[key]
+                start = len(seg.lines)
+                for i in range(a, b):
+                    seg._append(src.lines[i], src.norms[i])
+                shift = start - a
+                for c in src.doc_chunks(key):
+                    head = src.chunk_heads[c]
+                    seg._append_chunk(
+                        src.chunk_starts[c] + shift,
+                        src.chunk_ends[c] + shift,
+                        head + shift if head >= 0 else -1,
+                        src.chunk_tokens[c],
+                    )
+                seg.doc_ranges[key] = (start, len(seg.lines))
+        return seg
+
+    def doc_lines(self, key: str) -> Set[int]:
+        a, b = self.doc_ranges[key]
+        return set(range(a, b))
+
+    def doc_chunks(self, key: str) -> range:
+        """文書のチャンク番号（文書内のチャンクは連続している）"""
+        a, b = self.doc_ranges[key]
+        if a == b:
+            return range(0)
+        first = self.line_chunk[a]
+        last = first
+        while last + 1 < len(self.chunk_starts) and self.chunk_starts[last + 1] < b:
+            last += 1
+        return range(first, last + 1)
+
+    def chunk_text(self, c: int) -> str:
+        """チャンクの本文（見出しが範囲の外なら先頭に付ける）"""
+        a, b, head = self.chunk_starts[c], self.chunk_ends[c], self.chunk_heads[c]
+        lines = [self.lines[i] for i in range(a, b)]
+        if 0 <= head < a:
+            lines.insert(0, self.lines[head])
+        return "\n".join(lines)
+
+
+class KnowledgeSnapshot(NamedTuple):
+    """
+    ある時点のナレッジ全体（変更しない）
+
+    - version: ナレッジのバージョン（全ワーカー共通の番号）
+    - segments: 検索対象のセグメント
+    - dead_lines: セグメントごとの削除済み行番号
+    - doc_segment: 文書キー → その文書が入っているセグメントの位置
+    - 更新は with_doc / without_doc / compacted で新しいスナップショットを作る
+    - 読み手はリクエストの最初に 1 回だけ取得して使い続ける
+      （途中で差し替わっても、作りかけ・混ざった状態は見えない）
+    """
+
+    version: int
+    segments: Tuple[Segment, ...]
+    dead_lines: Tuple[FrozenSet[int], ...]
+    doc_segment: Mapping[str, int]
+
+    @classmethod
+    def empty(cls, version: int = 0) -> "KnowledgeSnapshot":
+        return cls(version, (), (), MappingProxyType({}))
+
+    @classmethod
+    def from_segment(cls, seg: Segment, version: int) -> "KnowledgeSnapshot":
+        return cls(
+            version,
+            (seg,),
+            (frozenset(),),
+            MappingProxyType({key: 0 for key in seg.doc_ranges}),
+        )
+
+    @property
+    def line_count(self) -> int:
+        return sum(len(seg) for seg in self.segments) - self.dead_count
+
+    @property
+    def dead_count(self) -> int:
+        return sum(len(d) for d in self.dead_lines)
+
+    def without_doc(self, key: str, version: int) -> "KnowledgeSnapshot":
+        """文書の行を削除済みにしたスナップショット（文書が無ければバージョンだけ更新）"""
+        return self.without_docs((key,), version)
+
+    def without_docs(self, keys: Iterable[str], version: int) -> "KnowledgeSnapshot":
+        """複数の文書をまとめて削除済みにする（辞書・削除済み行のコピーは 1 回だけ）"""
+        dead_lines = list(self.dead_lines)
+        doc_segment = dict(self.doc_segment)
+        for key in keys:
+            si = doc_segment.pop(key, None)
+            if si is not None:
+                dead_lines[si] = dead_lines[si] | self.segments[si].doc_lines(key)
+
+        return KnowledgeSnapshot(
+            version, self.segments, tuple(dead_lines), MappingProxyType(doc_segment)
+        )
+
+    def with_doc(self, key: str, seg: Segment, version: int) -> "KnowledgeSnapshot":
+        """文書を追加 / 差し替えたスナップショット（seg はその文書だけのセグメント）"""
+        base = self.without_doc(key, version)
+        return KnowledgeSnapshot(
+            version,
+            base.segments + (seg,),
+            base.dead_lines + (frozenset(),),
+            MappingProxyType({**base.doc_segment, key: len(base.segments)}),
+        )
+
+    def with_docs(self, keys: Iterable[str], seg: Segment, version: int) -> "KnowledgeSnapshot":
+        """
+        複数の文書を 1 つのセグメントでまとめて追加 / 差し替える（一括取り込み用）
+        - keys のうち seg に行が無い文書は削除扱い
+        - seg に入っていても keys に無い文書の行は削除済みにする
+        """
+        keys = set(keys)
+        base = self.without_docs(keys, version)
+        live = {
+            key for key in keys
+            if key in seg.doc_ranges and seg.doc_ranges[key][0] < seg.doc_ranges[key][1]
+        }
+        if not live:
+            return base
+
+        dead: Set[int] = set()
+        for key in seg.doc_ranges:
+            if key not in live:
+                dead |= seg.doc_lines(key)
+        si = len(base.segments)
+        return KnowledgeSnapshot(
+            version,
+            base.segments + (seg,),
+            base.dead_lines + (frozenset(dead),),
+            MappingProxyType({**base.doc_segment, **{key: si for key in live}}),
+        )
+
+    def compacted(self) -> "KnowledgeSnapshot":
+        """
+        生きている文書だけで 1 つのセグメントにまとめ直したスナップショット
+        - DB は読まない（メモリ上の行をそのまま使う）
+        """
+        parts = []
+        for si, seg in enumerate(self.segments):
+            keys = [k for k in seg.doc_ranges if self.doc_segment.get(k) == si]
+            parts.append((seg, keys))
+        return KnowledgeSnapshot.from_segment(Segment.merge(parts), self.version)
@@ -0,0 +1,341 @@
+# backend/app/services/knowledge_mmap.py
+# ナレッジのインデックスをファイルに書き出し、読み込み専用で mmap する
+#
+# - reload_knowledge_cache（全件）やまとめ直しのときに 1 回だけ書き出す
+# - 各ワーカーは同じファイルを mmap するので、ページは OS のページキャッシュで共有される
+#   （ワーカーごとに全文の Python 文字列を持たない）
+#
+# ファイル形式（リトルエンディアン、各セクションは 8 バイト境界）
+#   ヘッダ: magic, 形式バージョン, ナレッジのバージョン, 行数, 文書数, 語数, セクション表
+#   0  行のオフセット        Q * (行数 + 1)
+#   1  行の本文              UTF-8
+#   2  正規化済み行のオフセット Q * (行数 + 1)
+#   3  正規化済み行           UTF-8
+#   4  長さペナルティの分母    d * 行数
+#   5  文書キーのオフセット    Q * (文書数 + 1)
+#   6  文書キー              UTF-8
+#   7  文書の行範囲           Q * 2 * 文書数
+#   8  語のオフセット         Q * (語数 + 1)（語は昇順）
+#   9  語                   UTF-8
+#   10 postings のオフセット  Q * (語数 + 1)（要素数単位）
+#   11 postings             I * 合計
+#   12 チャンクの開始行        Q * チャンク数
+#   13 チャンクの終了行        Q * チャンク数
+#   14 チャンクの見出し行      q * チャンク数（無ければ -1）
+#   15 チャンクのトークン数    I * チャンク数
+#   16 行 → チャンク          I * 行数
+#
+# チャンクの埋め込みは別ファイル（<インデックス>.<埋め込みの id>.<バージョン>.npy）
+#   float32 (チャンク数, 次元数)。np.load(mmap_mode="r") で各ワーカーが共有する
+# 大きなセグメントの IVF（ann_index.py）は <インデックス>.<埋め込みの id>.<バージョン>.ivf.npz
+
+from __future__ import annotations
+
+import bisect
+import glob
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.ann_index import IvfIndex
+from app.services.knowledge_index import Segment
+
+MAGIC = b"EDKI"
+FORMAT_VERSION = 2
+SECTIONS = 17
+
+_HEADER = struct.Struct("<4sIQQQQ" + "QQ" * SECTIONS)
+
+
+class _StrArray:
+    """mmap 上の文字列の並び（読むときに 1 件ずつ decode する）"""
+
+    __slots__ = ("_offsets", "_blob")
+
+    def __init__(self, offsets: memoryview, blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+class _Postings:
+    """mmap 上の postings（語は昇順なので二分探索で引く）"""
+
+    __slots__ = ("_terms", "_offsets", "_data")
+
+    def __init__(self, terms: _StrArray, offsets: memoryview, data: memoryview):
+        self._terms = terms
+        self._offsets = offsets
+        self._data = data
+
+    def get(self, term: str, default=()):
+        i = bisect.bisect_left(self._terms, term)
+        if i < len(self._terms) and self._terms[i] == term:
+            return self._data[self._offsets[i]:self._offsets[i + 1]]
+        return default
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+
+class MmapSegment(Segment):
+    """
+    ファイルを mmap したセグメント（読み込み専用）
+    - Segment と同じ属性を持つので、検索・削除・まとめ直しはそのまま使える
+    - path / version: 読み込んだファイルとナレッジのバージョン（埋め込みのファイル名に使う）
+    """
+
+    __slots__ = ("_mm", "path", "version")
+
+
+def _align(f) -> None:
+    pad = (-f.tell()) % 8
+    if pad:
+        f.write(b"\0" * pad)
+
+
+def _write_strings(f, items: Iterable[str]) -> Tuple[array, int, int]:
+    """文字列を書き出し、(オフセット, 開始位置, 長さ) を返す"""
+    _align(f)
+    start = f.tell()
+    offsets = array("Q", [0])
+    pos = 0
+    for s in items:
+        b = s.encode("utf-8")
+        f.write(b)
+        pos += len(b)
+        offsets.append(pos)
+    return offsets, start, pos
+
+
+def _write_array(f, arr: array) -> Tuple[int, int]:
+    _align(f)
+    start = f.tell()
+    if sys.byteorder != "little":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    arr.tofile(f)
+    return start, f.tell() - start
+
+
+def write_index(path: str, seg: Segment, version: int) -> None:
+    """
+    セグメントをファイルに書き出す
+    - 一時ファイルに書いてから置き換えるので、読み手が書きかけを見ることはない
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    sections: List[Tuple[int, int]] = [(0, 0)] * SECTIONS
+
+    doc_keys = list(seg.doc_ranges)
+    terms = sorted(seg.postings)
+
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+
+        offsets, start, size = _write_strings(f, seg.lines)
+        sections[1] = (start, size)
+        sections[0] = _write_array(f, offsets)
+
+        offsets, start, size = _write_strings(f, seg.norms)
+        sections[3] = (start, size)
+        sections[2] = _write_array(f, offsets)
+
+        sections[4] = _write_array(f, array("d", seg.denoms))
+
+        offsets, start, size = _write_strings(f, doc_keys)
+        sections[6] = (start, size)
+        sections[5] = _write_array(f, offsets)
+        ranges = array("Q")
+        for key in doc_keys:
+            ranges.extend(seg.doc_ranges[key])
+        sections[7] = _write_array(f, ranges)
+
+        offsets, start, size = _write_strings(f, terms)
+        sections[9] = (start, size)
+        sections[8] = _write_array(f, offsets)
+
+        posting_offsets = array("Q", [0])
+        _align(f)
+        start = f.tell()
+        for term in terms:
+            ids = array("I", seg.postings[term])
+            if sys.byteorder != "little":
+                ids.byteswap()
+            ids.tofile(f)
+            posting_offsets.append(posting_offsets[-1] + len(ids))
+        sections[11] = (start, f.tell() - start)
+        sections[10] = _write_array(f, posting_offsets)
+
+        sections[12] = _write_array(f, array("Q", seg.chunk_starts))
+        sections[13] = _write_array(f, array("Q", seg.chunk_ends))
+        sections[14] = _write_array(f, array("q", seg.chunk_heads))
+        sections[15] = _write_array(f, array("I", seg.chunk_tokens))
+        sections[16] = _write_array(f, array("I", seg.line_chunk))
+
+        f.seek(0)
+        flat = [v for sec in sections for v in sec]
+        f.write(_HEADER.pack(
+            MAGIC, FORMAT_VERSION, version, len(seg), len(doc_keys), len(terms), *flat
+        ))
+
+    os.replace(tmp, path)
+
+
+def open_index(path: str) -> Optional[Tuple[MmapSegment, int]]:
+    """
+    ファイルを mmap して (セグメント, ナレッジのバージョン) を返す
+    - ファイルが無い / 形式が違う / 壊れているときは None（mmap はその場で閉じる）
+    """
+    if sys.byteorder != "little" or not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            return None
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    head = _HEADER.unpack_from(mm, 0)
+    magic, fmt, version, n_lines, n_docs, n_terms = head[:6]
+    if magic != MAGIC or fmt != FORMAT_VERSION:
+        mm.close()
+        return None
+
+    # 失敗したときは作った memoryview を全部手放してから閉じる（残っていると mm を閉じられない）
+    buf = memoryview(mm)
+    views = [buf]
+
+    def cast(v: memoryview, fmt: str) -> memoryview:
+        v = v.cast(fmt)
+        views.append(v)
+        return v
+
+    ok = False
+    try:
+        sec = [buf[head[6 + 2 * i]:head[6 + 2 * i] + head[7 + 2 * i]] for i in range(SECTIONS)]
+        views.extend(sec)
+
+        seg = MmapSegment.__new__(MmapSegment)
+        seg._mm = mm
+        seg.path = path
+        seg.version = version
+        seg.lines = _StrArray(cast(sec[0], "Q"), sec[1])
+        seg.norms = _StrArray(cast(sec[2], "Q"), sec[3])
+        seg.denoms = cast(sec[4], "d")
+        keys = _StrArray(cast(sec[5], "Q"), sec[6])
+        ranges = cast(sec[7], "Q")
+        seg.doc_ranges = {keys[i]: (ranges[2 * i], ranges[2 * i + 1]) for i in range(n_docs)}
+        seg.postings = _Postings(_StrArray(cast(sec[8], "Q"), sec[9]), cast(sec[10], "Q"), cast(sec[11], "I"))
+        seg.chunk_starts = cast(sec[12], "Q")
+        seg.chunk_ends = cast(sec[13], "Q")
+        seg.chunk_heads = cast(sec[14], "q")
+        seg.chunk_tokens = cast(sec[15], "I")
+        seg.line_chunk = cast(sec[16], "I")
+
+        ok = (
+            len(seg.lines) == n_lines
+            and len(seg.postings) == n_terms
+            and len(seg.line_chunk) == n_lines
+        )
+    except (TypeError, ValueError, IndexError):
+        # セクションの大きさ・位置が壊れている（cast できない / UTF-8 でない / 範囲外）
+        pass
+    finally:
+        if not ok:
+            for v in reversed(views):
+                v.release()
+            mm.close()
+    return (seg, version) if ok else None
+
+
+def vectors_path(seg: MmapSegment, embedder_id: str, suffix: str = "npy") -> str:
+    return f"{seg.path}.{embedder_id}.{seg.version}.{suffix}"
+
+
+def _replace_versioned(seg: MmapSegment, embedder_id: str, suffix: str, write) -> None:
+    """
+    一時ファイルに書いてから置き換え、同じ種類の古いバージョンのファイルは消す
+    （mmap 中のワーカーはそのまま読める）
+    """
+    path = vectors_path(seg, embedder_id, suffix)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+    for old in glob.glob(f"{glob.escape(seg.path)}.{embedder_id}.*.{suffix}"):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+def write_vectors(seg: MmapSegment, embedder_id: str, mat: np.ndarray) -> None:
+    """インデックスファイルに対応するチャンクの埋め込みを書き出す"""
+    _replace_versioned(
+        seg, embedder_id, "npy",
+        lambda f: np.save(f, np.ascontiguousarray(mat, dtype=np.float32)),
+    )
+
+
+def open_vectors(seg: MmapSegment, embedder_id: str, dim: int) -> Optional[np.ndarray]:
+    """
+    チャンクの埋め込みを mmap する
+    - ファイルが無い / 形が合わないときは None
+    """
+    path = vectors_path(seg, embedder_id)
+    if not os.path.exists(path):
+        return None
+    mat = np.load(path, mmap_mode="r")
+    if mat.dtype != np.float32 or mat.shape != (len(seg.chunk_starts), dim):
+        return None
+    return mat
+
+
+def write_ivf(seg: MmapSegment, embedder_id: str, ivf: IvfIndex) -> None:
+    """インデックスファイルに対応する IVF を書き出す"""
+    _replace_versioned(
+        seg, embedder_id, "ivf.npz",
+        lambda f: np.savez(
+            f,
+            centroids=ivf.centroids,
+            order=ivf.order,
+            offsets=ivf.offsets,
+            trained_on=np.array(ivf.trained_on),
+        ),
+    )
+
+
+def open_ivf(seg: MmapSegment, embedder_id: str, dim: int) -> Optional[IvfIndex]:
+    """
+    IVF を読み込む
+    - ファイルが無い / 形が合わないときは None
+    """
+    path = vectors_path(seg, embedder_id, "ivf.npz")
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as z:
+        ivf = IvfIndex(z["centroids"], z["order"], z["offsets"], int(z["trained_on"]))
+    if ivf.centroids.shape[1] != dim or len(ivf.order) != len(seg.chunk_starts):
+        return None
+    return ivf
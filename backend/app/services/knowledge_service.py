@@ -3,94 +3,753 @@
 
 from __future__ import annotations
 
-import re
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+from sqlalchemy import delete, func, insert, or_
 from sqlalchemy.orm import Session
 
-from app.models.knowledge import KnowledgeDoc
-
-# メモリ上のシンプルなキャッシュ（行単位）
-_KNOWLEDGE_LINES: List[str] = []
+from app.db import SessionLocal
+from app.services.chunker import estimate_tokens
+from app.services.extractors import ExtractError, extract_text, needs_extraction, supported_extensions
+from app.services.id_gaps import IdGaps
+from app.models.knowledge import (
+    SEARCHABLE_STATUSES,
+    KnowledgeDoc,
+    KnowledgeDocPart,
+    KnowledgeEvent,
+)
+from app.services.knowledge_index import (
+    KnowledgeSnapshot,
+    Segment,
+    cache_query_key,
+    db_doc_key,
+    file_doc_key,
+    normalize_text,
+)
+from app.services.knowledge_mmap import open_index, write_index
+from app.services.retrievers import get_retriever, score_lines
+
+# メモリ上のキャッシュ（セグメント単位、行単位で検索）
+# - 変更しないスナップショットを 1 つ持ち、更新のたびに丸ごと差し替える
+# - バージョンは knowledge_events.id（全ワーカー共通）。DB なしで更新したときはローカルで +1
+#   コミットが前後して後から見えた id（バージョンより小さい）も、抜けとして覚えておいて反映する
+_SNAPSHOT: KnowledgeSnapshot = KnowledgeSnapshot.empty()
+_event_gaps = IdGaps()
+
+# 文書単位の更新でセグメントがこの数を超えたら 1 つにまとめ直す
+MAX_SEGMENTS = 32
+
+# 他ワーカーの変更（knowledge_events）を確認する間隔（秒）。0 なら確認しない
+KNOWLEDGE_SYNC_INTERVAL = float(os.getenv("KNOWLEDGE_SYNC_INTERVAL", "5"))
+
+# 変更履歴を残す秒数（これより古いものは同期のスレッドが消す。最新の 1 件は残す）
+# 止まっていたワーカーは、消された分があれば全件読み込みし直す
+KNOWLEDGE_EVENT_RETENTION = float(os.getenv("KNOWLEDGE_EVENT_RETENTION", str(24 * 3600)))
+# 古い変更履歴を消す間隔（秒）
+_EVENT_PRUNE_INTERVAL = 600
+
+# インデックスファイル（全件読み込み / まとめ直しのときに書き出し、各ワーカーが mmap する）
+# 空文字なら書き出さない。相対パスは backend ディレクトリから（起動したディレクトリによらない）
+KNOWLEDGE_INDEX_PATH = os.getenv("KNOWLEDGE_INDEX_PATH", "knowledge_index.bin")
+if KNOWLEDGE_INDEX_PATH:
+    KNOWLEDGE_INDEX_PATH = str(Path(__file__).resolve().parents[2] / KNOWLEDGE_INDEX_PATH)
+
+# 全件読み込みで DB から一度に取り出す文書数
+KNOWLEDGE_LOAD_BATCH = int(os.getenv("KNOWLEDGE_LOAD_BATCH", "200"))
+
+# プロンプトに入れるナレッジの上限（トークン数の見積もり）
+KNOWLEDGE_CONTEXT_TOKENS = int(os.getenv("KNOWLEDGE_CONTEXT_TOKENS", "1500"))
+
+# プロンプトに入れるチャンク数の上限
+KNOWLEDGE_CONTEXT_CHUNKS = int(os.getenv("KNOWLEDGE_CONTEXT_CHUNKS", "5"))
+
+# 予算に詰める候補のチャンク数
+CONTEXT_CANDIDATE_CHUNKS = 50
+
+# 組み立てたナレッジのキャッシュ（正規化した質問 + ナレッジのバージョンごと）
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "1024"))
+_context_cache: "OrderedDict[Tuple[str, int, str, int, int], str]" = OrderedDict()
+_context_cache_version = -1
+_context_cache_lock = threading.Lock()
+_context_cache_hits = 0
+_context_cache_misses = 0
+
+# 更新（差し替え）は 1 つずつ。読み手はロックを取らない
+_update_lock = threading.Lock()
+_sync_stop = threading.Event()
 
 # 静的ドキュメント（リポジトリに含まれている会社紹介など）
 DATA_DIR = Path(__file__).resolve().parents[1] / "data" / "company_docs"
 
-SUPPORTED = {".txt", ".md", ".markdown"}
+# テキスト + PDF / DOCX / HTML など（extractors.py に登録した形式）
+SUPPORTED = supported_extensions()
 
 
 def _read_text_file(p: Path) -> str:
-    """テキストファイルをUTF-8で読み込む（失敗したら errors=ignore）"""
+    """
+    テキストファイルをUTF-8で読み込む（失敗したら errors=ignore）
+    - PDF などはテキストを取り出す（取り出せなければ空）
+    """
+    if needs_extraction(p.suffix):
+        try:
+            return extract_text(p.name, p.read_bytes())
+        except ExtractError as e:
+            print(f"[KnowledgeBase] {p.name} からテキストを取り出せません: {e}")
+            return ""
     try:
         return p.read_text(encoding="utf-8")
     except Exception:
         return p.read_text(encoding="utf-8", errors="ignore")
 
 
-def load_all_knowledge(db: Optional[Session] = None) -> List[str]:
+def _static_doc_paths() -> List[Path]:
+    if not DATA_DIR.exists():
+        return []
+    return [
+        p for p in sorted(DATA_DIR.glob("*"))
+        if p.is_file() and p.suffix.lower() in SUPPORTED
+    ]
+
+
+def iter_doc_content(
+    db: Session,
+    doc_id: int,
+    part_count: int,
+    content: Optional[str] = None,
+) -> Iterator[str]:
     """
-    ① app/data/company_docs 配下の静的テキスト
-    ② knowledge_docs テーブルの content（status='active'）
-    をすべて読み込んで、テキストのリストを返す
+    文書の本文を先頭（content）から knowledge_doc_parts の続きまで 1 つずつ返す
+    - 続きは 1 つずつ読む（長い文書でも、メモリに載るのは 1 つ分だけ。Segment.build にそのまま渡せる）
+    - content: 読んであれば先頭の本文（None なら DB から読む）
     """
-    texts: List[str] = []
+    if content is None:
+        content = db.query(KnowledgeDoc.content).filter(KnowledgeDoc.id == doc_id).scalar()
+    yield content or ""
+    for seq in range(1, part_count + 1):
+        part = (
+            db.query(KnowledgeDocPart.content)
+            .filter(KnowledgeDocPart.doc_id == doc_id, KnowledgeDocPart.seq == seq)
+            .scalar()
+        )
+        if part:
+            yield part
+
 
+def iter_knowledge_doc_pieces(db: Optional[Session] = None) -> Iterator[Tuple[str, Iterator[str]]]:
+    """
+    ① app/data/company_docs 配下の静的テキスト
+    ② knowledge_docs テーブルの content（取り込み済み：status='ready'）
+    を 1 件ずつ (文書キー, 本文を少しずつ返すイテレータ) で返す（Segment.build にそのまま渡す）
+    - DB は KNOWLEDGE_LOAD_BATCH 件ずつ読む（全文書の本文を一度にメモリに載せない）
+    - 長い文書も本文をつなげない（knowledge_doc_parts を 1 つずつ読む）
+    - イテレータは次の文書に進む前に読み切ること
+    """
     # 1) 静的 docs
-    if DATA_DIR.exists():
-        for p in sorted(DATA_DIR.glob("*")):
-            if p.is_file() and p.suffix.lower() in SUPPORTED:
-                texts.append(_read_text_file(p))
+    for p in _static_doc_paths():
+        yield file_doc_key(p.name), iter([_read_text_file(p)])
 
-    # 2) DB 管理のナレッジ
+    # 2) DB 管理のナレッジ（id と本文だけ）
     if db is not None:
-        docs = (
-            db.query(KnowledgeDoc)
-            .filter(KnowledgeDoc.status == "active")
-            .all()
+        rows = (
+            db.query(KnowledgeDoc.id, KnowledgeDoc.content, KnowledgeDoc.part_count)
+            .filter(KnowledgeDoc.status.in_(SEARCHABLE_STATUSES))
+            .order_by(KnowledgeDoc.id)
+            .yield_per(KNOWLEDGE_LOAD_BATCH)
         )
-        for d in docs:
-            if d.content:
-                texts.append(d.content)
+        for row in rows:
+            if row.content:
+                yield db_doc_key(row.id), iter_doc_content(db, row.id, row.part_count, row.content)
+
+
+def iter_knowledge_docs(db: Optional[Session] = None) -> Iterator[Tuple[str, str]]:
+    """
+    iter_knowledge_doc_pieces の本文をつなげて (文書キー, テキスト) で返す（互換用）
+    """
+    for key, pieces in iter_knowledge_doc_pieces(db=db):
+        yield key, "".join(pieces)
+
+
+def load_all_knowledge_docs(db: Optional[Session] = None) -> List[Tuple[str, str]]:
+    """
+    iter_knowledge_docs をリストにして返す（互換用、全件の本文をメモリに載せる）
+    """
+    return list(iter_knowledge_docs(db=db))
+
+
+def load_all_knowledge(db: Optional[Session] = None) -> List[str]:
+    """
+    load_all_knowledge_docs のテキストだけを返す（互換用）
+    """
+    return [text for _, text in iter_knowledge_docs(db=db)]
 
-    return texts
+
+def get_snapshot() -> KnowledgeSnapshot:
+    """
+    現在のナレッジのスナップショット
+    - リクエストの最初に 1 回だけ取得して使う（途中で差し替わっても影響しない）
+    """
+    return _SNAPSHOT
+
+
+def get_knowledge_version() -> int:
+    """現在のナレッジのバージョン（アップロード/削除/再読み込みで変わる）"""
+    return _SNAPSHOT.version
+
+
+def _latest_event_id(db: Session) -> int:
+    return db.query(func.max(KnowledgeEvent.id)).scalar() or 0
+
+
+def _events_pruned_after(db: Session, version: int) -> bool:
+    """version より後の変更履歴が消されているかもしれない（残っている最古の id が飛んでいる）"""
+    oldest = db.query(func.min(KnowledgeEvent.id)).scalar()
+    return bool(version and oldest and oldest > version + 1)
+
+
+def _note_event_gaps(db: Session, version: int) -> None:
+    """
+    全件読み込み / インデックスファイルから始めたときに、version 以前でまだ見えていない id を覚える
+    （その時点でコミットされていない変更を、後から反映するため）
+    """
+    _event_gaps.clear()
+    after = max(0, version - _event_gaps.limit)
+    ids = db.query(KnowledgeEvent.id).filter(KnowledgeEvent.id > after, KnowledgeEvent.id <= version)
+    _event_gaps.update(after, [row.id for row in ids], upto=version)
 
 
-def reload_knowledge_cache(db: Optional[Session] = None) -> None:
+def prune_knowledge_events(db: Session, retention: float = KNOWLEDGE_EVENT_RETENTION) -> int:
+    """
+    KNOWLEDGE_EVENT_RETENTION 秒より古い変更履歴を消し、消した件数を返す
+    - 最新の 1 件は残す（バージョンの基準になるので）
+    """
+    latest = _latest_event_id(db)
+    limit = datetime.utcnow() - timedelta(seconds=retention)
+    deleted = db.execute(
+        delete(KnowledgeEvent).where(KnowledgeEvent.created_at < limit, KnowledgeEvent.id < latest)
+    ).rowcount
+    db.commit()
+    return deleted
+
+
+def _record_event(db: Session, op: str, doc_id: Optional[int] = None) -> int:
+    """変更履歴を 1 件書き込み、その id（= 新しいバージョン）を返す"""
+    event = KnowledgeEvent(op=op, doc_id=doc_id)
+    db.add(event)
+    db.commit()
+    return event.id
+
+
+def _record_events(db: Session, op: str, doc_ids: List[int]) -> List[int]:
+    """変更履歴を文書ごとに 1 件ずつ、1 回の INSERT でまとめて書き込み、その id を返す"""
+    if not doc_ids:
+        return []
+    ids = db.scalars(
+        insert(KnowledgeEvent).returning(KnowledgeEvent.id, sort_by_parameter_order=True),
+        [{"op": op, "doc_id": doc_id} for doc_id in doc_ids],
+    ).all()
+    db.commit()
+    return list(ids)
+
+
+def _persist(seg: Segment, version: int) -> Segment:
+    """
+    セグメントをインデックスファイルに書き出し、mmap したものを返す
+    - 書き出せないとき（読み込み専用のディスクなど）はメモリ上のセグメントをそのまま使う
+    """
+    if not KNOWLEDGE_INDEX_PATH:
+        return seg
+    try:
+        write_index(KNOWLEDGE_INDEX_PATH, seg, version)
+        opened = open_index(KNOWLEDGE_INDEX_PATH)
+    except Exception as e:
+        print(f"[KnowledgeBase] インデックスファイルを書き出せませんでした: {e}")
+        return seg
+    return opened[0] if opened else seg
+
+
+def _maybe_compact(snap: KnowledgeSnapshot, persist: bool = False) -> KnowledgeSnapshot:
+    """
+    セグメントや削除済みの行が増えすぎていたらまとめ直す
+    - persist=True ならまとめ直した結果をインデックスファイルにも書き出す
+    """
+    total = sum(len(seg) for seg in snap.segments)
+    if len(snap.segments) > MAX_SEGMENTS or snap.dead_count * 2 > total:
+        snap = snap.compacted()
+        if persist:
+            snap = KnowledgeSnapshot.from_segment(_persist(snap.segments[0], snap.version), snap.version)
+        get_retriever().prepare(snap)
+    return snap
+
+
+def reload_knowledge_cache(db: Optional[Session] = None, publish: bool = False) -> None:
     """
     DB / 静的ファイルの内容をまとめて読み込み、行単位でキャッシュ
+    - 文書単位の更新（upsert_knowledge_doc / remove_knowledge_doc）が使えないときの全件版
+    - publish=True のときは他のワーカーにも全件読み込みを促す（管理画面の再読み込み）
     """
-    global _KNOWLEDGE_LINES
+    global _SNAPSHOT
 
-    texts = load_all_knowledge(db=db)
+    with _update_lock:
+        # 先にバージョンを読んでおく（読み込み中の変更は、あとで同期したときに反映される）
+        if db is None:
+            version = _SNAPSHOT.version + 1
+        elif publish:
+            version = _record_event(db, "reload")
+        else:
+            version = _latest_event_id(db)
 
-    lines: List[str] = []
-    for t in texts:
-        # CRLF, LF 両方に対応
-        for line in t.splitlines():
-            s = line.strip()
-            if s:
-                lines.append(s)
+        seg = Segment.build(iter_knowledge_doc_pieces(db=db))
+        if db is not None:
+            seg = _persist(seg, version)
+            _note_event_gaps(db, version)
+        snap = KnowledgeSnapshot.from_segment(seg, version)
+        get_retriever().prepare(snap)
+        _SNAPSHOT = snap
 
-    _KNOWLEDGE_LINES = lines
-    print("[KnowledgeBase] sample lines:", _KNOWLEDGE_LINES[:20])
+    print("[KnowledgeBase] sample lines:", seg.lines[:20])
 
-    print(f"[KnowledgeBase] 合計 {len(_KNOWLEDGE_LINES)} 行のナレッジを読み込みました。")
+    print(f"[KnowledgeBase] 合計 {len(seg)} 行のナレッジを読み込みました。")
 
 
-def _normalize_query(query: str) -> str:
+def _matches_db(db: Session, snap: KnowledgeSnapshot) -> bool:
+    """
+    スナップショットの文書が DB / 静的ファイルと揃っているか（件数と最大 id で確認）
+    - 変更履歴を通さずに DB が書き換えられた場合（tools のスクリプトなど）に気づくため
+    """
+    count, max_id = (
+        db.query(func.count(KnowledgeDoc.id), func.max(KnowledgeDoc.id))
+        .filter(KnowledgeDoc.status.in_(SEARCHABLE_STATUSES), KnowledgeDoc.content != "")
+        .one()
+    )
+    ids = [int(k[3:]) for k in snap.doc_segment if k.startswith("db:")]
+    files = {k for k in snap.doc_segment if k.startswith("file:")}
+    return (
+        len(ids) == count
+        and (max(ids) if ids else None) == max_id
+        and files == {file_doc_key(p.name) for p in _static_doc_paths()}
+    )
+
+
+def load_knowledge_cache(db: Session) -> None:
     """
-    日本語クエリ用の簡易正規化：
-    - 全角/半角の「?」「？」「。」「、」などの記号・空白を削除
-    - 文字だけを残す
+    起動時のナレッジ読み込み
+    - インデックスファイルがあれば mmap し、その後の変更履歴だけを反映する
+      （全文書の本文を DB から読まないので、ワーカーを増やしても起動が速い）
+    - ファイルが無い / 古い / DB と食い違うときは reload_knowledge_cache（全件）
     """
-    q = query.strip()
-    # 記号・空白をざっくり削る
-    q = re.sub(r"[？\?！!。、．\.,\s・]", "", q)
-    return q
+    global _SNAPSHOT
+
+    opened = None
+    if KNOWLEDGE_INDEX_PATH:
+        try:
+            opened = open_index(KNOWLEDGE_INDEX_PATH)
+        except Exception as e:
+            print(f"[KnowledgeBase] インデックスファイルを開けませんでした: {e}")
+
+    if opened is not None:
+        seg, version = opened
+        index_mtime = os.path.getmtime(KNOWLEDGE_INDEX_PATH)
+        if version > _latest_event_id(db) or _events_pruned_after(db, version) or any(
+            p.stat().st_mtime > index_mtime for p in _static_doc_paths()
+        ):
+            opened = None
+
+    if opened is None:
+        reload_knowledge_cache(db=db)
+        return
+
+    with _update_lock:
+        _SNAPSHOT = KnowledgeSnapshot.from_segment(seg, version)
+        _note_event_gaps(db, version)
+    sync_knowledge_cache(db)
+    get_retriever().prepare(_SNAPSHOT)
+
+    if not _matches_db(db, _SNAPSHOT):
+        print("[KnowledgeBase] インデックスファイルが DB と一致しないため、全件読み込みします。")
+        reload_knowledge_cache(db=db)
+        return
+
+    print(
+        f"[KnowledgeBase] インデックスファイルから {_SNAPSHOT.line_count} 行を読み込みました"
+        f"（バージョン {_SNAPSHOT.version}）。"
+    )
+
+
+def _apply_events_locked(
+    db: Session,
+    events: List[KnowledgeEvent],
+    known: Optional[Dict[int, Segment]] = None,
+    full: bool = False,
+) -> None:
+    """
+    変更履歴を順番に反映する（_update_lock 内で呼ぶ）
+    - upsert: 文書を読み直して差し替え（無い / 取り込み済みでなければ削除扱い。known のセグメントを使うときも確認する）
+    - delete: 文書を外す
+    - reload: 全件読み込み（full=True でも。間の変更履歴が消されていたとき）
+    - known: すでに手元で作ってあるその文書のセグメント（変更履歴の id → セグメント）
+      一括取り込みでは複数の変更履歴が同じセグメントを指す
+    - 後から見えた古い id（抜け）の変更も含むので、バージョンは今より下げない
+    """
+    global _SNAPSHOT
+
+    version = max(events[-1].id, _SNAPSHOT.version)
+    if full or any(e.op == "reload" for e in events):
+        seg = Segment.build(iter_knowledge_doc_pieces(db=db))
+        snap = KnowledgeSnapshot.from_segment(_persist(seg, version), version)
+        get_retriever().prepare(snap)
+        _SNAPSHOT = snap
+        return
+
+    # 文書ごとに最後の変更だけを反映すればよい（upsert は DB の今の本文を読むので、途中の変更は関係ない）
+    last: Dict[int, KnowledgeEvent] = {}
+    for e in events:
+        last[e.doc_id] = e
+
+    known = known or {}
+    removed: List[str] = []
+    need: List[int] = []
+    ready: Dict[int, Tuple[Segment, List[str]]] = {}
+    for doc_id, e in last.items():
+        if e.op != "upsert":
+            removed.append(db_doc_key(doc_id))
+        elif e.id in known:
+            seg = known[e.id]
+            ready.setdefault(id(seg), (seg, []))[1].append(db_doc_key(doc_id))
+        else:
+            need.append(doc_id)
+
+    # 手元のセグメントも、DB で削除済み・取り込み済みでなくなった文書は外す
+    # （取り込み中に削除された文書の upsert が、削除の後に反映されても戻らないように）
+    if ready:
+        known_ids = [int(key[3:]) for _, keys in ready.values() for key in keys]
+        alive = {
+            row.id for row in db.query(KnowledgeDoc.id)
+            .filter(KnowledgeDoc.id.in_(known_ids), KnowledgeDoc.status.in_(SEARCHABLE_STATUSES))
+        }
+        for seg, keys in ready.values():
+            gone = [key for key in keys if int(key[3:]) not in alive]
+            removed.extend(gone)
+            keys[:] = [key for key in keys if key not in gone]
+
+    # 手元に無い文書は本文をまとめて読み、1 つのセグメントにする（無い / 取り込み済みでなければ削除扱い）
+    if need:
+        rows = (
+            db.query(KnowledgeDoc.id, KnowledgeDoc.content, KnowledgeDoc.part_count)
+            .filter(KnowledgeDoc.id.in_(need), KnowledgeDoc.status.in_(SEARCHABLE_STATUSES))
+            .all()
+        )
+        seg = Segment.build(
+            (db_doc_key(row.id), iter_doc_content(db, row.id, row.part_count, row.content))
+            for row in rows if row.content
+        )
+        ready[id(seg)] = (seg, [db_doc_key(doc_id) for doc_id in need])
+
+    snap = _SNAPSHOT.without_docs(removed, version)
+    for seg, keys in ready.values():
+        snap = snap.with_docs(keys, seg, version)
+
+    _SNAPSHOT = _maybe_compact(snap, persist=True)
+
+
+def sync_knowledge_cache(
+    db: Session,
+    known: Optional[Dict[int, Segment]] = None,
+) -> bool:
+    """
+    他のワーカー（自分も含む）の変更を反映する
+    - 普段は max(id) を 1 回読むだけ
+    - 変更があったときだけ、その差分（と、まだ見えていなかった id）を読んで反映する
+    - 反映したら True
+    """
+    gaps = _event_gaps.pending()
+    if _latest_event_id(db) <= _SNAPSHOT.version and not gaps:
+        return False
+
+    with _update_lock:
+        version = _SNAPSHOT.version
+        cond = KnowledgeEvent.id > version
+        if gaps:
+            cond = or_(cond, KnowledgeEvent.id.in_(gaps))
+        events = db.query(KnowledgeEvent).filter(cond).order_by(KnowledgeEvent.id).all()
+        if not events:
+            return False
+        _event_gaps.update(version, [e.id for e in events])
+        full = events[-1].id > version and _events_pruned_after(db, version)
+        if full:
+            print("[KnowledgeBase] 反映していない変更履歴が消されているため、全件読み込みします。")
+        _apply_events_locked(db, events, known, full=full)
+
+    print(f"[KnowledgeBase] バージョン {_SNAPSHOT.version} に更新しました（{len(events)} 件の変更）。")
+    return True
+
+
+def upsert_knowledge_doc(
+    doc_id: int,
+    content: Optional[str],
+    db: Optional[Session] = None,
+    segment: Optional[Segment] = None,
+) -> None:
+    """
+    DB の文書 1 件を追加 / 差し替える（その文書の大きさに比例する処理だけ）
+    - db を渡すと変更履歴に記録し、他のワーカーにも反映させる
+    - segment: 取り込みジョブで作ってあるその文書のセグメント（あれば content は使わない）
+    """
+    seg = segment if segment is not None else Segment.build([(db_doc_key(doc_id), content or "")])
+    upsert_knowledge_docs([doc_id], seg, db=db)
 
 
-def get_relevant_context(query: str, top_k: int = 10) -> str:
+def upsert_knowledge_docs(
+    doc_ids: List[int],
+    segment: Segment,
+    db: Optional[Session] = None,
+) -> None:
+    """
+    DB の文書をまとめて追加 / 差し替える（一括取り込み用、スナップショットの差し替えは 1 回）
+    - segment: それらの文書をまとめて作ったセグメント（本文が空の文書は外す）
+    - db を渡すと変更履歴に記録し、他のワーカーにも反映させる
+    """
+    global _SNAPSHOT
+
+    if db is not None:
+        event_ids = _record_events(db, "upsert", doc_ids)
+        sync_knowledge_cache(db, known={event_id: segment for event_id in event_ids})
+        return
+
+    keys = [db_doc_key(doc_id) for doc_id in doc_ids]
+    with _update_lock:
+        _SNAPSHOT = _maybe_compact(_SNAPSHOT.with_docs(keys, segment, _SNAPSHOT.version + 1))
+
+
+def remove_knowledge_doc(doc_id: int, db: Optional[Session] = None) -> None:
+    """
+    DB の文書 1 件をキャッシュから外す
+    - db を渡すと変更履歴に記録し、他のワーカーにも反映させる
+    """
+    global _SNAPSHOT
+
+    if db is not None:
+        _record_event(db, "delete", doc_id)
+        sync_knowledge_cache(db)
+        return
+
+    with _update_lock:
+        _SNAPSHOT = _maybe_compact(
+            _SNAPSHOT.without_doc(db_doc_key(doc_id), _SNAPSHOT.version + 1)
+        )
+
+
+def start_knowledge_sync(interval: float = KNOWLEDGE_SYNC_INTERVAL) -> None:
+    """
+    他のワーカーの変更を定期的に確認するスレッドを起動する（起動時に 1 回呼ぶ）
+    - ときどき古い変更履歴も消す（prune_knowledge_events）
+    """
+    if interval <= 0:
+        return
+
+    _sync_stop.clear()
+
+    def loop():
+        last_prune = 0.0
+        while not _sync_stop.wait(interval):
+            try:
+                with SessionLocal() as db:
+                    sync_knowledge_cache(db)
+                    if time.monotonic() - last_prune >= _EVENT_PRUNE_INTERVAL:
+                        last_prune = time.monotonic()
+                        prune_knowledge_events(db)
+            except Exception as e:
+                print(f"[KnowledgeBase] 同期に失敗しました: {e}")
+
+    threading.Thread(target=loop, name="knowledge-sync", daemon=True).start()
+
+
+def stop_knowledge_sync() -> None:
+    _sync_stop.set()
+
+
+def _head_lines(snap: KnowledgeSnapshot, n: int) -> str:
+    picked: List[str] = []
+    for si, seg in enumerate(snap.segments):
+        dead = snap.dead_lines[si]
+        for i, line in enumerate(seg.lines):
+            if len(picked) >= n:
+                return "\n".join(picked)
+            if i not in dead:
+                picked.append(line)
+    return "\n".join(picked)
+
+
+def _truncate_line(line: str, budget: int) -> str:
+    """1 行を先頭から budget トークン以内に切る（estimate_tokens と同じ数え方）"""
+    cost = 0.0
+    n = 0
+    for ch in line:
+        cost += 1.0 if ord(ch) > 0x7F else 0.25
+        if cost > budget:
+            break
+        n += 1
+    return line[:n]
+
+
+def _truncate_chunk(text: str, budget: int) -> str:
+    """
+    チャンクの本文を先頭から budget トークン分だけ切り出す（1 つでも予算を超えるチャンク用）
+    - 予算に収まらない行は行の途中で切る（改行の無い長い段落でも空にならない）
+    """
+    picked: List[str] = []
+    used = 0
+    for line in text.split("\n"):
+        n = estimate_tokens(line)
+        if used + n > budget:
+            rest = _truncate_line(line, budget - used)
+            if rest:
+                picked.append(rest)
+            break
+        picked.append(line)
+        used += n
+    return "\n".join(picked)
+
+
+def _head_chunks(snap: KnowledgeSnapshot, budget: int, max_chunks: int) -> str:
+    """先頭から予算に収まるだけのチャンク（ヒットしなかったとき用）"""
+    picked: List[str] = []
+    for si, seg in enumerate(snap.segments):
+        dead = snap.dead_lines[si]
+        for c in range(len(seg.chunk_starts)):
+            if seg.chunk_starts[c] in dead:
+                continue
+            if seg.chunk_tokens[c] > budget or len(picked) >= max_chunks:
+                return "\n\n".join(picked)
+            picked.append(seg.chunk_text(c))
+            budget -= seg.chunk_tokens[c]
+    return "\n\n".join(picked)
+
+
+def build_context(
+    query: str,
+    token_budget: int = KNOWLEDGE_CONTEXT_TOKENS,
+    snapshot: Optional[KnowledgeSnapshot] = None,
+    retriever: str = "",
+    max_chunks: int = KNOWLEDGE_CONTEXT_CHUNKS,
+) -> str:
+    """
+    プロンプト用のナレッジを組み立てる（チャンク単位、token_budget 以内・最大 max_chunks 個）
+
+    - チャンクの順位は検索の実装（KNOWLEDGE_RETRIEVER、retrievers.py）で決める
+    - スコアの高いチャンクから、予算に収まるものを順に詰める
+    - 予算に入らないチャンクは、最上位のもの・予算の半分以上が空いているときだけ先頭から切り詰めて入れる
+      （1 行が予算より長ければ行の途中で切る）
+    - 重なっている行（見出しも）は 1 回だけ入れる
+    - 現在のスナップショットで検索したときは、質問（空白だけ整えたもの）+ バージョンごとに結果を使い回す
+    """
+    if snapshot is not None:
+        return _assemble_context(snapshot, query, token_budget, retriever, max_chunks)
+
+    global _context_cache_version, _context_cache_hits, _context_cache_misses
+
+    snap = _SNAPSHOT
+    key = (
+        cache_query_key(query),
+        snap.version,
+        get_retriever(retriever).name,
+        token_budget,
+        max_chunks,
+    )
+    with _context_cache_lock:
+        cached = _context_cache.get(key)
+        if cached is not None:
+            _context_cache.move_to_end(key)
+            _context_cache_hits += 1
+            return cached
+        _context_cache_misses += 1
+
+    context = _assemble_context(snap, query, token_budget, retriever, max_chunks)
+
+    with _context_cache_lock:
+        # バージョンが上がったら古い結果はもう使わない（古いスナップショットの結果は入れない）
+        if snap.version > _context_cache_version:
+            _context_cache.clear()
+            _context_cache_version = snap.version
+        if snap.version == _context_cache_version and CONTEXT_CACHE_SIZE > 0:
+            _context_cache[key] = context
+            while len(_context_cache) > CONTEXT_CACHE_SIZE:
+                _context_cache.popitem(last=False)
+    return context
+
+
+def get_context_cache_stats() -> Dict[str, Any]:
+    with _context_cache_lock:
+        total = _context_cache_hits + _context_cache_misses
+        return {
+            "entries": len(_context_cache),
+            "hits": _context_cache_hits,
+            "misses": _context_cache_misses,
+            "hit_rate": round(_context_cache_hits / total, 3) if total else 0.0,
+        }
+
+
+def _assemble_context(
+    snap: KnowledgeSnapshot,
+    query: str,
+    token_budget: int,
+    retriever: str,
+    max_chunks: int,
+) -> str:
+    if not any(len(seg) for seg in snap.segments) or token_budget <= 0:
+        return ""
+
+    ranked = get_retriever(retriever).search(snap, query, CONTEXT_CANDIDATE_CHUNKS)
+    if not ranked:
+        return _head_chunks(snap, token_budget, max_chunks)
+
+    picked: List[str] = []
+    used: set[Tuple[int, int]] = set()
+    remaining = token_budget
+
+    for _, si, c in ranked:
+        seg = snap.segments[si]
+        a, b, head = seg.chunk_starts[c], seg.chunk_ends[c], seg.chunk_heads[c]
+        rows = ([head] if 0 <= head < a else []) + list(range(a, b))
+        if any((si, i) in used for i in rows):
+            # 隣のチャンクと重なっている行は 1 回だけ入れる
+            rows = [i for i in rows if (si, i) not in used]
+            if not rows:
+                continue
+            text = "\n".join(seg.lines[i] for i in rows)
+            n = estimate_tokens(text)
+        else:
+            text = None
+            n = seg.chunk_tokens[c]
+
+        if n <= remaining:
+            picked.append(text if text is not None else seg.chunk_text(c))
+            used.update((si, i) for i in rows)
+            remaining -= n
+        elif not picked or remaining * 2 >= token_budget:
+            # 予算を超えるチャンクでも、予算の半分以上が空いていれば切り詰めて入れる
+            # （見出しだけのチャンクの後に長い段落が来ても、本文が入らないことがないように）
+            text = _truncate_chunk(text if text is not None else seg.chunk_text(c), remaining)
+            if text:
+                picked.append(text)
+            remaining = 0
+        if remaining <= 0 or len(picked) >= max_chunks:
+            break
+
+    return "\n\n".join(picked)
+
+
+def get_relevant_context(
+    query: str,
+    top_k: int = 10,
+    snapshot: Optional[KnowledgeSnapshot] = None,
+) -> str:
     """
     文字レベルの超シンプル類似検索（改良版）
 
@@ -100,56 +759,40 @@ def get_relevant_context(query: str, top_k: int = 10) -> str:
     - スコアの高い行だけでなく、その前後の行も一緒に返す
       → 『代表取締役』の次の行に「何 暁楽」があるケースに対応
     """
-    if not _KNOWLEDGE_LINES:
+    # 途中で更新されても混ざらないよう、最初にスナップショットを取っておく
+    snap = snapshot or _SNAPSHOT
+    segments, dead_lines = snap.segments, snap.dead_lines
+    if not any(len(seg) for seg in segments):
         return ""
 
-    q_norm = _normalize_query(query)
+    q_norm = normalize_text(query)
     if not q_norm:
         # クエリがほぼ空なら、とりあえず先頭から
-        return "\n".join(_KNOWLEDGE_LINES[:top_k])
-
-    # 重複を除いた文字リスト
-    chars = list(dict.fromkeys(q_norm))
+        return _head_lines(snap, top_k)
 
-    scored_indices: List[tuple[float, int]] = []
-
-    for idx, line in enumerate(_KNOWLEDGE_LINES):
-        line_norm = _normalize_query(line)
-        if not line_norm:
-            continue
-
-        # クエリに含まれる文字が、この行に何個含まれているか
-        raw_score = sum(1 for c in chars if c in line_norm)
-        if raw_score == 0:
-            continue
-
-        # 行が長すぎるときはペナルティ（短い見出しを優先させる）
-        length = max(5, len(line_norm))
-        score = raw_score / (length ** 0.5)
-
-        scored_indices.append((score, idx))
+    scored_indices = score_lines(snap, q_norm)
 
     if not scored_indices:
         # 一つもヒットしなかった場合は先頭から
-        return "\n".join(_KNOWLEDGE_LINES[:top_k])
+        return _head_lines(snap, top_k)
 
-    # スコア降順にソート
-    scored_indices.sort(key=lambda x: x[0], reverse=True)
+    # スコアの高い順に必要な分だけ取り出す（同点なら前にある行から）
+    # 前の行の前後として拾い済みの行は何も増やさないので、件数は決めずに top_k 行になるまで取る
+    heapq.heapify(scored_indices)
 
     picked_lines: List[str] = []
-    used_idx: set[int] = set()
+    used_idx: set[Tuple[int, int]] = set()
 
-    for score, idx in scored_indices:
-        if len(picked_lines) >= top_k:
-            break
+    while scored_indices and len(picked_lines) < top_k:
+        _, si, idx = heapq.heappop(scored_indices)
 
-        # この行と、その前後の行も一緒に拾う
+        # この行と、その前後の行も一緒に拾う（同じセグメント内の生きている行だけ）
+        seg, dead = segments[si], dead_lines[si]
         for j in (idx - 1, idx, idx + 1):
-            if 0 <= j < len(_KNOWLEDGE_LINES) and j not in used_idx:
-                picked_lines.append(_KNOWLEDGE_LINES[j])
-                used_idx.add(j)
+            if 0 <= j < len(seg) and j not in dead and (si, j) not in used_idx:
+                picked_lines.append(seg.lines[j])
+                used_idx.add((si, j))
                 if len(picked_lines) >= top_k:
                     break
 
     return "\n".join(picked_lines)
-
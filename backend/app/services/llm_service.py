@@ -1,10 +1,23 @@
+import importlib.util
+import json
 import os
-from typing import List, Dict, Optional
+from typing import Any, AsyncIterator, List, Dict, NamedTuple, Optional, Tuple
 
 import httpx
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
-from .knowledge_service import get_relevant_context  # 本地知识库
+from . import answer_cache, token_budget
+from .knowledge_index import cache_query_key
+from .knowledge_service import build_context, get_knowledge_version  # 本地知识库
+from .token_budget import (
+    MESSAGE_OVERHEAD,
+    PROMPT_MAX_TOKENS,
+    clip_tokens,
+    count_tokens,
+    message_tokens,
+    static_tokens,
+)
 
 load_dotenv()
 
@@ -13,6 +26,16 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai")
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
 
+# HTTP 连接池配置（整个进程共用一个 AsyncClient）
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "60"))
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "100"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "20"))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "30"))
+# HTTP/2 需要安装 h2（httpx[http2]），没有安装时自动退回 HTTP/1.1
+GROQ_HTTP2 = os.getenv("GROQ_HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+
+_async_client: Optional[httpx.AsyncClient] = None
+
 SYSTEM_PROMPT = """
 你是一位耐心、讲解清楚的编程老师，同时非常了解我们公司的内部情况。
 
@@ -28,69 +51,221 @@ SYSTEM_PROMPT = """
 """
 
 
-def build_messages(
+KB_HEADER = "下面是与公司业务相关的知识库内容，请结合参考回答：\n"
+
+
+class PromptUsage(NamedTuple):
+    """一次请求的 prompt 各部分的 token 数（估算）"""
+
+    system: int
+    question: int
+    context: int
+    history: int
+    total: int
+    history_kept: int
+    history_dropped: int
+    question_clipped: bool
+    context_clipped: bool
+
+
+def _fit_context(context: str, max_tokens: int) -> Tuple[str, bool]:
+    """
+    把知识库内容压到 max_tokens 以内（返回 (内容, 是否删减)）
+    - 片段按相关度从高到低排列（用空行分隔），从后面整段去掉
+    - 第一段就放不下时，截取它的开头
+    """
+    if count_tokens(context) <= max_tokens:
+        return context, False
+    picked: List[str] = []
+    used = 0
+    for chunk in context.split("\n\n"):
+        n = count_tokens(chunk) + (1 if picked else 0)
+        if used + n > max_tokens:
+            break
+        picked.append(chunk)
+        used += n
+    if not picked:
+        return clip_tokens(context, max_tokens), True
+    return "\n\n".join(picked), True
+
+
+def assemble_messages(
     question: str,
     subject: Optional[str],
     history: List[Dict[str, str]],
     context: Optional[str] = None,
-):
+    max_tokens: int = PROMPT_MAX_TOKENS,
+) -> Tuple[List[Dict[str, str]], PromptUsage]:
     """
-    构造发送给大模型的 messages 列表
+    构造发送给大模型的 messages 列表，总量不超过 max_tokens（估算）
+    - 按优先级分配：系统提示 > 当前问题 > 知识库内容 > 最近的历史 > 更早的历史
+    - 问题本身太长时截取开头；知识库内容从相关度低的片段开始去掉
+    - 历史从最新的往前放，放不下的更早的消息（包括会话摘要）不再放入
+      按「一问一答」整组放入或去掉（不会只留下回答而没有对应的提问）
     """
-    messages: List[Dict[str, str]] = [
-        {"role": "system", "content": SYSTEM_PROMPT}
-    ]
+    remaining = max_tokens
 
-    # 将知识库命中的内容加入到系统信息
-    if context:
-        kb_block = (
-            "下面是与公司业务相关的知识库内容，请结合参考回答：\n"
-            + context
-        )
-        messages.append({"role": "system", "content": kb_block})
-
-    # 历史对话
-    for msg in history:
-        messages.append({"role": msg["role"], "content": msg["content"]})
+    # 系统提示（固定内容，token 数只算一次）
+    system_tokens = static_tokens(SYSTEM_PROMPT) + MESSAGE_OVERHEAD
+    remaining -= system_tokens
 
     # 当前问题
     user_content = question
     if subject:
         user_content = f"[科目: {subject}]\n{question}"
+    question_tokens = count_tokens(user_content) + MESSAGE_OVERHEAD
+    question_clipped = question_tokens > remaining
+    if question_clipped:
+        user_content = clip_tokens(user_content, max(0, remaining - MESSAGE_OVERHEAD))
+        question_tokens = count_tokens(user_content) + MESSAGE_OVERHEAD
+    remaining -= question_tokens
+
+    # 将知识库命中的内容加入到系统信息
+    kb_block = None
+    context_tokens = 0
+    context_clipped = False
+    if context:
+        available = remaining - static_tokens(KB_HEADER) - MESSAGE_OVERHEAD
+        fitted, context_clipped = _fit_context(context, available) if available > 0 else ("", True)
+        if fitted:
+            kb_block = KB_HEADER + fitted
+            context_tokens = static_tokens(KB_HEADER) + count_tokens(fitted) + MESSAGE_OVERHEAD
+            remaining -= context_tokens
+
+    # 历史对话（从最新的往前，一问一答为一组）
+    kept: List[Dict[str, str]] = []
+    history_tokens = 0
+    for turn in reversed(_history_turns(history)):
+        n = sum(message_tokens(msg) for msg in turn)
+        if n > remaining:
+            break
+        kept[:0] = [{"role": msg["role"], "content": msg["content"]} for msg in turn]
+        history_tokens += n
+        remaining -= n
+
+    messages: List[Dict[str, str]] = [
+        {"role": "system", "content": SYSTEM_PROMPT}
+    ]
+    if kb_block:
+        messages.append({"role": "system", "content": kb_block})
+    messages.extend(kept)
     messages.append({"role": "user", "content": user_content})
 
-    return messages
+    usage = PromptUsage(
+        system=system_tokens,
+        question=question_tokens,
+        context=context_tokens,
+        history=history_tokens,
+        total=max_tokens - remaining,
+        history_kept=len(kept),
+        history_dropped=len(history) - len(kept),
+        question_clipped=question_clipped,
+        context_clipped=context_clipped,
+    )
+    return messages, usage
 
 
-def ask_llm(
+def _history_turns(history: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
+    """
+    把历史按「一问一答」分组（从旧到新）
+    - assistant 和它前面的 user 为一组；没有对应提问的 assistant 不放入
+    - 其他消息（会话摘要的 system、还没有回答的 user）各自一组
+    """
+    turns: List[List[Dict[str, str]]] = []
+    for msg in history:
+        if msg["role"] == "assistant":
+            if turns and [m["role"] for m in turns[-1]] == ["user"]:
+                turns[-1].append(msg)
+            continue
+        turns.append([msg])
+    return turns
+
+
+def build_messages(
     question: str,
-    subject: Optional[str] = None,
-    history: List[Dict[str, str]] = None,
-) -> str:
+    subject: Optional[str],
+    history: List[Dict[str, str]],
+    context: Optional[str] = None,
+):
     """
-    对外接口：
-    1. 检索知识库
-    2. 构造 prompt
-    3. 调用 Groq
-    4. 返回最终回答
+    构造发送给大模型的 messages 列表（不超过 PROMPT_MAX_TOKENS，详见 assemble_messages）
     """
-    history = history or []
+    return assemble_messages(question, subject, history, context=context)[0]
 
-    if not GROQ_API_KEY:
-        return "后端配置错误：请先在 .env 中设置 GROQ_API_KEY。"
 
-    # 1. 先查知识库
-    context = get_relevant_context(question, top_k=30)
+def get_async_client() -> httpx.AsyncClient:
+    """
+    返回进程内共用的 AsyncClient（第一次调用时创建）
+    - keep-alive 复用 TCP/TLS 连接，不再每次请求都握手
+    - 连接数上限由 GROQ_MAX_CONNECTIONS 等环境变量控制
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=GROQ_TIMEOUT,
+            http2=GROQ_HTTP2,
+            limits=httpx.Limits(
+                max_connections=GROQ_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+                keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _async_client
 
+
+async def close_async_client() -> None:
+    """应用关闭时释放连接池"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def _log_usage(usage: PromptUsage) -> None:
+    # 每次请求的 prompt token 数（估算），同时计入管理页面的统计
+    token_budget.record_usage(
+        usage.total, usage.question_clipped, usage.context_clipped, usage.history_dropped
+    )
+    print(
+        f"[LLM] prompt tokens ≈ {usage.total}/{PROMPT_MAX_TOKENS} "
+        f"(system={usage.system} question={usage.question} kb={usage.context} "
+        f"history={usage.history}, {usage.history_kept} kept / {usage.history_dropped} dropped)"
+        + (" question clipped" if usage.question_clipped else "")
+        + (" kb clipped" if usage.context_clipped else "")
+    )
+
+
+def _log_context(context: str) -> None:
     # 若你不希望终端打印调试信息，可将下方三行删掉
     print("=== KB HIT ===")
     print(context if context else "没有命中知识库")
     print("==============")
 
-    # 2. 构造消息
-    messages = build_messages(question, subject, history, context=context)
 
-    # 3. 组织请求
+async def retrieve_context_async(question: str) -> str:
+    """
+    检索知识库（CPU 处理，放到线程池里避免阻塞事件循环）
+    - 按段落/章节取片段，总量不超过 KNOWLEDGE_CONTEXT_TOKENS
+    - 默认词匹配与向量检索并行，用 RRF 合并；同一问题、同一知识库版本直接复用结果
+    """
+    context = await run_in_threadpool(build_context, question)
+    _log_context(context)
+    return context
+
+
+def _build_request(
+    question: str,
+    subject: Optional[str],
+    history: List[Dict[str, str]],
+    context: str,
+    stream: bool = False,
+) -> Tuple[str, Dict[str, str], Dict[str, Any], PromptUsage]:
+    """
+    组织发给 Groq 的 url / headers / payload（以及 prompt 的 token 估算）
+    """
+    messages, usage = assemble_messages(question, subject, history, context=context)
+    _log_usage(usage)
+
     url = GROQ_BASE_URL.rstrip("/") + "/v1/chat/completions"
     headers = {
         "Authorization": f"Bearer {GROQ_API_KEY}",
@@ -101,10 +276,73 @@ def ask_llm(
         "messages": messages,
         "temperature": 0.4,
     }
+    if stream:
+        payload["stream"] = True
+    return url, headers, payload, usage
+
+
+def _parse_answer(data: Dict[str, Any]) -> Tuple[str, bool]:
+    """
+    返回 (回答文本, 是否成功)；失败时文本为错误信息
+    """
+    try:
+        return data["choices"][0]["message"]["content"], True
+    except Exception as e:
+        return f"解析 Groq 返回内容时出错：{e}；原始响应：{data}", False
+
+
+def answer_cache_key(
+    question: str,
+    subject: Optional[str],
+    history: List[Dict[str, str]],
+) -> str:
+    """
+    回答缓存的 key：问题（只去掉首尾空白、合并连续空白）+ 科目 + 历史 + 知识库版本 + 模型
+    - 不去掉标点（"3.5" 和 "35"、"print(a, b)" 和 "print(ab)" 是不同的问题）
+    - 知识库上传/删除后版本号会变，旧的缓存自然失效
+    """
+    return answer_cache.make_key(
+        cache_query_key(question),
+        subject,
+        history,
+        get_knowledge_version(),
+        GROQ_MODEL,
+    )
+
+
+def ask_llm(
+    question: str,
+    subject: Optional[str] = None,
+    history: List[Dict[str, str]] = None,
+) -> str:
+    """
+    对外接口（同步版，保留给脚本等非 async 场景）：
+    1. 检索知识库
+    2. 构造 prompt
+    3. 调用 Groq
+    4. 返回最终回答
+    """
+    history = history or []
+
+    if not GROQ_API_KEY:
+        return "后端配置错误：请先在 .env 中设置 GROQ_API_KEY。"
+
+    # 0. 相同问题直接返回缓存
+    cache_key = answer_cache_key(question, subject, history)
+    cached = answer_cache.get_answer(cache_key)
+    if cached is not None:
+        return cached
+
+    # 1. 先查知识库
+    context = build_context(question)
+    _log_context(context)
+
+    # 2. 构造消息 / 3. 组织请求
+    url, headers, payload, usage = _build_request(question, subject, history, context)
 
     # 4. 调用 Groq
     try:
-        with httpx.Client(timeout=60.0) as client:
+        with httpx.Client(timeout=GROQ_TIMEOUT) as client:
             resp = client.post(url, headers=headers, json=payload)
             resp.raise_for_status()
             data = resp.json()
@@ -113,8 +351,201 @@ def ask_llm(
     except Exception as e:
         return f"调用 Groq 接口时发生错误：{e}"
 
-    # 5. 返回模型内容
+    # 5. 返回模型内容（只缓存成功的回答）
+    token_budget.record_actual(usage.total, (data.get("usage") or {}).get("prompt_tokens"))
+    answer, ok = _parse_answer(data)
+    if ok:
+        answer_cache.set_answer(cache_key, answer)
+    return answer
+
+
+async def ask_llm_result_async(
+    question: str,
+    subject: Optional[str] = None,
+    history: List[Dict[str, str]] = None,
+) -> Tuple[str, bool]:
+    """
+    对外接口（异步版，/api/ask 使用）：
+    - 与 ask_llm 流程相同
+    - 使用共用的 AsyncClient，等待 Groq 时不占用线程池
+    - 返回 (回答文本, 是否成功)；失败时文本为错误信息（会话接口据此不保存错误信息）
+    """
+    history = history or []
+
+    if not GROQ_API_KEY:
+        return "后端配置错误：请先在 .env 中设置 GROQ_API_KEY。", False
+
+    # 0. 相同问题直接返回缓存
+    cache_key = answer_cache_key(question, subject, history)
+    cached = answer_cache.get_answer(cache_key)
+    if cached is not None:
+        return cached, True
+
+    # 1. 先查知识库
+    context = await retrieve_context_async(question)
+
+    # 2. 构造消息 / 3. 组织请求
+    url, headers, payload, usage = _build_request(question, subject, history, context)
+
+    # 4. 调用 Groq
     try:
-        return data["choices"][0]["message"]["content"]
+        resp = await get_async_client().post(url, headers=headers, json=payload)
+        resp.raise_for_status()
+        data = resp.json()
+    except httpx.HTTPStatusError as e:
+        return f"调用 Groq 接口失败：HTTP {e.response.status_code}，详情：{e.response.text[:200]}", False
     except Exception as e:
-        return f"解析 Groq 返回内容时出错：{e}；原始响应：{data}"
+        return f"调用 Groq 接口时发生错误：{e}", False
+
+    # 5. 返回模型内容（只缓存成功的回答）
+    token_budget.record_actual(usage.total, (data.get("usage") or {}).get("prompt_tokens"))
+    answer, ok = _parse_answer(data)
+    if ok:
+        answer_cache.set_answer(cache_key, answer)
+    return answer, ok
+
+
+async def ask_llm_async(
+    question: str,
+    subject: Optional[str] = None,
+    history: List[Dict[str, str]] = None,
+) -> str:
+    """
+    同 ask_llm_result_async，只返回文本（出错时为错误信息）
+    """
+    answer, _ = await ask_llm_result_async(question, subject, history)
+    return answer
+
+
+def get_cached_answer(
+    question: str,
+    subject: Optional[str] = None,
+    history: List[Dict[str, str]] = None,
+) -> Optional[str]:
+    """
+    查询回答缓存（流式接口在检索知识库之前先调用）
+    """
+    return answer_cache.get_answer(answer_cache_key(question, subject, history or []))
+
+
+class StreamStatus:
+    """
+    流式调用的结果（传给 stream_llm_async，迭代过程中/结束后查看）
+    - error：出错时的错误信息（在 yield 错误信息之前设置）
+    - ok：收到了 [DONE]，回答完整
+    """
+
+    def __init__(self) -> None:
+        self.ok = False
+        self.error: Optional[str] = None
+
+
+async def stream_llm_async(
+    question: str,
+    subject: Optional[str] = None,
+    history: List[Dict[str, str]] = None,
+    context: str = "",
+    status: Optional[StreamStatus] = None,
+) -> AsyncIterator[str]:
+    """
+    流式接口（/api/ask/stream 使用）：
+    - context 由调用方提前检索好（在发送第一个字节之前）
+    - 以 stream=true 调用 Groq，逐个 yield 模型输出的增量文本
+    - 出错时与 ask_llm 一样，把错误信息作为文本返回（同时设置 status.error）
+    - 正常结束时把完整回答写入回答缓存（缓存命中由调用方先用 get_cached_answer 判断）
+    """
+    history = history or []
+    status = status if status is not None else StreamStatus()
+
+    if not GROQ_API_KEY:
+        status.error = "后端配置错误：请先在 .env 中设置 GROQ_API_KEY。"
+        yield status.error
+        return
+
+    cache_key = answer_cache_key(question, subject, history)
+    url, headers, payload, _ = _build_request(question, subject, history, context, stream=True)
+    parts: List[str] = []
+
+    try:
+        async with get_async_client().stream("POST", url, headers=headers, json=payload) as resp:
+            if resp.status_code >= 400:
+                detail = (await resp.aread()).decode("utf-8", errors="ignore")
+                status.error = f"调用 Groq 接口失败：HTTP {resp.status_code}，详情：{detail[:200]}"
+                yield status.error
+                return
+
+            # OpenAI 兼容的 SSE：每行 "data: {...}"，以 "data: [DONE]" 结束
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    status.ok = True
+                    break
+                try:
+                    delta = json.loads(data)["choices"][0]["delta"].get("content")
+                except Exception:
+                    continue
+                if delta:
+                    parts.append(delta)
+                    yield delta
+    except Exception as e:
+        status.error = f"调用 Groq 接口时发生错误：{e}"
+        yield status.error
+        return
+
+    # 只缓存完整的回答（没有收到 [DONE] 就断开时不缓存）
+    if not status.ok:
+        status.error = "Groq 的回答在中途中断了"
+        return
+    answer_cache.set_answer(cache_key, "".join(parts))
+
+
+SUMMARY_PROMPT = """
+请把下面的师生对话压缩成一段简短的摘要，供后续回答时参考：
+- 保留学生的问题、已经讲过的结论、代码中的关键名称和尚未解决的问题；
+- 不要寒暄，不要逐句复述；
+- 使用对话所用的语言。
+"""
+
+
+async def summarize_history_async(
+    previous_summary: Optional[str],
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+) -> Optional[str]:
+    """
+    把较早的对话（连同之前的摘要）压缩成新的摘要（会话历史超出预算时在后台调用）
+    - 失败或未配置 GROQ_API_KEY 时返回 None（由调用方退回到简单的截取）
+    """
+    if not GROQ_API_KEY or not messages:
+        return None
+
+    lines: List[str] = []
+    if previous_summary:
+        lines.append(f"[之前的摘要]\n{previous_summary}\n")
+    for msg in messages:
+        name = "学生" if msg["role"] == "user" else "老师"
+        lines.append(f"{name}：{msg['content']}")
+
+    url = GROQ_BASE_URL.rstrip("/") + "/v1/chat/completions"
+    headers = {
+        "Authorization": f"Bearer {GROQ_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "model": GROQ_MODEL,
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": "\n".join(lines)},
+        ],
+        "temperature": 0.2,
+        "max_tokens": max_tokens,
+    }
+    try:
+        resp = await get_async_client().post(url, headers=headers, json=payload)
+        resp.raise_for_status()
+        summary, ok = _parse_answer(resp.json())
+    except Exception:
+        return None
+    return summary.strip() if ok else None
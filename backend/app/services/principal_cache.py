@@ -0,0 +1,180 @@
+# backend/app/services/principal_cache.py
+# ログイン中ユーザーのキャッシュ（認証のたびに users テーブルを読まない）
+#
+# - JWT の subject（メールアドレス）ごとに、ユーザーの読み取り専用のスナップショットを持つ
+#   （id / email / 氏名 / role / is_active。ORM のオブジェクトは持たない）
+# - PRINCIPAL_CACHE_TTL 秒で捨てる / PRINCIPAL_CACHE_SIZE 件を超えたら古く使われたものから捨てる
+# - 権限変更・停止のときは invalidate_user() で即座に捨てる（次のリクエストで DB から読み直す）
+#   - db を渡すと user_invalidations に行を書き、他のプロセスも
+#     PRINCIPAL_SYNC_INTERVAL 秒ごとの同期（get_current_user の中、読むのは新しい行だけ）で捨てる
+#   - コミットが前後して後から見えた行も読むように、抜けていた id を覚えておく（id_gaps.py）
+#   - TTL を過ぎた行はもう要らないので、ときどき消す
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.orm import Session
+
+from app.models.user import UserInvalidation
+from app.services.id_gaps import IdGaps
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))  # 秒（0 ならキャッシュしない）
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+# 他のプロセスでの権限変更・停止を読み込む間隔（秒）
+PRINCIPAL_SYNC_INTERVAL = float(os.getenv("PRINCIPAL_SYNC_INTERVAL", "5"))
+# 古い知らせを消す間隔（秒）
+_CLEANUP_INTERVAL = 600
+
+
+class Principal(NamedTuple):
+    """認証済みユーザーのスナップショット（読み取り専用）"""
+
+    id: int
+    email: str
+    full_name: Optional[str]
+    role: str
+    is_active: bool
+
+
+_cache: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+_lock = threading.Lock()
+# 無効化のたびに進める（読み込み中に無効化されたものをキャッシュに入れない）
+_generation = 0
+_hits = 0
+_misses = 0
+# 同期で読んだ user_invalidations の位置
+_last_id = 0
+_gaps = IdGaps()
+_last_sync = 0.0
+_last_cleanup = 0.0
+
+
+def get_principal(subject: str, load: Callable[[], Optional[Principal]]) -> Optional[Principal]:
+    """
+    subject のスナップショットを返す（無い・期限切れなら load() で DB から読んで入れる）
+    - load() が None（ユーザーがいない）ならキャッシュしない
+    """
+    global _hits, _misses
+
+    if PRINCIPAL_CACHE_TTL <= 0:
+        return load()
+
+    now = time.monotonic()
+    with _lock:
+        item = _cache.get(subject)
+        if item is not None and item[0] > now:
+            _cache.move_to_end(subject)
+            _hits += 1
+            return item[1]
+        _misses += 1
+        generation = _generation
+
+    principal = load()
+    if principal is None:
+        return None
+
+    with _lock:
+        if generation == _generation:
+            _cache[subject] = (now + PRINCIPAL_CACHE_TTL, principal)
+            _cache.move_to_end(subject)
+            while len(_cache) > PRINCIPAL_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return principal
+
+
+def invalidate_user(email: str, db: Optional[Session] = None, user_id: Optional[int] = None) -> None:
+    """
+    ユーザーの権限・状態を変えたときに呼ぶ（変更を commit した後）
+    - db と user_id を渡すと、他のプロセスにも知らせる
+    """
+    global _generation
+
+    with _lock:
+        _generation += 1
+        _cache.pop(email, None)
+
+    if db is not None and user_id is not None and PRINCIPAL_CACHE_TTL > 0:
+        db.add(UserInvalidation(user_id=user_id, created_at=datetime.utcnow()))
+        db.commit()
+
+
+def _keep_after(now: datetime) -> datetime:
+    """これより前の知らせはもう要らない（その前に入れたキャッシュは TTL で切れている）"""
+    return now - timedelta(seconds=PRINCIPAL_CACHE_TTL + PRINCIPAL_SYNC_INTERVAL)
+
+
+def sync_invalidations(db: Session, force: bool = False) -> None:
+    """
+    他のプロセスでの権限変更・停止を読み込み、そのユーザーのキャッシュを捨てる
+    （前回から PRINCIPAL_SYNC_INTERVAL 秒たっていなければ何もしない）
+    - 読むのは前回より新しい行と、前回までに抜けていた id だけ（インデックスで引く）
+    - 古い行はときどき消す
+    """
+    global _generation, _last_id, _last_sync, _last_cleanup
+
+    if PRINCIPAL_CACHE_TTL <= 0:
+        return
+    now = time.time()
+    if not force and now - _last_sync < PRINCIPAL_SYNC_INTERVAL:
+        return
+    with _lock:
+        if not force and now - _last_sync < PRINCIPAL_SYNC_INTERVAL:
+            return
+        _last_sync = now
+        last_id = _last_id
+        cleanup = now - _last_cleanup >= _CLEANUP_INTERVAL
+        if cleanup:
+            _last_cleanup = now
+
+    keep_after = _keep_after(datetime.utcnow())
+    cond = UserInvalidation.id > last_id
+    gaps = _gaps.pending()
+    if gaps:
+        cond = or_(cond, UserInvalidation.id.in_(gaps))
+    rows = db.execute(
+        select(UserInvalidation.id, UserInvalidation.user_id)
+        .where(cond, UserInvalidation.created_at > keep_after)
+        .order_by(UserInvalidation.id)
+    ).all()
+    _gaps.update(last_id, [row.id for row in rows])
+    if cleanup:
+        db.execute(delete(UserInvalidation).where(UserInvalidation.created_at <= keep_after))
+        db.commit()
+
+    user_ids = {row.user_id for row in rows}
+    with _lock:
+        if rows:
+            _last_id = max(_last_id, rows[-1].id)
+        if user_ids:
+            _generation += 1
+            for subject in [s for s, (_, p) in _cache.items() if p.id in user_ids]:
+                del _cache[subject]
+
+
+def clear() -> None:
+    global _generation
+
+    with _lock:
+        _generation += 1
+        _cache.clear()
+
+
+def get_stats() -> dict:
+    """ヒット/ミス数（管理画面のシステム状態で表示）"""
+    total = _hits + _misses
+    return {
+        "entries": len(_cache),
+        "ttl": PRINCIPAL_CACHE_TTL,
+        "hits": _hits,
+        "misses": _misses,
+        "hit_rate": round(_hits / total, 4) if total else 0.0,
+        "last_id": _last_id,
+        "id_gaps": len(_gaps),
+    }
@@ -0,0 +1,60 @@
+# backend/app/services/rate_limit.py
+# 回数制限（ログイン・登録など、IP / アカウントごと）
+#
+# - キーごとのトークンバケット：limit 回までは続けて通し、window 秒で limit 回分まで回復する
+# - プロセス内のメモリだけ（キーは max_keys 件まで、古く使われたものから捨てる）
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+
+class RateLimiter:
+    def __init__(self, limit: int, window: float, max_keys: int = 100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def hit(self, key: str) -> float:
+        """
+        1 回分を使う。通してよければ 0、だめなら何秒後に通せるか
+        - limit が 0 以下なら制限しない
+        """
+        if self.limit <= 0:
+            return 0.0
+
+        rate = self.limit / self.window
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (float(self.limit), now))
+            tokens = min(float(self.limit), tokens + (now - last) * rate)
+            if tokens < 1.0:
+                self._buckets[key] = (tokens, now)
+                self._buckets.move_to_end(key)
+                self.rejected += 1
+                return (1.0 - tokens) / rate
+
+            self._buckets[key] = (tokens - 1.0, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0.0
+
+    def reset(self, key: str) -> None:
+        """成功したときなどに、そのキーの回数を戻す"""
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def get_stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "window": self.window,
+            "keys": len(self._buckets),
+            "rejected": self.rejected,
+        }
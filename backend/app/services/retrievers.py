@@ -0,0 +1,537 @@
+# backend/app/services/retrievers.py
+# ナレッジ検索の実装（差し替え可能）
+#
+# - どの実装も「スナップショットとクエリ → スコアの高いチャンク」を返す
+# - KNOWLEDGE_RETRIEVER で選ぶ（auto / bm25 / legacy / vector / hybrid）
+#   既定の auto は、意味を見る埋め込み（sentence-transformers のモデル）を読み込めれば hybrid、
+#   読み込めなければ bm25（埋め込みモデルはワーカーごとに読み込まれ、全チャンクを埋め込むので、
+#   メモリが少ないときは bm25 を明示的に選ぶ）
+#   - legacy: 行ごとに「クエリの文字がいくつ含まれるか ÷ 行の長さの平方根」
+#   - bm25:   チャンクごとに BM25（日本語は 2 文字ずつ区切る、英数字は単語）
+#             「の」「は」のようにどこにでもある文字は IDF でほぼ効かなくなる
+#   - vector: チャンクの埋め込み（embeddings.py）とのコサイン類似度
+#             セグメントごとに float32 の行列を持ち、行列 × ベクトル 1 回で全件を計算する
+#             大きなセグメントは IVF（ann_index.py）で近いクラスタだけを計算する
+#   - hybrid: 語の一致（bm25）とベクトルを並列に実行し、順位を RRF でまとめる
+#             （語が一致する固有名詞と、言い換えの両方を拾う）
+
+from __future__ import annotations
+
+import heapq
+import math
+import os
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.ann_index import ANN_MIN_CHUNKS, ANN_NPROBE, IvfIndex, top_k_indices
+from app.services.embeddings import Embedder, embed_texts, get_embedder
+from app.services.knowledge_index import KnowledgeSnapshot, Segment, normalize_text, tokenize
+from app.services.knowledge_mmap import (
+    MmapSegment,
+    open_ivf,
+    open_vectors,
+    write_ivf,
+    write_vectors,
+)
+
+KNOWLEDGE_RETRIEVER = os.getenv("KNOWLEDGE_RETRIEVER", "auto")
+
+# BM25 のパラメータ（一般的な値）
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# legacy でチャンクを選ぶときに見る、スコア上位の行数
+LEGACY_CANDIDATE_LINES = 200
+
+# hybrid：語の一致に使う実装 / RRF の定数 / 各実装から取る件数 / 並列に使うスレッド数
+HYBRID_LEXICAL = os.getenv("HYBRID_LEXICAL", "bm25")
+RRF_K = int(os.getenv("RRF_K", "60"))
+HYBRID_DEPTH = 50
+HYBRID_WORKERS = int(os.getenv("HYBRID_WORKERS", "4"))
+
+# (スコア, セグメント位置, チャンク番号)。スコアの高い順
+ScoredChunk = Tuple[float, int, int]
+
+
+class Retriever(ABC):
+    """
+    検索の実装のインターフェイス
+    - search はスコアの高い順に最大 k 件のチャンクを返す（削除済みのチャンクは含めない）
+    - search が無い実装は作った時点でエラー（prepare / status は必要なときだけ上書きする）
+    """
+
+    name = ""
+
+    def prepare(self, snap: KnowledgeSnapshot) -> None:
+        """検索の前に必要なものを作っておく（全件読み込み / まとめ直しのあと）"""
+
+    @abstractmethod
+    def search(self, snap: KnowledgeSnapshot, query: str, k: int) -> List[ScoredChunk]:
+        ...
+
+    def status(self, snap: KnowledgeSnapshot) -> Dict[str, Any]:
+        """管理画面用の状態（status が "ok" なら検索できる）"""
+        return {"status": "ok"}
+
+
+def score_lines(snap: KnowledgeSnapshot, q_norm: str) -> List[Tuple[float, int, int]]:
+    """
+    正規化済みクエリで各行をスコア付けし、(−スコア, セグメント位置, 行番号) を返す
+    - 「ヒットした文字数 ÷ 行の長さの平方根」（短い見出しを優先させる）
+    - 削除済みの行は除く
+    """
+    # 重複を除いた文字リスト
+    chars = list(dict.fromkeys(q_norm))
+
+    scored_indices: List[Tuple[float, int, int]] = []
+
+    for si, seg in enumerate(snap.segments):
+        # クエリに含まれる文字が、各行に何個含まれているか
+        # （転置インデックスを引くので、共通の文字を持つ行しか触らない）
+        hits: Dict[int, int] = {}
+        for c in chars:
+            for idx in seg.postings.get(c, ()):
+                hits[idx] = hits.get(idx, 0) + 1
+
+        dead = snap.dead_lines[si]
+        denoms = seg.denoms
+        for idx, raw_score in hits.items():
+            if idx in dead:
+                continue
+            # 行が長すぎるときはペナルティ（短い見出しを優先させる）
+            scored_indices.append((-raw_score / denoms[idx], si, idx))
+
+    return scored_indices
+
+
+class CharOverlapRetriever(Retriever):
+    """
+    従来のスコア（行単位）
+    - 行のスコアをチャンクに持ち上げる（チャンクのスコアは中の行の最高スコア）
+    """
+
+    name = "legacy"
+
+    def search(self, snap: KnowledgeSnapshot, query: str, k: int) -> List[ScoredChunk]:
+        q_norm = normalize_text(query)
+        if not q_norm:
+            return []
+
+        out: List[ScoredChunk] = []
+        seen = set()
+        for neg, si, idx in heapq.nsmallest(LEGACY_CANDIDATE_LINES, score_lines(snap, q_norm)):
+            c = snap.segments[si].line_chunk[idx]
+            if (si, c) in seen:
+                continue
+            seen.add((si, c))
+            out.append((-neg, si, c))
+            if len(out) >= k:
+                break
+        return out
+
+
+# ---- BM25 ----
+
+class Bm25Index:
+    """
+    1 セグメント分の BM25 用インデックス（チャンク単位、構築後は変更しない）
+    - postings: 語 → (チャンク番号の配列, 出現回数の配列)
+      文書頻度は配列の長さ
+    - lengths: チャンクごとの語数
+    """
+
+    __slots__ = ("postings", "lengths", "total_length")
+
+    def __init__(self, seg: Segment) -> None:
+        postings: Dict[str, Tuple[array, array]] = {}
+        self.lengths = array("I")
+        for c in range(len(seg.chunk_starts)):
+            terms: Dict[str, int] = {}
+            n = 0
+            for t in tokenize(seg.chunk_text(c)):
+                terms[t] = terms.get(t, 0) + 1
+                n += 1
+            self.lengths.append(n)
+            for t, tf in terms.items():
+                if t not in postings:
+                    postings[t] = (array("I"), array("H"))
+                ids, tfs = postings[t]
+                ids.append(c)
+                tfs.append(min(tf, 0xFFFF))
+        self.postings = postings
+        self.total_length = sum(self.lengths)
+
+
+# セグメントは変更しないので、セグメントごとに 1 回だけ作って使い回す
+_bm25_cache: "weakref.WeakKeyDictionary[Segment, Bm25Index]" = weakref.WeakKeyDictionary()
+_bm25_lock = threading.Lock()
+
+
+def bm25_index(seg: Segment) -> Bm25Index:
+    index = _bm25_cache.get(seg)
+    if index is None:
+        with _bm25_lock:
+            index = _bm25_cache.get(seg)
+            if index is None:
+                index = Bm25Index(seg)
+                _bm25_cache[seg] = index
+    return index
+
+
+class Bm25Retriever(Retriever):
+    """
+    BM25（チャンク単位）
+    - 文書頻度・平均の長さはスナップショット内の全セグメントで合算する
+      （削除済みのチャンクも、まとめ直されるまでは数に入る）
+    """
+
+    name = "bm25"
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B) -> None:
+        self.k1 = k1
+        self.b = b
+
+    def prepare(self, snap: KnowledgeSnapshot) -> None:
+        for seg in snap.segments:
+            bm25_index(seg)
+
+    def search(self, snap: KnowledgeSnapshot, query: str, k: int) -> List[ScoredChunk]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        indexes = [bm25_index(seg) for seg in snap.segments]
+        n_chunks = sum(len(ix.lengths) for ix in indexes)
+        if not n_chunks:
+            return []
+        avgdl = max(1.0, sum(ix.total_length for ix in indexes) / n_chunks)
+
+        idf: Dict[str, float] = {}
+        for t in terms:
+            df = sum(len(ix.postings[t][0]) for ix in indexes if t in ix.postings)
+            if df:
+                idf[t] = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+
+        k1, b = self.k1, self.b
+        scored: List[ScoredChunk] = []
+        for si, ix in enumerate(indexes):
+            scores: Dict[int, float] = {}
+            lengths = ix.lengths
+            for t, w in idf.items():
+                posting = ix.postings.get(t)
+                if posting is None:
+                    continue
+                for c, tf in zip(*posting):
+                    norm = k1 * (1 - b + b * lengths[c] / avgdl)
+                    scores[c] = scores.get(c, 0.0) + w * tf * (k1 + 1) / (tf + norm)
+
+            dead = snap.dead_lines[si]
+            starts = snap.segments[si].chunk_starts
+            for c, score in scores.items():
+                if dead and starts[c] in dead:
+                    continue
+                scored.append((score, si, c))
+
+        # 同点なら前にあるチャンクから
+        return heapq.nsmallest(k, scored, key=lambda x: (-x[0], x[1], x[2]))
+
+
+# ---- ベクトル検索 ----
+
+# セグメントごとのチャンクの埋め込み (チャンク数, 次元数)
+_vector_cache: "weakref.WeakKeyDictionary[Segment, np.ndarray]" = weakref.WeakKeyDictionary()
+_vector_lock = threading.Lock()
+
+
+def segment_vectors(seg: Segment, embedder: Embedder) -> np.ndarray:
+    """
+    セグメントのチャンクの埋め込み（セグメントごとに 1 回だけ作る）
+    - インデックスファイルのセグメントは、埋め込みもファイルに書き出して各ワーカーで共有する
+    """
+    mat = _vector_cache.get(seg)
+    if mat is None:
+        with _vector_lock:
+            mat = _vector_cache.get(seg)
+            if mat is None:
+                mat = _load_or_embed(seg, embedder)
+                _vector_cache[seg] = mat
+    return mat
+
+
+def _load_or_embed(seg: Segment, embedder: Embedder) -> np.ndarray:
+    if isinstance(seg, MmapSegment):
+        try:
+            mat = open_vectors(seg, embedder.id, embedder.dim)
+        except Exception as e:
+            print(f"[KnowledgeBase] 埋め込みのファイルを開けませんでした: {e}")
+            mat = None
+        if mat is not None:
+            return mat
+
+    mat = embed_texts(embedder, [seg.chunk_text(c) for c in range(len(seg.chunk_starts))])
+
+    if isinstance(seg, MmapSegment):
+        try:
+            write_vectors(seg, embedder.id, mat)
+            mat = open_vectors(seg, embedder.id, embedder.dim)
+        except Exception as e:
+            print(f"[KnowledgeBase] 埋め込みのファイルを書き出せませんでした: {e}")
+    return mat
+
+
+def reuse_vectors(seg: Segment, snap: KnowledgeSnapshot) -> int:
+    """
+    文書を差し替えるとき、前の版と同じ本文のチャンクは埋め込みを引き継ぎ、変わったチャンクだけ埋め込む
+    - snap: 差し替える前のスナップショット（前の版の埋め込みを作ってある文書だけが対象）
+    - 前の版の埋め込みが 1 つも無ければ何もしない（埋め込みを使っていない設定など）
+    - 引き継いだチャンク数を返す
+    """
+    previous: Dict[str, np.ndarray] = {}
+    for key in seg.doc_ranges:
+        si = snap.doc_segment.get(key)
+        if si is None:
+            continue
+        old = snap.segments[si]
+        mat = _vector_cache.get(old)
+        if mat is None:
+            continue
+        for c in old.doc_chunks(key):
+            previous.setdefault(old.chunk_text(c), mat[c])
+    if not previous or seg in _vector_cache:
+        return 0
+
+    embedder = get_embedder()
+    texts = [seg.chunk_text(c) for c in range(len(seg.chunk_starts))]
+    missing = [c for c, text in enumerate(texts) if text not in previous]
+    out = np.empty((len(texts), embedder.dim), dtype=np.float32)
+    if missing:
+        out[missing] = embed_texts(embedder, [texts[c] for c in missing])
+    for c, text in enumerate(texts):
+        if text in previous:
+            out[c] = previous[text]
+
+    with _vector_lock:
+        _vector_cache.setdefault(seg, out)
+    return len(texts) - len(missing)
+
+
+# セグメントごとの IVF（ANN_MIN_CHUNKS 件以上のセグメントだけ）
+_ann_cache: "weakref.WeakKeyDictionary[Segment, IvfIndex]" = weakref.WeakKeyDictionary()
+# 直近に作った / 読み込んだ IVF（まとめ直したセグメントで中心を使い回す）
+_last_ivf: Optional[IvfIndex] = None
+
+
+def segment_ann(seg: Segment, embedder: Embedder, mat: np.ndarray) -> Optional[IvfIndex]:
+    """
+    大きなセグメントの IVF（セグメントごとに 1 回だけ作る、小さいセグメントは None）
+    - 文書の追加は小さなセグメント（全件を正確に計算）、削除は削除済みの行で除外し、
+      まとめ直したときに前の中心を使い回して振り分け直す（k-means はやり直さない）
+    """
+    if ANN_MIN_CHUNKS <= 0 or len(mat) < ANN_MIN_CHUNKS:
+        return None
+    ivf = _ann_cache.get(seg)
+    if ivf is None:
+        with _vector_lock:
+            ivf = _ann_cache.get(seg)
+            if ivf is None:
+                ivf = _load_or_build_ivf(seg, embedder, mat)
+                _ann_cache[seg] = ivf
+    return ivf
+
+
+def _load_or_build_ivf(seg: Segment, embedder: Embedder, mat: np.ndarray) -> IvfIndex:
+    global _last_ivf
+
+    if isinstance(seg, MmapSegment):
+        try:
+            ivf = open_ivf(seg, embedder.id, embedder.dim)
+        except Exception as e:
+            print(f"[KnowledgeBase] IVF のファイルを開けませんでした: {e}")
+            ivf = None
+        if ivf is not None:
+            _last_ivf = ivf
+            return ivf
+
+    base = _last_ivf
+    if base is not None and base.reusable_for(len(mat), embedder.dim):
+        ivf = IvfIndex.build(mat, base.centroids, base.trained_on)
+    else:
+        ivf = IvfIndex.build(mat)
+
+    if isinstance(seg, MmapSegment):
+        try:
+            write_ivf(seg, embedder.id, ivf)
+        except Exception as e:
+            print(f"[KnowledgeBase] IVF のファイルを書き出せませんでした: {e}")
+    _last_ivf = ivf
+    return ivf
+
+
+class VectorRetriever(Retriever):
+    """
+    埋め込みのコサイン類似度（チャンク単位）
+    - 小さいセグメントは全件を正確に計算、ANN_MIN_CHUNKS 件以上は IVF（近似）
+    - 類似度が 0 以下のチャンクは返さない（ハッシュ埋め込みで語が 1 つも重ならないとき）
+    """
+
+    name = "vector"
+
+    def __init__(self, nprobe: int = ANN_NPROBE) -> None:
+        self.nprobe = nprobe
+
+    def prepare(self, snap: KnowledgeSnapshot) -> None:
+        embedder = get_embedder()
+        for seg in snap.segments:
+            segment_ann(seg, embedder, segment_vectors(seg, embedder))
+
+    def search(self, snap: KnowledgeSnapshot, query: str, k: int) -> List[ScoredChunk]:
+        if not normalize_text(query):
+            return []
+
+        embedder = get_embedder()
+        # float64 だと行列ごと変換されて遅くなるので float32 にそろえる
+        q = np.asarray(embedder.embed_query(query), dtype=np.float32)
+
+        scored: List[ScoredChunk] = []
+        for si, seg in enumerate(snap.segments):
+            mat = segment_vectors(seg, embedder)
+            if not len(mat):
+                continue
+
+            # 削除済みのチャンクを除いても k 件残るように多めに取る
+            dead = snap.dead_lines[si]
+            want = k + len(dead)
+            ivf = segment_ann(seg, embedder, mat)
+            if ivf is not None:
+                idx, scores = ivf.search(mat, q, want, self.nprobe)
+            else:
+                scores = mat @ q
+                idx = top_k_indices(scores, want)
+                scores = scores[idx]
+
+            starts = seg.chunk_starts
+            for c, score in zip(idx.tolist(), scores.tolist()):
+                if score <= 0:
+                    break
+                if dead and starts[c] in dead:
+                    continue
+                scored.append((score, si, c))
+
+        return heapq.nsmallest(k, scored, key=lambda x: (-x[0], x[1], x[2]))
+
+    def status(self, snap: KnowledgeSnapshot) -> Dict[str, Any]:
+        ready = all(seg in _vector_cache for seg in snap.segments)
+        out: Dict[str, Any] = {"status": "ok" if ready else "loading"}
+        if ready:
+            embedder = get_embedder()
+            out.update(
+                embedder=embedder.id,
+                dim=embedder.dim,
+                ann_segments=sum(1 for seg in snap.segments if seg in _ann_cache),
+                nprobe=self.nprobe,
+            )
+        return out
+
+
+# ---- hybrid ----
+
+_hybrid_pool: Optional[ThreadPoolExecutor] = None
+_hybrid_pool_lock = threading.Lock()
+
+
+def _get_hybrid_pool() -> ThreadPoolExecutor:
+    global _hybrid_pool
+
+    if _hybrid_pool is None:
+        with _hybrid_pool_lock:
+            if _hybrid_pool is None:
+                _hybrid_pool = ThreadPoolExecutor(
+                    max_workers=HYBRID_WORKERS, thread_name_prefix="knowledge-hybrid"
+                )
+    return _hybrid_pool
+
+
+def rrf_fuse(rankings: List[List[ScoredChunk]], k: int, rrf_k: int = RRF_K) -> List[ScoredChunk]:
+    """
+    Reciprocal Rank Fusion：各順位リストで 1 / (rrf_k + 順位) を足し合わせる
+    - スコアの尺度が違う実装（BM25 とコサイン類似度）でも、そのまま混ぜられる
+    """
+    fused: Dict[Tuple[int, int], float] = {}
+    for ranking in rankings:
+        for rank, (_, si, c) in enumerate(ranking, start=1):
+            fused[(si, c)] = fused.get((si, c), 0.0) + 1.0 / (rrf_k + rank)
+    return heapq.nsmallest(
+        k,
+        ((score, si, c) for (si, c), score in fused.items()),
+        key=lambda x: (-x[0], x[1], x[2]),
+    )
+
+
+class HybridRetriever(Retriever):
+    """
+    語の一致とベクトルを並列に実行して RRF でまとめる
+    - ベクトル側（行列の計算は GIL を離す）をスレッドプールで、語の一致を呼び出し元のスレッドで実行する
+    - 埋め込みがハッシュ（意味を見ない）のときは語の一致だけを使う
+      （同じ情報を雑にしたものを混ぜると、かえって順位が悪くなる）
+    """
+
+    name = "hybrid"
+
+    def __init__(self, lexical: Retriever, vector: Retriever, depth: int = HYBRID_DEPTH) -> None:
+        self.lexical = lexical
+        self.vector = vector
+        self.depth = depth
+
+    def prepare(self, snap: KnowledgeSnapshot) -> None:
+        self.lexical.prepare(snap)
+        if get_embedder().semantic:
+            self.vector.prepare(snap)
+
+    def search(self, snap: KnowledgeSnapshot, query: str, k: int) -> List[ScoredChunk]:
+        if not get_embedder().semantic:
+            return self.lexical.search(snap, query, k)
+
+        depth = max(k, self.depth)
+        future = _get_hybrid_pool().submit(self.vector.search, snap, query, depth)
+        lexical = self.lexical.search(snap, query, depth)
+        return rrf_fuse([lexical, future.result()], k)
+
+    def status(self, snap: KnowledgeSnapshot) -> Dict[str, Any]:
+        if not get_embedder().semantic:
+            return {"status": "ok", "lexical": self.lexical.name, "embedder": get_embedder().id}
+        return {**self.vector.status(snap), "lexical": self.lexical.name}
+
+
+_LEXICAL: Dict[str, Retriever] = {
+    r.name: r for r in (CharOverlapRetriever(), Bm25Retriever())
+}
+_VECTOR = VectorRetriever()
+
+RETRIEVERS: Dict[str, Retriever] = {
+    **_LEXICAL,
+    _VECTOR.name: _VECTOR,
+    "hybrid": HybridRetriever(_LEXICAL[HYBRID_LEXICAL], _VECTOR),
+}
+
+
+def get_retriever(name: str = "") -> Retriever:
+    """名前（省略時は KNOWLEDGE_RETRIEVER）で検索の実装を取得する"""
+    name = name or KNOWLEDGE_RETRIEVER
+    if name == "auto":
+        # 埋め込みを読み込むのは最初の 1 回だけ（以降は読み込み済みのものを見るだけ）
+        name = "hybrid" if get_embedder().semantic else "bm25"
+    if name not in RETRIEVERS:
+        raise ValueError(f"unknown retriever: {name}")
+    return RETRIEVERS[name]
+
+
+def search_status(snap: KnowledgeSnapshot) -> Dict[str, Any]:
+    """管理画面用：使っている検索の実装と、その状態"""
+    retriever = get_retriever()
+    return {"retriever": retriever.name, **retriever.status(snap)}
@@ -0,0 +1,124 @@
+# backend/app/services/token_budget.py
+# プロンプトのトークン数の見積もりと予算（build_messages で使う）
+#
+# - 見積もりは文字数ベース（chunker.estimate_tokens）に TOKEN_ESTIMATE_RATIO を掛けたもの
+#   （Groq が返す実際の prompt_tokens から求めた値が get_stats() の observed_ratio。これに合わせて設定する）
+# - メッセージ 1 つごとに役割などの分として MESSAGE_OVERHEAD トークンを足す
+# - システムプロンプトなど変わらない文字列は static_tokens() で 1 回だけ数える
+# - プロンプト全体を PROMPT_MAX_TOKENS 以内に収める（何をどこまで削ったかは集計して管理画面に出す）
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, Optional
+
+from app.services.chunker import estimate_tokens
+
+# プロンプト（messages 全体）の上限。回答の分はモデルのコンテキスト長から別に残しておく
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "6000"))
+# 見積もりの補正（実際のトークン数 ÷ 見積もり）
+TOKEN_ESTIMATE_RATIO = float(os.getenv("TOKEN_ESTIMATE_RATIO", "1.0"))
+MESSAGE_OVERHEAD = 4
+
+
+def count_tokens(text: str) -> int:
+    """text のトークン数の見積もり"""
+    if not text:
+        return 0
+    return math.ceil(estimate_tokens(text) * TOKEN_ESTIMATE_RATIO)
+
+
+@lru_cache(maxsize=64)
+def static_tokens(text: str) -> int:
+    """変わらない文字列（システムプロンプトなど）のトークン数（1 回だけ数える）"""
+    return count_tokens(text)
+
+
+def message_tokens(msg: Dict[str, object]) -> int:
+    """
+    メッセージ 1 つ分
+    - 保存時に見積もった tokens があればそれを使う（本文を数え直さない）
+    """
+    tokens = msg.get("tokens")
+    if isinstance(tokens, int):
+        return math.ceil(tokens * TOKEN_ESTIMATE_RATIO) + MESSAGE_OVERHEAD
+    return count_tokens(str(msg["content"])) + MESSAGE_OVERHEAD
+
+
+def clip_tokens(text: str, max_tokens: int, keep_tail: bool = False) -> str:
+    """
+    max_tokens 以内に切る（既定は先頭を残す。keep_tail なら末尾を残す）
+    - 切ったときは切った側に "…" を付ける
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 1:
+        return ""
+
+    limit = (max_tokens - 1) / TOKEN_ESTIMATE_RATIO
+    cost = 0.0
+    n = 0
+    chars = reversed(text) if keep_tail else iter(text)
+    for c in chars:
+        cost += 1.0 if ord(c) > 0x7F else 0.25
+        if cost > limit:
+            break
+        n += 1
+    return "…" + text[len(text) - n:] if keep_tail else text[:n] + "…"
+
+
+# ========== 集計（管理画面のシステム状態で表示） ==========
+
+_lock = threading.Lock()
+_stats: Dict[str, float] = {
+    "requests": 0,
+    "estimated_total": 0,
+    "estimated_max": 0,
+    "trimmed": 0,  # 予算に収めるために何かを削ったリクエスト
+    "question_clipped": 0,
+    "context_clipped": 0,
+    "history_dropped": 0,  # 入れなかった履歴のメッセージ数
+    "actual_total": 0,  # Groq が返した prompt_tokens（返ってきたものだけ）
+    "actual_estimated_total": 0,  # ↑ と同じリクエストの見積もり
+}
+
+
+def record_usage(
+    total: int,
+    question_clipped: bool,
+    context_clipped: bool,
+    history_dropped: int,
+) -> None:
+    with _lock:
+        _stats["requests"] += 1
+        _stats["estimated_total"] += total
+        _stats["estimated_max"] = max(_stats["estimated_max"], total)
+        if question_clipped or context_clipped or history_dropped:
+            _stats["trimmed"] += 1
+        _stats["question_clipped"] += int(question_clipped)
+        _stats["context_clipped"] += int(context_clipped)
+        _stats["history_dropped"] += history_dropped
+
+
+def record_actual(estimated: int, actual: Optional[int]) -> None:
+    """Groq の usage.prompt_tokens と見積もりを並べて記録する（補正の目安）"""
+    if not actual:
+        return
+    with _lock:
+        _stats["actual_total"] += actual
+        _stats["actual_estimated_total"] += estimated
+
+
+def get_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+    requests = stats["requests"]
+    stats["estimated_avg"] = round(stats["estimated_total"] / requests, 1) if requests else 0.0
+    estimated = stats.pop("actual_estimated_total")
+    stats["observed_ratio"] = round(stats["actual_total"] / estimated * TOKEN_ESTIMATE_RATIO, 3) if estimated else None
+    stats["budget"] = PROMPT_MAX_TOKENS
+    stats["ratio"] = TOKEN_ESTIMATE_RATIO
+    return stats
@@ -0,0 +1,177 @@
+# backend/app/services/token_revocation.py
+# 無効にしたアクセストークンのリスト（get_current_user でリクエストごとに確認する）
+#
+# - アクセストークン（JWT）はそのまま検証できるので、DB に保存しない
+#   無効にしたもの（ログアウト・パスワード変更・リフレッシュトークンの使い回し）だけを持つ
+# - キーは "j:<jti>"（トークン 1 つ）/ "f:<family_id>"（そのログインから出たトークン全部）
+# - メモリ上はブルームフィルタ + 期限付きの辞書
+#   （ほとんどのトークンは無効でないので、ブルームフィルタだけで判定が終わる）
+# - 無効にしたものは revoked_tokens テーブルにも書き、他のプロセスは
+#   REVOCATION_SYNC_INTERVAL 秒ごとに差分を読み込む（リクエストの中で、読むのは新しい行だけ）
+#   コミットが前後して後から見えた行も読むように、抜けていた id を覚えておく（id_gaps.py）
+# - アクセストークンの有効期限を過ぎたものは捨てる（リストは短い有効期限の分しか増えない）
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.orm import Session
+
+from app.models.auth_token import RevokedToken
+from app.services.id_gaps import IdGaps
+
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", "5"))
+# 期限を過ぎた行を消す間隔（秒）
+_CLEANUP_INTERVAL = 600
+# ブルームフィルタのビット数（既定 1M ビット = 128KB、1 万件で誤判定 0.1% 未満）
+REVOCATION_BLOOM_BITS = int(os.getenv("REVOCATION_BLOOM_BITS", str(1 << 20)))
+_BLOOM_HASHES = 4
+
+
+class BloomFilter:
+    """「入っていない」は確実、「入っているかも」は辞書で確かめる"""
+
+    def __init__(self, bits: int, hashes: int = _BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self._data = bytearray((bits + 7) // 8)
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8 * self.hashes).digest()
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[i * 8:(i + 1) * 8], "little") % self.bits
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self._data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+_lock = threading.Lock()
+_bloom = BloomFilter(REVOCATION_BLOOM_BITS)
+_revoked: Dict[str, float] = {}  # キー → 期限（unix 秒）
+_last_id = 0
+_gaps = IdGaps()
+_last_sync = 0.0
+_last_cleanup = 0.0
+
+
+def token_key(jti: str) -> str:
+    return f"j:{jti}"
+
+
+def family_key(family_id: str) -> str:
+    return f"f:{family_id}"
+
+
+def _add_locked(key: str, expires: float) -> None:
+    if _revoked.get(key, 0) < expires:
+        _revoked[key] = expires
+    _bloom.add(key)
+
+
+def _prune_locked(now: float) -> None:
+    """期限を過ぎたものを捨て、ブルームフィルタを作り直す"""
+    global _bloom
+
+    expired = [k for k, exp in _revoked.items() if exp <= now]
+    if not expired:
+        return
+    for k in expired:
+        del _revoked[k]
+    bloom = BloomFilter(REVOCATION_BLOOM_BITS)
+    for k in _revoked:
+        bloom.add(k)
+    _bloom = bloom
+
+
+def is_revoked(*keys: Optional[str]) -> bool:
+    """どれかのキーが無効にされていれば True（ロックは取らない）"""
+    bloom = _bloom
+    now = time.time()
+    for key in keys:
+        if key and key in bloom:
+            exp = _revoked.get(key)
+            if exp is not None and exp > now:
+                return True
+    return False
+
+
+def revoke(db: Session, keys: Iterable[str], expires_at: datetime) -> None:
+    """
+    キーを無効にする（expires_at はそのキーで出したアクセストークンの最長の期限）
+    - DB に書いて commit する（他のプロセスは次の同期で読み込む）
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    db.add_all(RevokedToken(key=k, expires_at=expires_at) for k in keys)
+    db.commit()
+    expires = expires_at.timestamp() if expires_at.tzinfo else _utc_timestamp(expires_at)
+    with _lock:
+        for k in keys:
+            _add_locked(k, expires)
+
+
+def sync_revocations(db: Session, force: bool = False) -> None:
+    """
+    他のプロセスで無効にしたものを読み込む（前回から REVOCATION_SYNC_INTERVAL 秒たっていなければ何もしない）
+    - 読むのは前回より新しい行と、前回までに抜けていた id だけ（インデックスで引く）
+    - 期限を過ぎた行はときどき消す
+    """
+    global _last_id, _last_sync, _last_cleanup
+
+    now = time.time()
+    if not force and now - _last_sync < REVOCATION_SYNC_INTERVAL:
+        return
+    with _lock:
+        if not force and now - _last_sync < REVOCATION_SYNC_INTERVAL:
+            return
+        _last_sync = now
+        last_id = _last_id
+        cleanup = now - _last_cleanup >= _CLEANUP_INTERVAL
+        if cleanup:
+            _last_cleanup = now
+
+    utcnow = datetime.utcnow()
+    cond = RevokedToken.id > last_id
+    gaps = _gaps.pending()
+    if gaps:
+        cond = or_(cond, RevokedToken.id.in_(gaps))
+    rows = db.execute(
+        select(RevokedToken.id, RevokedToken.key, RevokedToken.expires_at)
+        .where(cond, RevokedToken.expires_at > utcnow)
+        .order_by(RevokedToken.id)
+    ).all()
+    _gaps.update(last_id, [row.id for row in rows])
+    if cleanup:
+        db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= utcnow))
+        db.commit()
+
+    with _lock:
+        for row in rows:
+            _add_locked(row.key, _utc_timestamp(row.expires_at))
+            _last_id = max(_last_id, row.id)
+        _prune_locked(now)
+
+
+def _utc_timestamp(dt: datetime) -> float:
+    """DB の naive な UTC 日時 → unix 秒"""
+    return (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+def get_stats() -> dict:
+    return {
+        "revoked": len(_revoked),
+        "bloom_bits": _bloom.bits,
+        "last_id": _last_id,
+        "id_gaps": len(_gaps),
+    }
@@ -0,0 +1,57 @@
+# backend/tests/conftest.py
+# テスト共通の設定（メモリ上の SQLite・外部サービスを使わない）
+#
+# - app を import する前に環境変数を決める（モジュールの読み込み時に os.getenv で読むため）
+# - db フィクスチャはテストごとに新しいメモリ上の DB（全テーブルを create_all）
+
+import os
+
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ["EMBEDDING_MODEL"] = "hash"
+os.environ["KNOWLEDGE_INDEX_PATH"] = ""
+os.environ["BCRYPT_ROUNDS"] = "4"
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db import Base
+from app.models import auth_token, conversation, knowledge, user  # noqa: F401  モデル登録用
+from app.services import principal_cache, token_revocation
+from app.services.id_gaps import IdGaps
+
+
+@pytest.fixture
+def db():
+    # 1 つの接続を使い回す（メモリ上の SQLite は接続ごとに別の DB になる）
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def fresh_revocations(monkeypatch):
+    """無効リストのメモリ上の状態はモジュールに持つので、テストごとに空にする"""
+    monkeypatch.setattr(token_revocation, "_bloom", token_revocation.BloomFilter(1 << 12))
+    monkeypatch.setattr(token_revocation, "_revoked", {})
+    monkeypatch.setattr(token_revocation, "_last_id", 0)
+    monkeypatch.setattr(token_revocation, "_gaps", IdGaps())
+    monkeypatch.setattr(token_revocation, "_last_sync", 0.0)
+
+
+@pytest.fixture(autouse=True)
+def fresh_principal_cache(monkeypatch):
+    principal_cache.clear()
+    monkeypatch.setattr(principal_cache, "_last_id", 0)
+    monkeypatch.setattr(principal_cache, "_gaps", IdGaps())
+    monkeypatch.setattr(principal_cache, "_last_sync", 0.0)
+    monkeypatch.setattr(principal_cache, "_last_cleanup", 0.0)
@@ -0,0 +1,29 @@
+# backend/tests/test_answer_cache.py
+# 回答キャッシュの保存先（差し替え用のインターフェイス）
+
+import pytest
+
+from app.services.answer_cache import AnswerCacheBackend, MemoryAnswerCache
+
+
+def test_backend_without_all_methods_cannot_be_created():
+    class Partial(AnswerCacheBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+    with pytest.raises(TypeError):
+        AnswerCacheBackend()
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryAnswerCache(max_entries=2, ttl=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert len(cache) == 2
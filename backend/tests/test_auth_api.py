@@ -0,0 +1,34 @@
+# backend/tests/test_auth_api.py
+# /auth/refresh の IP ごとの回数制限
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import auth
+from app.db import get_db
+from app.services.rate_limit import RateLimiter
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    monkeypatch.setattr(auth, "ip_limiter", RateLimiter(2, 60))
+    app = FastAPI()
+    app.include_router(auth.router)
+    app.dependency_overrides[get_db] = lambda: db
+    return TestClient(app)
+
+
+def test_refresh_is_throttled_per_ip(client):
+    headers = {"X-Forwarded-For": "203.0.113.5"}
+    for _ in range(2):
+        res = client.post("/auth/refresh", json={"refresh_token": "bad"}, headers=headers)
+        assert res.status_code == 401
+
+    res = client.post("/auth/refresh", json={"refresh_token": "bad"}, headers=headers)
+    assert res.status_code == 429
+    assert int(res.headers["Retry-After"]) >= 1
+
+    # 別の IP は別に数える
+    res = client.post("/auth/refresh", json={"refresh_token": "bad"}, headers={"X-Forwarded-For": "203.0.113.6"})
+    assert res.status_code == 401
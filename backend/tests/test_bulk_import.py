@@ -0,0 +1,68 @@
+# backend/tests/test_bulk_import.py
+# 一括取り込み：1 回の中の同じ名前・同じ内容のファイル、既存の文書との照合
+
+from app.models.knowledge import JOB_PENDING, KnowledgeDoc, KnowledgeJob
+from app.services.bulk_import import Entry, content_hash, import_docs
+
+
+def _import(db, *files):
+    return import_docs(db, [Entry(name, data.encode("utf-8")) for name, data in files], inline=False)
+
+
+def test_same_name_in_one_batch_keeps_the_last_file(db):
+    result = _import(db, ("a.txt", "古い本文"), ("b.txt", "別の文書"), ("a.txt", "新しい本文"))
+
+    assert sorted(d["original_name"] for d in result["added"]) == ["a.txt", "b.txt"]
+    assert [s["name"] for s in result["skipped"]] == ["a.txt"]
+    docs = {d.original_name: d for d in db.query(KnowledgeDoc).all()}
+    assert len(docs) == 2
+    assert docs["a.txt"].content == "新しい本文"
+    assert docs["a.txt"].content_hash == content_hash("新しい本文")
+
+
+def test_same_name_then_old_content_again_is_not_a_duplicate(db):
+    # 置き換えられた前のファイルの内容は、後から来ても重複扱いにしない
+    result = _import(db, ("a.txt", "一つ目"), ("a.txt", "二つ目"), ("c.txt", "一つ目"))
+
+    assert sorted(d["original_name"] for d in result["added"]) == ["a.txt", "c.txt"]
+    assert result["duplicates"] == []
+    assert db.query(KnowledgeDoc).count() == 2
+
+
+def test_same_content_in_one_batch_is_added_once(db):
+    result = _import(db, ("a.txt", "同じ本文"), ("b.txt", "同じ本文"))
+
+    assert [d["original_name"] for d in result["added"]] == ["a.txt"]
+    assert result["duplicates"] == [{"name": "b.txt", "id": None}]
+    assert db.query(KnowledgeDoc).count() == 1
+
+
+def test_existing_docs_are_matched_by_content_and_name(db):
+    first = _import(db, ("a.txt", "本文 A"), ("b.txt", "本文 B"))
+    ids = {d["original_name"]: d["id"] for d in first["added"]}
+
+    result = _import(db, ("copy.txt", "本文 A"), ("b.txt", "本文 B（改訂）"))
+
+    assert result["added"] == []
+    assert result["duplicates"] == [{"name": "copy.txt", "id": ids["a.txt"]}]
+    assert result["updated"] == [{"id": ids["b.txt"], "original_name": "b.txt"}]
+    assert db.get(KnowledgeDoc, ids["b.txt"]).content == "本文 B（改訂）"
+
+
+def test_jobs_are_enqueued_for_added_and_updated_docs(db):
+    _import(db, ("a.txt", "本文 A"))
+    result = _import(db, ("a.txt", "本文 A2"), ("b.txt", "本文 B"))
+
+    jobs = db.query(KnowledgeJob).filter(KnowledgeJob.id.in_(result["job_ids"])).all()
+    assert len(jobs) == 2
+    assert {job.status for job in jobs} == {JOB_PENDING}
+    assert sorted(job.doc_id for job in jobs) == sorted(
+        d["id"] for d in result["added"] + result["updated"]
+    )
+
+
+def test_empty_text_is_skipped(db):
+    result = _import(db, ("blank.txt", "  \n"))
+
+    assert result["added"] == []
+    assert [s["name"] for s in result["skipped"]] == ["blank.txt"]
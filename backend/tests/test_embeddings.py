@@ -0,0 +1,26 @@
+# backend/tests/test_embeddings.py
+# 埋め込みのインターフェイスと、ハッシュ埋め込み（テスト・開発用）
+
+import numpy as np
+import pytest
+
+from app.services.embeddings import Embedder, HashingEmbedder
+
+
+def test_embedder_without_embed_documents_cannot_be_created():
+    class NoEmbed(Embedder):
+        id = "none"
+
+    with pytest.raises(TypeError):
+        NoEmbed()
+
+
+def test_hashing_embedder_is_normalized_and_deterministic():
+    embedder = HashingEmbedder(dim=64)
+    vecs = embedder.embed_documents(["料金表の更新", "料金表の更新", ""])
+
+    assert vecs.shape == (3, 64)
+    assert vecs.dtype == np.float32
+    assert np.allclose(vecs[0], vecs[1])
+    assert np.isclose(np.linalg.norm(vecs[0]), 1.0)
+    assert np.allclose(embedder.embed_query("料金表の更新"), vecs[0])
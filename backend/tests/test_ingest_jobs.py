@@ -0,0 +1,87 @@
+# backend/tests/test_ingest_jobs.py
+# 取り込みジョブの取り方（_claim）と、止まったジョブのやり直し（recover_stale_jobs）
+
+from datetime import datetime, timedelta
+
+from app.models.knowledge import (
+    DOC_ERROR,
+    DOC_PENDING,
+    JOB_ERROR,
+    JOB_PENDING,
+    JOB_RUNNING,
+    KnowledgeDoc,
+    KnowledgeJob,
+)
+from app.services import ingest_service
+
+
+def _add_jobs(db, n):
+    doc = KnowledgeDoc(original_name="a.txt", content="本文", status=DOC_PENDING)
+    db.add(doc)
+    db.flush()
+    jobs = [KnowledgeJob(doc_id=doc.id, status=JOB_PENDING) for _ in range(n)]
+    db.add_all(jobs)
+    db.commit()
+    return doc, [job.id for job in jobs]
+
+
+def test_claim_marks_jobs_running(db):
+    _, job_ids = _add_jobs(db, 3)
+
+    assert ingest_service._claim(db, job_ids) == job_ids
+    jobs = db.query(KnowledgeJob).order_by(KnowledgeJob.id).all()
+    assert {job.status for job in jobs} == {JOB_RUNNING}
+    assert {job.attempts for job in jobs} == {1}
+    assert len({job.claimed_by for job in jobs}) == 1
+    assert all(job.started_at is not None for job in jobs)
+
+
+def test_claim_skips_jobs_taken_by_another_worker(db):
+    _, job_ids = _add_jobs(db, 3)
+
+    assert ingest_service._claim(db, job_ids[:2]) == job_ids[:2]
+    # 2 回目は残っていた 1 件だけ（先に取られたものは返さない）
+    assert ingest_service._claim(db, job_ids) == job_ids[2:]
+    assert ingest_service._claim(db, job_ids) == []
+    assert ingest_service._claim(db, []) == []
+
+
+def test_claim_next_takes_oldest_pending_first(db):
+    _, job_ids = _add_jobs(db, 5)
+
+    assert ingest_service._claim_next(db, limit=2) == job_ids[:2]
+    assert ingest_service._claim_next(db, limit=10) == job_ids[2:]
+
+
+def test_recover_stale_jobs_requeues_stuck_jobs(db):
+    _, job_ids = _add_jobs(db, 2)
+    ingest_service._claim(db, job_ids)
+    old = datetime.utcnow() - timedelta(seconds=ingest_service.INGEST_STALE_AFTER + 60)
+    db.query(KnowledgeJob).filter(KnowledgeJob.id == job_ids[0]).update({KnowledgeJob.started_at: old})
+    db.commit()
+
+    assert ingest_service.recover_stale_jobs(db) == 1
+    stale, fresh = db.query(KnowledgeJob).order_by(KnowledgeJob.id).all()
+    assert stale.status == JOB_PENDING
+    assert fresh.status == JOB_RUNNING
+    # 戻したジョブはまた取れる
+    assert ingest_service._claim(db, job_ids) == [job_ids[0]]
+    assert db.get(KnowledgeJob, job_ids[0]).attempts == 2
+
+
+def test_recover_stale_jobs_gives_up_after_max_attempts(db):
+    doc, job_ids = _add_jobs(db, 1)
+    ingest_service._claim(db, job_ids)
+    old = datetime.utcnow() - timedelta(seconds=ingest_service.INGEST_STALE_AFTER + 60)
+    db.query(KnowledgeJob).update(
+        {KnowledgeJob.started_at: old, KnowledgeJob.attempts: ingest_service.INGEST_MAX_ATTEMPTS}
+    )
+    db.commit()
+
+    assert ingest_service.recover_stale_jobs(db) == 1
+    job = db.get(KnowledgeJob, job_ids[0])
+    assert job.status == JOB_ERROR
+    assert job.finished_at is not None
+    db.refresh(doc)
+    assert doc.status == DOC_ERROR
+    assert doc.error_message == job.error_message
@@ -0,0 +1,67 @@
+# backend/tests/test_knowledge_mmap.py
+# インデックスファイルの書き出し・mmap（壊れたファイルは mmap を残さない）
+
+import os
+
+import pytest
+
+from app.services.knowledge_index import Segment
+from app.services.knowledge_mmap import _HEADER, open_index, write_index
+
+
+def _segment():
+    return Segment.build([("db:1", "# 料金\n人材派遣 3000円\n\n# 連絡先\n窓口は総務部")])
+
+
+def _mapped(path):
+    with open("/proc/self/maps") as f:
+        return any(line.rstrip().endswith(str(path)) for line in f)
+
+
+def _patch_header(path, index, value):
+    with open(path, "r+b") as f:
+        head = list(_HEADER.unpack(f.read(_HEADER.size)))
+        head[index] = value
+        f.seek(0)
+        f.write(_HEADER.pack(*head))
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "index.bin"
+    seg = _segment()
+    write_index(str(path), seg, 7)
+
+    opened, version = open_index(str(path))
+    assert version == 7
+    assert list(opened.lines) == list(seg.lines)
+    assert opened.doc_ranges == seg.doc_ranges
+    assert list(opened.chunk_starts) == list(seg.chunk_starts)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc")
+@pytest.mark.parametrize(
+    "index, value",
+    [
+        (3, 999),  # 行数が合わない
+        (7, 7),  # 行のオフセットが 8 バイトの倍数でない（cast できない）
+        (4, 5),  # 文書数が多すぎる（文書の行範囲の外を読む）
+    ],
+)
+def test_broken_file_is_unmapped(tmp_path, index, value):
+    path = tmp_path / "index.bin"
+    write_index(str(path), _segment(), 1)
+    _patch_header(path, index, value)
+
+    assert open_index(str(path)) is None
+    assert not _mapped(path)
+
+
+def test_wrong_magic_or_short_file(tmp_path):
+    path = tmp_path / "index.bin"
+    path.write_bytes(b"\0" * (_HEADER.size + 8))
+    assert open_index(str(path)) is None
+
+    path.write_bytes(b"EDKI")
+    assert open_index(str(path)) is None
+    assert open_index(str(tmp_path / "missing.bin")) is None
+
@@ -0,0 +1,68 @@
+# backend/tests/test_principal_cache.py
+# ログイン中ユーザーのキャッシュ：権限変更・停止の知らせ（user_invalidations）を他のプロセスにも届ける
+
+from datetime import datetime, timedelta
+
+from app.models.auth_token import RevokedToken
+from app.models.user import UserInvalidation
+from app.services import principal_cache
+from app.services.principal_cache import Principal
+
+
+def _cache(user_id, email, role="user"):
+    principal = Principal(user_id, email, None, role, True)
+    assert principal_cache.get_principal(email, lambda: principal) == principal
+
+
+def _cached(email):
+    return principal_cache.get_principal(email, lambda: None) is not None
+
+
+def test_invalidate_writes_invalidation_not_revoked_token(db):
+    _cache(1, "a@example.com")
+    principal_cache.invalidate_user("a@example.com", db, 1)
+
+    assert not _cached("a@example.com")
+    assert [row.user_id for row in db.query(UserInvalidation).all()] == [1]
+    assert db.query(RevokedToken).count() == 0
+
+
+def test_sync_drops_users_changed_in_other_process(db):
+    _cache(1, "a@example.com")
+    _cache(2, "b@example.com")
+    # 他のプロセスが書いた知らせ
+    db.add(UserInvalidation(user_id=2, created_at=datetime.utcnow()))
+    db.commit()
+
+    principal_cache.sync_invalidations(db, force=True)
+    assert _cached("a@example.com")
+    assert not _cached("b@example.com")
+
+
+def test_sync_reads_ids_committed_out_of_order(db):
+    _cache(1, "a@example.com")
+    db.add(UserInvalidation(id=2, user_id=9, created_at=datetime.utcnow()))
+    db.commit()
+    principal_cache.sync_invalidations(db, force=True)
+    assert principal_cache.get_stats()["id_gaps"] == 1
+
+    db.add(UserInvalidation(id=1, user_id=1, created_at=datetime.utcnow()))
+    db.commit()
+    principal_cache.sync_invalidations(db, force=True)
+    assert not _cached("a@example.com")
+    assert principal_cache.get_stats()["id_gaps"] == 0
+
+
+def test_sync_removes_old_invalidations(db):
+    old = datetime.utcnow() - timedelta(
+        seconds=principal_cache.PRINCIPAL_CACHE_TTL + principal_cache.PRINCIPAL_SYNC_INTERVAL + 60
+    )
+    db.add(UserInvalidation(user_id=1, created_at=old))
+    db.add(UserInvalidation(user_id=2, created_at=datetime.utcnow()))
+    db.commit()
+    _cache(1, "a@example.com")
+
+    principal_cache.sync_invalidations(db, force=True)
+    # TTL より古い知らせは読まない（そのキャッシュはもう切れている）
+    assert _cached("a@example.com")
+    assert [row.user_id for row in db.query(UserInvalidation).all()] == [2]
@@ -0,0 +1,80 @@
+# backend/tests/test_prompt_history.py
+# プロンプトの組み立て：履歴は「一問一答」の組ごとに入れる・落とす
+
+from app.services.llm_service import SYSTEM_PROMPT, assemble_messages
+from app.services.token_budget import MESSAGE_OVERHEAD, count_tokens, message_tokens, static_tokens
+
+
+def _history(n):
+    history = []
+    for i in range(n):
+        history.append({"role": "user", "content": f"質問{i}" * 10})
+        history.append({"role": "assistant", "content": f"回答{i}" * 30})
+    return history
+
+
+def _budget(question, kept):
+    """システム + 質問 + kept のメッセージがちょうど入る上限"""
+    return (
+        static_tokens(SYSTEM_PROMPT) + MESSAGE_OVERHEAD
+        + count_tokens(question) + MESSAGE_OVERHEAD
+        + sum(message_tokens(m) for m in kept)
+    )
+
+
+def test_everything_fits():
+    history = _history(3)
+    messages, usage = assemble_messages("今の質問", None, history)
+
+    assert messages[1:-1] == history
+    assert usage.history_kept == 6
+    assert usage.history_dropped == 0
+
+
+def test_older_turns_are_dropped_as_pairs():
+    history = _history(3)
+    # 最新の組 + 1 つ前の回答まで入る予算でも、回答だけを残さない
+    budget = _budget("今の質問", history[-3:])
+    messages, usage = assemble_messages("今の質問", None, history, max_tokens=budget)
+
+    assert messages[1:-1] == history[-2:]
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert usage.history_kept == 2
+    assert usage.history_dropped == 4
+
+
+def test_newest_pair_too_large_keeps_no_history():
+    history = _history(2)
+    budget = _budget("今の質問", history[-1:])
+    messages, usage = assemble_messages("今の質問", None, history, max_tokens=budget)
+
+    assert [m["role"] for m in messages] == ["system", "user"]
+    assert usage.history_kept == 0
+
+
+def test_orphan_assistant_is_not_sent():
+    history = [
+        {"role": "assistant", "content": "前の会話の続き"},
+        {"role": "user", "content": "質問"},
+        {"role": "assistant", "content": "回答"},
+    ]
+    messages, _ = assemble_messages("今の質問", None, history)
+
+    assert messages[1:-1] == history[1:]
+
+
+def test_summary_and_unanswered_question_are_their_own_turns():
+    history = [
+        {"role": "system", "content": "これまでの会話の要約"},
+        {"role": "user", "content": "答えのなかった質問"},
+        {"role": "user", "content": "質問"},
+        {"role": "assistant", "content": "回答"},
+    ]
+    messages, _ = assemble_messages("今の質問", None, history)
+    assert messages[1:-1] == history
+
+    # 予算が足りなければ古いもの（要約）から落とす
+    budget = _budget("今の質問", history[1:])
+    messages, usage = assemble_messages("今の質問", None, history, max_tokens=budget)
+    assert messages[1:-1] == history[1:]
+    assert usage.history_dropped == 1
@@ -0,0 +1,74 @@
+# backend/tests/test_refresh_tokens.py
+# リフレッシュトークンの使い回し：猶予時間内は失敗だけ、過ぎたらログイン（family）ごと無効
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.auth_token import RefreshToken
+from app.models.user import User
+from app.services import auth_service, token_revocation
+
+
+@pytest.fixture
+def tokens(db):
+    user = User(email="taro@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return auth_service.issue_tokens(db, user.id, user.email)
+
+
+def _age_old_token(db, raw, seconds):
+    revoked_at = datetime.utcnow() - timedelta(seconds=seconds)
+    db.query(RefreshToken).filter(
+        RefreshToken.token_hash == auth_service._hash_refresh_token(raw)
+    ).update({RefreshToken.revoked_at: revoked_at})
+    db.commit()
+
+
+def test_rotate_issues_new_pair_in_same_family(db, tokens):
+    rotated = auth_service.rotate_refresh_token(db, tokens["refresh_token"])
+
+    assert rotated is not None
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+    old, new = db.query(RefreshToken).order_by(RefreshToken.id).all()
+    assert old.revoked_at is not None
+    assert old.replaced_by == new.id
+    assert old.family_id == new.family_id
+    assert new.revoked_at is None
+
+
+def test_reuse_within_grace_only_fails(db, tokens):
+    rotated = auth_service.rotate_refresh_token(db, tokens["refresh_token"])
+
+    # 別のタブが同時に古いトークンを使った（猶予時間内）
+    assert auth_service.rotate_refresh_token(db, tokens["refresh_token"]) is None
+    family_id = db.query(RefreshToken.family_id).first().family_id
+    assert not token_revocation.is_revoked(token_revocation.family_key(family_id))
+    # 新しいトークンはそのまま使える
+    assert auth_service.rotate_refresh_token(db, rotated["refresh_token"]) is not None
+
+
+def test_reuse_after_grace_revokes_family(db, tokens):
+    rotated = auth_service.rotate_refresh_token(db, tokens["refresh_token"])
+    _age_old_token(db, tokens["refresh_token"], auth_service.REFRESH_REUSE_GRACE_SECONDS + 1)
+
+    assert auth_service.rotate_refresh_token(db, tokens["refresh_token"]) is None
+    family_id = db.query(RefreshToken.family_id).first().family_id
+    assert token_revocation.is_revoked(token_revocation.family_key(family_id))
+    assert db.query(RefreshToken).filter(RefreshToken.revoked_at.is_(None)).count() == 0
+    # 盗まれたかもしれないので、新しいトークンも使えない
+    assert auth_service.rotate_refresh_token(db, rotated["refresh_token"]) is None
+
+
+def test_unknown_expired_and_inactive(db, tokens):
+    assert auth_service.rotate_refresh_token(db, "no-such-token") is None
+
+    db.query(RefreshToken).update({RefreshToken.expires_at: datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    assert auth_service.rotate_refresh_token(db, tokens["refresh_token"]) is None
+
+    db.query(RefreshToken).update({RefreshToken.expires_at: datetime.utcnow() + timedelta(days=1)})
+    db.query(User).update({User.is_active: False})
+    db.commit()
+    assert auth_service.rotate_refresh_token(db, tokens["refresh_token"]) is None
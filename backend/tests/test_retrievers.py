@@ -0,0 +1,34 @@
+# backend/tests/test_retrievers.py
+# 検索の実装の選び方（KNOWLEDGE_RETRIEVER=auto）と、実装のインターフェイス
+
+import pytest
+
+from app.services import retrievers
+from app.services.embeddings import HashingEmbedder
+
+
+class _SemanticEmbedder(HashingEmbedder):
+    semantic = True
+
+
+def test_auto_uses_bm25_without_semantic_embedder(monkeypatch):
+    monkeypatch.setattr(retrievers, "KNOWLEDGE_RETRIEVER", "auto")
+    monkeypatch.setattr(retrievers, "get_embedder", HashingEmbedder)
+
+    assert retrievers.get_retriever().name == "bm25"
+
+
+def test_auto_uses_hybrid_with_semantic_embedder(monkeypatch):
+    monkeypatch.setattr(retrievers, "KNOWLEDGE_RETRIEVER", "auto")
+    monkeypatch.setattr(retrievers, "get_embedder", _SemanticEmbedder)
+
+    assert retrievers.get_retriever().name == "hybrid"
+    assert retrievers.get_retriever("bm25").name == "bm25"
+
+
+def test_retriever_without_search_cannot_be_created():
+    class NoSearch(retrievers.Retriever):
+        name = "none"
+
+    with pytest.raises(TypeError):
+        NoSearch()
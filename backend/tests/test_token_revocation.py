@@ -0,0 +1,70 @@
+# backend/tests/test_token_revocation.py
+# 無効リストの同期：コミットの順が前後して後から見えた id も読む（IdGaps）
+
+import time
+from datetime import datetime, timedelta
+
+from app.models.auth_token import RevokedToken
+from app.services import token_revocation
+from app.services.id_gaps import IdGaps
+
+
+def _insert(db, id_, key):
+    db.add(RevokedToken(id=id_, key=key, expires_at=datetime.utcnow() + timedelta(minutes=5)))
+    db.commit()
+
+
+def test_sync_reads_ids_committed_out_of_order(db):
+    # id 2 が先にコミットされ、id 1 は後から見える
+    _insert(db, 2, "j:second")
+    token_revocation.sync_revocations(db, force=True)
+    assert token_revocation.is_revoked("j:second")
+    assert token_revocation.get_stats()["id_gaps"] == 1
+
+    _insert(db, 1, "j:first")
+    token_revocation.sync_revocations(db, force=True)
+    assert token_revocation.is_revoked("j:first")
+    assert token_revocation.get_stats()["id_gaps"] == 0
+
+
+def test_sync_reads_only_new_rows_and_gaps(db):
+    _insert(db, 1, "j:a")
+    _insert(db, 3, "j:c")
+    token_revocation.sync_revocations(db, force=True)
+    assert token_revocation.get_stats()["last_id"] == 3
+
+    _insert(db, 4, "j:d")
+    _insert(db, 2, "j:b")
+    token_revocation.sync_revocations(db, force=True)
+    assert token_revocation.is_revoked("j:b")
+    assert token_revocation.is_revoked("j:d")
+    assert not token_revocation.is_revoked("j:e")
+    assert token_revocation.get_stats()["id_gaps"] == 0
+
+
+def test_id_gaps_remembers_missing_ids():
+    gaps = IdGaps()
+    gaps.update(0, [1, 4])
+    assert gaps.pending() == [2, 3]
+
+    gaps.update(4, [3, 5])
+    assert gaps.pending() == [2]
+
+
+def test_id_gaps_range_and_limit():
+    gaps = IdGaps(limit=3)
+    gaps.update(0, [], upto=2)
+    assert gaps.pending() == [1, 2]
+
+    # 大きく飛んだときは新しい方だけ覚える（上限を超えた分は古いものから捨てる）
+    gaps.update(2, [10])
+    assert gaps.pending() == [2, 8, 9]
+
+
+def test_id_gaps_give_up_after_timeout():
+    gaps = IdGaps(timeout=0.01)
+    gaps.update(0, [2])
+    assert gaps.pending() == [1]
+    time.sleep(0.02)
+    assert gaps.pending() == []
+    assert len(gaps) == 0
@@ -0,0 +1,78 @@
+# backend/tools/bench_ann.py
+# IVF（近似）と全件計算（正確）の比較：recall@k と 1 クエリあたりの時間
+#
+# - 埋め込みは乱数のクラスタ（似た文書がまとまっている状態に近づける）
+# - クエリは既存の行に少しノイズを足したもの
+# - 中心を使い回して振り分け直す場合（まとめ直し）の時間も出す
+#
+# 使い方（backend/ で実行）:
+#   python -m tools.bench_ann                 # 200,000 件、384 次元
+#   python -m tools.bench_ann 1000000         # 件数を指定
+#   EMBEDDING_DIM=512 python -m tools.bench_ann
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from app.services.ann_index import IvfIndex, top_k_indices
+
+CHUNKS = 200_000
+DIM = int(os.getenv("EMBEDDING_DIM", "384"))
+CLUSTERS = 2_000
+QUERIES = 200
+TOP_K = 10
+NPROBES = (1, 4, 8, 16, 32, 64)
+SEED = 42
+
+
+def clustered_matrix(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.standard_normal((CLUSTERS, dim), dtype=np.float32)
+    mat = np.empty((n, dim), dtype=np.float32)
+    step = 100_000
+    for i in range(0, n, step):
+        m = min(step, n - i)
+        block = centers[rng.integers(0, CLUSTERS, m)]
+        block += 0.8 * rng.standard_normal((m, dim), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        mat[i:i + m] = block
+    return mat
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else CHUNKS
+    rng = np.random.default_rng(SEED)
+    mat = clustered_matrix(n, DIM, rng)
+
+    noise = rng.standard_normal((QUERIES, DIM), dtype=np.float32) / DIM ** 0.5
+    queries = mat[rng.integers(0, n, QUERIES)] + 0.5 * noise
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    exact = [set(top_k_indices(mat @ q, TOP_K).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) / QUERIES * 1000
+    print(f"corpus: {n} chunks, dim={DIM}, top_k={TOP_K}")
+    print(f"{'exact':<14} recall@{TOP_K} 1.000  {exact_ms:8.2f} ms / query")
+
+    start = time.perf_counter()
+    ivf = IvfIndex.build(mat)
+    print(f"{'IVF build':<14} nlist={ivf.nlist}  {(time.perf_counter() - start):8.2f} s (k-means + assign)")
+
+    start = time.perf_counter()
+    IvfIndex.build(mat, ivf.centroids, ivf.trained_on)
+    print(f"{'IVF rebuild':<14} {'':<11} {(time.perf_counter() - start):8.2f} s (reuse centroids)")
+
+    for nprobe in NPROBES:
+        hits = 0
+        start = time.perf_counter()
+        results = [ivf.search(mat, q, TOP_K, nprobe)[0] for q in queries]
+        per_query = (time.perf_counter() - start) / QUERIES * 1000
+        for got, want in zip(results, exact):
+            hits += len(want & set(got.tolist()))
+        recall = hits / (QUERIES * TOP_K)
+        print(f"{'nprobe=' + str(nprobe):<14} recall@{TOP_K} {recall:5.3f}  {per_query:8.2f} ms / query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# backend/tools/bench_knowledge_search.py
+# ナレッジ検索のマイクロベンチマーク（旧：全行スキャン / 新：前計算 + 転置インデックス）
+#
+# 使い方（backend/ で実行）:
+#   python -m tools.bench_knowledge_search            # 100,000 行
+#   python -m tools.bench_knowledge_search 300000     # 行数を指定
+
+import random
+import sys
+import time
+from typing import List
+
+from app.services import knowledge_service as ks
+from app.services.knowledge_index import KnowledgeSnapshot, Segment, normalize_text
+
+LINES = 100_000
+REPEAT = 5
+SEED = 42
+
+QUERIES = [
+    "代表取締役は誰ですか？",
+    "人材派遣の料金を教えてください",
+    "IT教室はどこで運営していますか",
+    "国際イベントの開催実績",
+]
+
+# 日本語の文書っぽい文字分布（助詞・かなを多めに）
+_KANA = "のはをにがでとてしたるいうかすなまもやらりれろです"
+_KANJI = "代表取締役会社紹介開発人材派遣教室運営国際事業部署営業経理総務技術料金実績場所"
+_ALPHABET = _KANA * 3 + _KANJI + "abcdefgXYZ0123 、。"
+
+
+def make_corpus(n: int) -> List[str]:
+    rnd = random.Random(SEED)
+    return [
+        "".join(rnd.choice(_ALPHABET) for _ in range(rnd.randint(5, 80)))
+        for _ in range(n)
+    ]
+
+
+def legacy_scan(lines: List[str], query: str) -> List[tuple[float, int]]:
+    """変更前の get_relevant_context のスコア計算（毎回全行を正規化）"""
+    chars = list(dict.fromkeys(normalize_text(query)))
+    scored: List[tuple[float, int]] = []
+    for idx, line in enumerate(lines):
+        line_norm = normalize_text(line)
+        if not line_norm:
+            continue
+        raw_score = sum(1 for c in chars if c in line_norm)
+        if raw_score == 0:
+            continue
+        scored.append((raw_score / (max(5, len(line_norm)) ** 0.5), idx))
+    return scored
+
+
+def indexed_scan(seg: Segment, query: str) -> List[tuple[float, int]]:
+    """変更後のスコア計算（get_relevant_context と同じ処理）"""
+    chars = list(dict.fromkeys(normalize_text(query)))
+    hits = {}
+    for c in chars:
+        for idx in seg.postings.get(c, ()):
+            hits[idx] = hits.get(idx, 0) + 1
+    return [(raw / seg.denoms[idx], idx) for idx, raw in hits.items()]
+
+
+def bench(label: str, fn) -> float:
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for q in QUERIES:
+            fn(q)
+    per_query = (time.perf_counter() - start) / (REPEAT * len(QUERIES)) * 1000
+    print(f"{label:<28} {per_query:8.2f} ms / query")
+    return per_query
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else LINES
+    lines = make_corpus(n)
+    print(f"corpus: {n} lines, {sum(len(l) for l in lines)} chars")
+
+    start = time.perf_counter()
+    seg = Segment.build([("bench", "\n".join(lines))])
+    print(f"{'index build (reload)':<28} {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+    ks._SNAPSHOT = KnowledgeSnapshot.from_segment(seg, 1)
+
+    # 結果が変わっていないことを先に確認
+    for q in QUERIES:
+        assert sorted(legacy_scan(lines, q)) == sorted(indexed_scan(seg, q)), q
+
+    before = bench("before: full line scan", lambda q: legacy_scan(lines, q))
+    after = bench("after: precomputed index", lambda q: indexed_scan(seg, q))
+    bench("get_relevant_context(top_k=30)", lambda q: ks.get_relevant_context(q, top_k=30))
+    bench("build_context", lambda q: ks.build_context(q))
+    print(f"speedup: x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    main()
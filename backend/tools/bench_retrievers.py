@@ -0,0 +1,92 @@
+# backend/tools/bench_retrievers.py
+# 検索の実装（legacy / bm25）の精度と速度を比べる
+#
+# - 合成した文書（見出し + 段落）から正解のチャンクを 1 つ選び、
+#   その中の語 2 つに「について教えてください」などを付けた質問を作る
+# - 正解のチャンクが上位 k 件に入るか（hit@k）と MRR、1 クエリあたりの時間を出す
+#
+# 使い方（backend/ で実行）:
+#   python -m tools.bench_retrievers              # 文書 2,000 件
+#   python -m tools.bench_retrievers 10000        # 文書数を指定
+
+import random
+import sys
+import time
+from typing import List, Tuple
+
+from app.services.knowledge_index import KnowledgeSnapshot, Segment
+from app.services.retrievers import RETRIEVERS, bm25_index
+
+DOCS = 2_000
+QUERIES = 200
+SEED = 42
+KS = (1, 3, 10)
+
+_KANJI = "代表取締役会社紹介開発人材派遣教室運営国際事業部署営業経理総務技術料金実績場所契約期間申込方法担当窓口研修制度福利厚生"
+_PARTICLES = ["の", "は", "を", "に", "が", "で", "と", "です。", "ます。", "について、"]
+_TEMPLATES = ["{}の{}について教えてください", "{}と{}はどうなっていますか？", "{}で{}を知りたいです"]
+
+
+def make_docs(n: int, rnd: random.Random) -> Tuple[List[Tuple[str, str]], List[str]]:
+    vocab = list({"".join(rnd.choice(_KANJI) for _ in range(rnd.randint(2, 4))) for _ in range(5000)})
+    docs = []
+    for d in range(n):
+        parts = []
+        for s in range(rnd.randint(1, 3)):
+            parts.append(f"# {rnd.choice(vocab)}{rnd.choice(vocab)}")
+            for _ in range(rnd.randint(1, 3)):
+                line = "".join(rnd.choice(vocab) + rnd.choice(_PARTICLES) for _ in range(rnd.randint(3, 12)))
+                parts.append(line + "\n")
+        docs.append((f"bench:{d}", "\n".join(parts)))
+    return docs, vocab
+
+
+def make_queries(seg: Segment, vocab: List[str], rnd: random.Random) -> List[Tuple[str, int]]:
+    out = []
+    n_chunks = len(seg.chunk_starts)
+    while len(out) < QUERIES:
+        c = rnd.randrange(n_chunks)
+        words = [w for w in vocab if w in seg.chunk_text(c)]
+        if len(words) < 2:
+            continue
+        a, b = rnd.sample(words, 2)
+        out.append((rnd.choice(_TEMPLATES).format(a, b), c))
+    return out
+
+
+def evaluate(name: str, snap: KnowledgeSnapshot, queries: List[Tuple[str, int]]) -> None:
+    retriever = RETRIEVERS[name]
+    hits = {k: 0 for k in KS}
+    rr = 0.0
+    start = time.perf_counter()
+    for q, target in queries:
+        ranked = [c for _, _, c in retriever.search(snap, q, max(KS))]
+        if target in ranked:
+            rank = ranked.index(target) + 1
+            rr += 1 / rank
+            for k in KS:
+                hits[k] += rank <= k
+    per_query = (time.perf_counter() - start) / len(queries) * 1000
+    cols = "  ".join(f"hit@{k} {hits[k] / len(queries):5.2f}" for k in KS)
+    print(f"{name:<8} {cols}  MRR {rr / len(queries):5.3f}  {per_query:7.2f} ms / query")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DOCS
+    rnd = random.Random(SEED)
+    docs, vocab = make_docs(n, rnd)
+    seg = Segment.build(docs)
+    snap = KnowledgeSnapshot.from_segment(seg, 1)
+    print(f"corpus: {n} docs, {len(seg)} lines, {len(seg.chunk_starts)} chunks")
+
+    start = time.perf_counter()
+    bm25_index(seg)
+    print(f"{'bm25 index build':<28} {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+    queries = make_queries(seg, vocab, rnd)
+    for name in RETRIEVERS:
+        evaluate(name, snap, queries)
+
+
+if __name__ == "__main__":
+    main()
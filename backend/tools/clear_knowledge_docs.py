@@ -3,6 +3,9 @@ import sqlite3
 conn = sqlite3.connect("eden_teacher.db")
 cur = conn.cursor()
 cur.execute("DELETE FROM knowledge_docs")
+cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='knowledge_doc_parts'")
+if cur.fetchone():
+    cur.execute("DELETE FROM knowledge_doc_parts")
 conn.commit()
 print("knowledge_docs を全削除しました。")
 cur.close()
@@ -1,55 +1,114 @@
-# backend/migrate_knowledge_docs.py
-# SQLite の knowledge_docs に不足カラムを追加（データは保持）
+# backend/tools/migrate_knowledge_docs.py
+# 既存の knowledge_docs に不足カラムを追加（データは保持）
+#
+# - DATABASE_URL の DB（SQLite / PostgreSQL どちらも）に SQLAlchemy で接続する
+# - 新しいテーブル（knowledge_jobs / knowledge_events / knowledge_doc_parts など）は create_all で作る
+# - デプロイ前（新しいコードのサーバーを起動する前）に 1 回実行する。何度実行してもよい
+#   Run from `backend/`: `python -m tools.migrate_knowledge_docs`
 
-import sqlite3
+import hashlib
 
-DB_PATH = "eden_teacher.db"
+from sqlalchemy import inspect, text
 
-def has_column(cur, table: str, col: str) -> bool:
-    cur.execute(f"PRAGMA table_info({table})")
-    cols = [r[1] for r in cur.fetchall()]
-    return col in cols
+from app.db import Base, engine, is_sqlite
+from app.models import auth_token, conversation, knowledge, user  # noqa: F401  モデル登録用
 
-def add_column(cur, table: str, ddl: str):
-    cur.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+TABLE = "knowledge_docs"
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    table = "knowledge_docs"
-    # 既に存在する前提：なければここで気づける
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
-    if not cur.fetchone():
-        print(f"Table not found: {table}")
-        return
-
-    # 追加したいカラム（SQLite は ADD COLUMN のみ対応）
-    # Boolean は INTEGER で持つのが無難
-    targets = [
-        ("is_active", "is_active INTEGER NOT NULL DEFAULT 1"),
-        ("status", "status TEXT NOT NULL DEFAULT 'ready'"),
+
+def column_targets():
+    """追加したいカラム（SQLite は ADD COLUMN のみ対応なので、NOT NULL には既定値を付ける）"""
+    datetime_type = "TEXT" if is_sqlite else "TIMESTAMP"
+    bool_type = "INTEGER NOT NULL DEFAULT 1" if is_sqlite else "BOOLEAN NOT NULL DEFAULT TRUE"
+    return [
+        ("is_active", f"is_active {bool_type}"),
+        ("status", "status VARCHAR NOT NULL DEFAULT 'ready'"),
         ("chunk_count", "chunk_count INTEGER NOT NULL DEFAULT 0"),
         ("error_message", "error_message TEXT"),
-        ("updated_at", "updated_at TEXT"),
+        ("content_hash", "content_hash VARCHAR(64)"),
+        ("part_count", "part_count INTEGER NOT NULL DEFAULT 0"),
+        ("updated_at", f"updated_at {datetime_type}"),
     ]
 
-    for col, ddl in targets:
-        if has_column(cur, table, col):
+
+def add_columns(conn) -> None:
+    cols = {c["name"] for c in inspect(conn).get_columns(TABLE)}
+    for col, ddl in column_targets():
+        if col in cols:
             print(f"Skip: {col} already exists")
         else:
             print(f"Add: {col}")
-            add_column(cur, table, ddl)
+            conn.execute(text(f"ALTER TABLE {TABLE} ADD COLUMN {ddl}"))
 
-    conn.commit()
 
-    # 確認
-    cur.execute(f"PRAGMA table_info({table})")
-    print(cur.fetchall())
+def full_content(conn, doc_id: int, content: str, part_count: int) -> str:
+    """本文（長い文書は knowledge_doc_parts の続きも合わせる）"""
+    if not part_count:
+        return content or ""
+    rows = conn.execute(
+        text("SELECT content FROM knowledge_doc_parts WHERE doc_id = :id ORDER BY seq"),
+        {"id": doc_id},
+    )
+    return (content or "") + "".join(r[0] for r in rows)
+
+
+def backfill_content_hash(conn) -> None:
+    """
+    content_hash が NULL の文書に本文の sha256 を埋め、ユニークインデックスを作る
+    - 同じ内容の文書が既に複数ある場合、2 件目以降は NULL のまま（管理画面で削除する）
+    """
+    seen = {
+        r[0] for r in conn.execute(text(f"SELECT content_hash FROM {TABLE} WHERE content_hash IS NOT NULL"))
+    }
+    ids = [
+        r[0] for r in conn.execute(text(f"SELECT id FROM {TABLE} WHERE content_hash IS NULL ORDER BY id"))
+    ]
+
+    # 本文は 1 件ずつ読む（全件をまとめてメモリに載せない）
+    updates = []
+    for doc_id in ids:
+        name, content, part_count = conn.execute(
+            text(f"SELECT original_name, content, part_count FROM {TABLE} WHERE id = :id"),
+            {"id": doc_id},
+        ).one()
+        digest = hashlib.sha256(full_content(conn, doc_id, content, part_count).encode("utf-8")).hexdigest()
+        if digest in seen:
+            print(f"Duplicate content (kept NULL): id={doc_id} {name}")
+            continue
+        seen.add(digest)
+        updates.append({"h": digest, "id": doc_id})
+    if updates:
+        conn.execute(text(f"UPDATE {TABLE} SET content_hash = :h WHERE id = :id"), updates)
+    print(f"Backfill content_hash: {len(updates)} rows")
 
-    cur.close()
-    conn.close()
+    # 以前の（ユニークでない）インデックスを作り直す
+    index_name = f"ix_{TABLE}_content_hash"
+    for ix in inspect(conn).get_indexes(TABLE):
+        if ix["name"] == index_name and not ix["unique"]:
+            print(f"Drop non-unique index: {index_name}")
+            conn.execute(text(f"DROP INDEX {index_name}"))
+    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {TABLE} (content_hash)"))
+
+
+def main():
+    print(f"Database: {engine.url.render_as_string(hide_password=True)}")
+    if not inspect(engine).has_table(TABLE):
+        # 無ければ create_all で新しく作るだけ
+        print(f"Table not found: {TABLE} (create_all で作成します)")
+    else:
+        # カラム追加 → 続きのテーブル（knowledge_doc_parts）が無ければ先に作る → content_hash
+        with engine.begin() as conn:
+            add_columns(conn)
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            backfill_content_hash(conn)
+
+    Base.metadata.create_all(bind=engine)
+
+    # 確認
+    print([c["name"] for c in inspect(engine).get_columns(TABLE)])
     print("Done.")
 
+
 if __name__ == "__main__":
     main()
@@ -1,7 +1,7 @@
 # migrate_sqlite_to_postgres.py
 
 import os
-from sqlalchemy import create_engine, MetaData, Table, select, text
+from sqlalchemy import create_engine, inspect, MetaData, Table, select, text
 
 # 1) 本地 SQLite
 SQLITE_URL = "sqlite:///./eden_teacher.db"
@@ -31,6 +31,11 @@ sqlite_meta.reflect(bind=sqlite_engine, only=["users", "knowledge_docs"])
 sqlite_users = Table("users", sqlite_meta, autoload_with=sqlite_engine)
 sqlite_knowledge = Table("knowledge_docs", sqlite_meta, autoload_with=sqlite_engine)
 
+# 长文档正文的后续部分（旧的 SQLite 里可能没有这个表）
+sqlite_parts = None
+if inspect(sqlite_engine).has_table("knowledge_doc_parts"):
+    sqlite_parts = Table("knowledge_doc_parts", sqlite_meta, autoload_with=sqlite_engine)
+
 
 def create_tables_in_postgres():
     """在 Postgres 中手动建 users 和 knowledge_docs 表（如果不存在）"""
@@ -55,15 +60,30 @@ def create_tables_in_postgres():
         content_type VARCHAR,
         content TEXT NOT NULL,
         status VARCHAR NOT NULL,
+        chunk_count INTEGER NOT NULL DEFAULT 0,
+        error_message TEXT,
+        content_hash VARCHAR(64) UNIQUE,
+        part_count INTEGER NOT NULL DEFAULT 0,
         created_at TIMESTAMP,
         updated_at TIMESTAMP
     );
     """)
 
+    create_parts_sql = text("""
+    CREATE TABLE IF NOT EXISTS knowledge_doc_parts (
+        id INTEGER PRIMARY KEY,
+        doc_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        CONSTRAINT uq_knowledge_doc_parts_doc_seq UNIQUE (doc_id, seq)
+    );
+    """)
+
     with pg_engine.begin() as conn:
         conn.execute(create_users_sql)
         conn.execute(create_knowledge_sql)
-        print("Postgres 中已确保存在 users / knowledge_docs 表。")
+        conn.execute(create_parts_sql)
+        print("Postgres 中已确保存在 users / knowledge_docs / knowledge_doc_parts 表。")
 
 
 def migrate():
@@ -109,6 +129,10 @@ def migrate():
                 "content_type": row["content_type"],
                 "content": row["content"],
                 "status": row["status"],
+                "chunk_count": row.get("chunk_count") or 0,
+                "error_message": row.get("error_message"),
+                "content_hash": row.get("content_hash"),
+                "part_count": row.get("part_count") or 0,
                 "created_at": row["created_at"],
                 "updated_at": row["updated_at"],
             }
@@ -116,15 +140,30 @@ def migrate():
                 INSERT INTO knowledge_docs (
                     id, original_name, stored_name, size,
                     content_type, content, status,
+                    chunk_count, error_message, content_hash, part_count,
                     created_at, updated_at
                 )
                 VALUES (
                     :id, :original_name, :stored_name, :size,
                     :content_type, :content, :status,
+                    :chunk_count, :error_message, :content_hash, :part_count,
                     :created_at, :updated_at
                 )
             """), data)
 
+        # ---- knowledge_doc_parts ----
+        if sqlite_parts is not None:
+            p_conn.execute(text("DELETE FROM knowledge_doc_parts;"))
+            count = 0
+            # 一行一行地读，长文档的正文不会一次性全部载入内存
+            for row in s_conn.execute(select(sqlite_parts)).mappings().yield_per(100):
+                p_conn.execute(text("""
+                    INSERT INTO knowledge_doc_parts (id, doc_id, seq, content)
+                    VALUES (:id, :doc_id, :seq, :content)
+                """), dict(row))
+                count += 1
+            print(f"已迁移 knowledge_doc_parts 表 {count} 行")
+
     print("迁移完成！")
 
 
@@ -8,7 +8,7 @@ import AdminView, { type AdminTab } from "./components/admin/AdminView";
 import SettingsView from "./components/settings/SettingsView";
 
 import type { Message, View, Theme, AuthMode } from "./types";
-import { apiAsk, apiLogin, apiRegister, apiMe } from "./lib/api";
+import { apiAsk, apiLogin, apiLogout, apiRegister, apiMe, clearTokens } from "./lib/api";
 import type { MeResponse } from "./lib/api";
 
 /**
@@ -22,6 +22,8 @@ const App: React.FC = () => {
   // ================= チャット関連 =================
   const [question, setQuestion] = useState("");
   const [messages, setMessages] = useState<Message[]>([]);
+  // サーバー側に保存している会話（最初の質問で作られる）
+  const [conversationId, setConversationId] = useState<number | null>(null);
   const [loading, setLoading] = useState(false);
   const [subject, setSubject] = useState("プログラミング");
   const [error, setError] = useState<string | null>(null);
@@ -72,7 +74,7 @@ const App: React.FC = () => {
         setMe(null);
         setIsLoggedIn(false);
         setToken(null);
-        localStorage.removeItem("eden_token");
+        clearTokens();
       }
     })();
   }, [token]);
@@ -94,13 +96,13 @@ const App: React.FC = () => {
     setLoading(true);
 
     try {
-      const historyPayload = newMessages.map((m) => ({ role: m.role, content: m.content }));
       const data = await apiAsk({
         token,
         question: trimmed,
         subject,
-        history: historyPayload,
+        conversationId,
       });
+      setConversationId(data.conversation_id);
       setMessages((prev) => [...prev, { role: "assistant", content: data.answer }]);
     } catch (e: any) {
       setError(e.message || "リクエスト失敗");
@@ -130,7 +132,6 @@ const App: React.FC = () => {
       const accessToken = await apiLogin(authEmail, authPassword);
       setToken(accessToken);
       setIsLoggedIn(true);
-      localStorage.setItem("eden_token", accessToken);
 
       // ✅ ログイン直後に /me を取得して role を確定
       const meData = await apiMe(accessToken);
@@ -140,7 +141,7 @@ const App: React.FC = () => {
       if (loginType === "admin") {
         if (meData.role !== "admin") {
           setAuthError("管理者権限がありません。");
-          localStorage.removeItem("eden_token");
+          void apiLogout();
           setIsLoggedIn(false);
           setToken(null);
           setMe(null);
@@ -162,13 +163,14 @@ const App: React.FC = () => {
     setIsLoggedIn(false);
     setToken(null);
     setMe(null);
-    localStorage.removeItem("eden_token");
+    void apiLogout();
 
     setAuthMode("login");
     setLoginType("user");
     setActiveView("chat");
     setSidebarOpen(false);
     setMessages([]);
+    setConversationId(null);
   };
 
   // ================= メイン描画 =================
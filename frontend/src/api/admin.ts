@@ -1,5 +1,5 @@
 // frontend/src/api/admin.ts
-import { API_BASE } from "../lib/api";
+import { API_BASE, authFetch } from "../lib/api";
 
 function getToken(): string | null {
   return localStorage.getItem("eden_token");
@@ -21,7 +21,7 @@ async function request<T>(path: string, init?: RequestInit): Promise<T> {
 
   if (token) headers["Authorization"] = `Bearer ${token}`;
 
-  const res = await fetch(`${API_BASE}${path}`, {
+  const res = await authFetch(`${API_BASE}${path}`, {
     ...init,
     headers,
     cache: "no-store",
@@ -1,7 +1,7 @@
 // src/api/knowledge.ts
 // 管理者向け：ナレッジ文書 API
 
-import { API_BASE } from "../lib/api";
+import { API_BASE, authFetch } from "../lib/api";
 
 export type KnowledgeDocItem = {
   id: number;
@@ -9,6 +9,9 @@ export type KnowledgeDocItem = {
   stored_name: string;
   size: number;
   content_type?: string | null;
+  status?: "pending" | "indexing" | "ready" | "error" | string;
+  chunk_count?: number;
+  error_message?: string | null;
   created_at?: string | null;
 };
 
@@ -17,18 +20,26 @@ function authHeaders(token: string) {
 }
 
 export async function apiKnowledgeList(token: string): Promise<KnowledgeDocItem[]> {
-  const res = await fetch(`${API_BASE}/admin/knowledge`, {
-    headers: { ...authHeaders(token) },
-  });
-  if (!res.ok) throw new Error(await res.text());
-  return res.json();
+  // サーバーはページ単位で返す（続きがあれば X-Next-Cursor ヘッダ）
+  const items: KnowledgeDocItem[] = [];
+  let cursor: string | null = null;
+  do {
+    const query: string = cursor ? `?limit=500&cursor=${cursor}` : "?limit=500";
+    const res: Response = await authFetch(`${API_BASE}/admin/knowledge${query}`, {
+      headers: { ...authHeaders(token) },
+    });
+    if (!res.ok) throw new Error(await res.text());
+    items.push(...((await res.json()) as KnowledgeDocItem[]));
+    cursor = res.headers.get("X-Next-Cursor");
+  } while (cursor);
+  return items;
 }
 
 export async function apiKnowledgeUpload(token: string, file: File) {
   const fd = new FormData();
   fd.append("file", file);
 
-  const res = await fetch(`${API_BASE}/admin/knowledge/upload`, {
+  const res = await authFetch(`${API_BASE}/admin/knowledge/upload`, {
     method: "POST",
     headers: { ...authHeaders(token) }, // multipart のとき Content-Type は付けない
     body: fd,
@@ -38,7 +49,7 @@ export async function apiKnowledgeUpload(token: string, file: File) {
 }
 
 export async function apiKnowledgeDelete(token: string, docId: number) {
-  const res = await fetch(`${API_BASE}/admin/knowledge/${docId}`, {
+  const res = await authFetch(`${API_BASE}/admin/knowledge/${docId}`, {
     method: "DELETE",
     headers: { ...authHeaders(token) },
   });
@@ -47,7 +58,7 @@ export async function apiKnowledgeDelete(token: string, docId: number) {
 }
 
 export async function apiKnowledgeReload(token: string) {
-  const res = await fetch(`${API_BASE}/admin/knowledge/reload`, {
+  const res = await authFetch(`${API_BASE}/admin/knowledge/reload`, {
     method: "POST",
     headers: { ...authHeaders(token) },
   });
@@ -8,7 +8,7 @@ import {
   apiKnowledgeReload,
   type KnowledgeDocItem,
 } from "../../api/knowledge";
-import { API_BASE } from "../../lib/api";
+import { API_BASE, authFetch } from "../../lib/api";
 
 export type AdminTab = "knowledge" | "users" | "system";
 
@@ -168,7 +168,7 @@ const AdminView: React.FC<AdminViewProps> = ({ token, adminTab, setAdminTab }) =
             </p>
 
             <div className="upload-row">
-              <input type="file" accept=".txt,.md,.markdown" onChange={(e) => setSelectedFile(e.target.files?.[0] || null)} />
+              <input type="file" accept=".txt,.md,.markdown,.pdf,.docx,.html,.htm" onChange={(e) => setSelectedFile(e.target.files?.[0] || null)} />
               <button className="primary-btn" onClick={onUpload} disabled={!selectedFile || uploading}>
                 {uploading ? "アップロード中..." : "アップロード"}
               </button>
@@ -267,7 +267,7 @@ const AdminView: React.FC<AdminViewProps> = ({ token, adminTab, setAdminTab }) =
                               return;
                             }
 
-                            const res = await fetch(`${API_BASE}/admin/users/${u.id}/role`, {
+                            const res = await authFetch(`${API_BASE}/admin/users/${u.id}/role`, {
                               method: "PATCH",
                               headers: {
                                 "Content-Type": "application/json",
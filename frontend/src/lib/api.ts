@@ -14,6 +14,69 @@ export const API_BASE =
     ? REMOTE_API
     : LOCAL_API;
 
+// ================= トークン =================
+// アクセストークンは短時間で切れるので、401 のときはリフレッシュトークンで取り直して 1 回だけやり直す
+const TOKEN_KEY = "eden_token";
+const REFRESH_KEY = "eden_refresh_token";
+
+function saveTokens(data: { access_token: string; refresh_token?: string | null }) {
+  localStorage.setItem(TOKEN_KEY, data.access_token);
+  if (data.refresh_token) localStorage.setItem(REFRESH_KEY, data.refresh_token);
+}
+
+export function clearTokens() {
+  localStorage.removeItem(TOKEN_KEY);
+  localStorage.removeItem(REFRESH_KEY);
+}
+
+// 同時に 401 になったリクエストでも、取り直しは 1 回だけ（リフレッシュトークンは 1 回しか使えない）
+let refreshing: Promise<string | null> | null = null;
+
+export function refreshAccessToken(): Promise<string | null> {
+  if (!refreshing) {
+    refreshing = (async () => {
+      const refreshToken = localStorage.getItem(REFRESH_KEY);
+      if (!refreshToken) return null;
+      try {
+        const res = await fetch(`${API_BASE}/auth/refresh`, {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ refresh_token: refreshToken }),
+        });
+        if (!res.ok) {
+          // 別のタブが先に取り直していたら、そちらのトークンを使う
+          const latest = localStorage.getItem(REFRESH_KEY);
+          return latest && latest !== refreshToken ? localStorage.getItem(TOKEN_KEY) : null;
+        }
+        const data = await res.json();
+        saveTokens(data);
+        return data.access_token as string;
+      } catch {
+        return null;
+      } finally {
+        refreshing = null;
+      }
+    })();
+  }
+  return refreshing;
+}
+
+// 認証付きの fetch（Authorization は保存している最新のトークンを付ける）
+export async function authFetch(input: string, init: RequestInit = {}): Promise<Response> {
+  const withToken = (token: string | null): RequestInit => {
+    const headers = new Headers(init.headers);
+    if (token) headers.set("Authorization", `Bearer ${token}`);
+    return { ...init, headers };
+  };
+
+  const res = await fetch(input, withToken(localStorage.getItem(TOKEN_KEY)));
+  if (res.status !== 401) return res;
+
+  const token = await refreshAccessToken();
+  if (!token) return res;
+  return fetch(input, withToken(token));
+}
+
 export async function apiRegister(email: string, password: string, fullName?: string | null) {
   const res = await fetch(`${API_BASE}/auth/register`, {
     method: "POST",
@@ -45,16 +108,36 @@ export async function apiLogin(email: string, password: string): Promise<string>
 
   const data = await res.json();
   if (!data?.access_token) throw new Error("access_token が返ってきませんでした");
+  saveTokens(data);
   return data.access_token as string;
 }
 
+// ログアウト（このログインのトークンをサーバー側でも無効にする）
+export async function apiLogout(): Promise<void> {
+  const refreshToken = localStorage.getItem(REFRESH_KEY);
+  const token = localStorage.getItem(TOKEN_KEY);
+  clearTokens();
+  if (!token) return;
+  try {
+    await fetch(`${API_BASE}/auth/logout`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json", Authorization: `Bearer ${token}` },
+      body: JSON.stringify({ refresh_token: refreshToken }),
+    });
+  } catch {
+    // ネットワークエラーでもローカルのトークンは消してあるので、ログアウト扱い
+  }
+}
+
+// 会話の続きとして質問する（履歴はサーバー側にあるので conversation_id だけを送る）
+// - conversationId が null なら新しい会話になる（返ってきた conversation_id を次から使う）
 export async function apiAsk(params: {
   token: string;
   question: string;
   subject: string;
-  history: { role: string; content: string }[];
+  conversationId: number | null;
 }) {
-  const res = await fetch(`${API_BASE}/api/ask`, {
+  const res = await authFetch(`${API_BASE}/api/conversations/ask`, {
     method: "POST",
     headers: {
       "Content-Type": "application/json",
@@ -63,12 +146,12 @@ export async function apiAsk(params: {
     body: JSON.stringify({
       question: params.question,
       subject: params.subject,
-      history: params.history,
+      conversation_id: params.conversationId,
     }),
   });
 
   if (!res.ok) throw new Error(`HTTP ${res.status}: ${await res.text()}`);
-  return (await res.json()) as { answer: string };
+  return (await res.json()) as { conversation_id: number; answer: string };
 }
 
 export type MeResponse = {
@@ -80,7 +163,7 @@ export type MeResponse = {
 
 // ログイン中ユーザー情報
 export async function apiMe(token: string): Promise<MeResponse> {
-  const res = await fetch(`${API_BASE}/auth/me`, {
+  const res = await authFetch(`${API_BASE}/auth/me`, {
     headers: { Authorization: `Bearer ${token}` },
   });
   if (!res.ok) throw new Error(await res.text());
@@ -93,7 +176,7 @@ export async function apiChangePassword(
   currentPassword: string,
   newPassword: string
 ): Promise<{ ok: boolean }> {
-  const res = await fetch(`${API_BASE}/auth/change-password`, {
+  const res = await authFetch(`${API_BASE}/auth/change-password`, {
     method: "POST",
     headers: {
       "Content-Type": "application/json",